@@ -3,3 +3,7 @@ from .parser import *
 from .plot_utils import *
 from .utils import *
 from .sampler import sampler
+
+def __getattr__(name):
+    ### model classes are imported lazily by em_pe.models
+    return getattr(models, name)
@@ -1,20 +1,102 @@
-from .interpolated_model import *
-from .kilonova import *
-from .kilonova_3c import *
-from .kn_interp import *
-from .kn_interp_angle import *
+import os
+import glob
+import importlib
+from functools import partial
+import numpy as np
 
+from .model import model_base
 from .parameters import *
 
-model_dict = {
-        "interpolated":interpolated,
-        "kilonova":kilonova,
-        "kilonova_3c":kilonova_3c,
-        "kn_interp":kn_interp,
-        "kn_interp_angle":kn_interp_angle,
-        "kn_interp_angle_no_mej_dyn":kn_interp_angle_no_mej_dyn
+### public names defined in the model modules, which are only imported when one
+### of their names is first used (so that e.g. param_dict or the analytic models
+### do not pull in sklearn and joblib)
+_lazy_names = {
+        "interpolated":"interpolated_model",
+        "kilonova":"kilonova",
+        "kilonova_3c":"kilonova_3c",
+        "kn_interp":"kn_interp",
+        "kn_interp_angle":"kn_interp_angle",
+        "kn_interp_angle_pca":"kn_interp_angle",
+        "kn_interp_angle_no_mej_dyn":"kn_interp_angle",
+        "fit_pca_surrogate":"kn_interp_angle",
+        "remote":"model_server",
+        "tabulated":"tabulated",
+        "load_table":"tabulated",
+        "save_table":"tabulated"
 }
 
+def __getattr__(name):
+    if name in _lazy_names:
+        value = getattr(importlib.import_module("." + _lazy_names[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
+
+class _LazyModel:
+    def __init__(self, name):
+        self.name = name
+
+class _ModelDict(dict):
+    '''
+    Dictionary mapping model names to model classes (or other callables that
+    create models). Built-in models are stored as placeholders and imported on
+    first access.
+    '''
+    def __getitem__(self, name):
+        value = dict.__getitem__(self, name)
+        if isinstance(value, _LazyModel):
+            value = __getattr__(value.name)
+            dict.__setitem__(self, name, value)
+        return value
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+model_dict = _ModelDict({name:_LazyModel(name) for name in [
+        "interpolated",
+        "kilonova",
+        "kilonova_3c",
+        "kn_interp",
+        "kn_interp_angle",
+        "kn_interp_angle_pca",
+        "kn_interp_angle_no_mej_dyn",
+        "remote"
+]})
+
+def _load_tabulated(fname, *args, **kwargs):
+    from .tabulated import tabulated
+    return tabulated(fname, *args, **kwargs)
+
+def register_tabulated_model(fname, name=None):
+    '''
+    Register a lightcurve table (see scripts/tabulate_model.py) as a model in
+    model_dict.
+
+    Parameters
+    ----------
+    fname : string
+        Name of table file
+    name : string
+        Name to register the model under. Defaults to the name stored in the table.
+    '''
+    if name is None:
+        ### only the name is read here, the table itself is loaded with the model
+        with np.load(fname) as f:
+            name = str(f["name"])
+    model_dict[name] = partial(_load_tabulated, fname)
+    return name
+
+### tables in the TABLE_LOC directory are registered automatically
+if "TABLE_LOC" in os.environ:
+    for _fname in sorted(glob.glob(os.path.join(os.environ["TABLE_LOC"], "*.npz"))):
+        register_tabulated_model(_fname)
+
 param_dict = {
         "distance":Distance,
         "mej":EjectaMass,
@@ -34,5 +116,7 @@ param_dict = {
         "Tc_blue":TcBlue,
         "kappa":Kappa,
         "sigma":Sigma,
-        "theta":Theta
+        "theta":Theta,
+        "m1":ComponentMass1,
+        "m2":ComponentMass2
 }
@@ -7,13 +7,13 @@ Model interpolated from some surrogate model
 import numpy as np
 import os
 from scipy import interpolate
-from sklearn.gaussian_process import GaussianProcessRegressor
 
 from .model import model_base
 
 class interpolated(model_base):
     def __init__(self, name, param_names, bands, weight=1):
         model_base.__init__(self, name, param_names, bands, weight)
+        from sklearn.gaussian_process import GaussianProcessRegressor
         fname = os.environ["EM_PE_INSTALL_DIR"] + "/Data/" + self.name + ".npz"
         f = np.load(fname)
         self.t_interp = f["arr_0"]
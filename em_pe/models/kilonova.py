@@ -4,6 +4,38 @@ from scipy.integrate import cumtrapz
 
 from .model import model_base
 
+def _blackbody_mags(nu, R_photo, T_photo):
+    """
+    AB magnitudes (at the fiducial distance of 10 pc) of a sum of blackbody
+    photospheres.
+
+    Parameters
+    ----------
+    nu : np.ndarray
+        Frequencies, one per band
+    R_photo : list
+        Photosphere radius arrays, one per component
+    T_photo : list
+        Photosphere temperature arrays, one per component
+
+    Returns
+    -------
+    np.ndarray
+        (band x time) array of magnitudes
+    """
+    c = 2.99792458e10 # cm/s
+    h = 6.626e-27 # erg * s
+    kb = 1.38e-16 # erg/K
+    Mpc = 3.08e24 # cm
+    D = 1.0e-5 * Mpc # fiducial distance
+
+    nu = np.asarray(nu)[:,np.newaxis,np.newaxis] # (band, component, time)
+    R_photo = np.asarray(R_photo)[np.newaxis]
+    T_photo = np.asarray(T_photo)[np.newaxis]
+    B_nu = (2.0 * h * nu**3 / c**2) / np.expm1(h * nu / (kb * T_photo))
+    F_nu = np.sum(B_nu * np.pi * R_photo**2 / D**2, axis=1)
+    return -2.5 * np.log10(F_nu) - 48.6
+
 class kilonova(model_base):
     def __init__(self):
         name = "kilonova"
@@ -22,9 +54,10 @@ class kilonova(model_base):
                          [0.17, 0.21, 0.31], [0.10, 0.13, 0.15]])
         _d = np.asarray([[1.12, 1.39, 1.52], [0.86, 1.21, 1.39],
                          [0.74, 1.13, 1.32], [0.6, 0.9, 1.13]])
-        self.fa = RegularGridInterpolator((_m, _v), _a, bounds_error=False, fill_value=None)
-        self.fb = RegularGridInterpolator((_m, _v), _b, bounds_error=False, fill_value=None)
-        self.fd = RegularGridInterpolator((_m, _v), _d, bounds_error=False, fill_value=None)
+        ### the three coefficient tables share a grid, so interpolate them together
+        self.f_abd = RegularGridInterpolator((_m, _v), np.stack([_a, _b, _d], axis=-1),
+                                             bounds_error=False, fill_value=None)
+        self.coefficient_cache = {} # maps (mej, vej) pairs to precomputed coefficients
 
         self.lmbda_dict = { # dictionary of wavelengths corresponding to bands
                 "u":354.3,
@@ -43,6 +76,38 @@ class kilonova(model_base):
         self.T_photo = None
         self.distance_Mpc =None
     
+    def thermalisation_coefficients(self, mej, vej):
+        """
+        Interpolate the a, b and d thermalisation coefficients for arrays of
+        ejecta masses and velocities.
+
+        Parameters
+        ----------
+        mej : float or np.ndarray
+            Ejecta masses
+        vej : float or np.ndarray
+            Ejecta velocities
+
+        Returns
+        -------
+        np.ndarray
+            (n x 3) array of [a, b, d] coefficients
+        """
+        return self.f_abd(np.column_stack([np.atleast_1d(mej), np.atleast_1d(vej)]))
+
+    def prepare_batch(self, params):
+        """
+        Precompute the thermalisation coefficients for a batch of samples, so
+        that set_params() does not have to interpolate them one at a time.
+
+        Parameters
+        ----------
+        params : dict
+            Dictionary mapping parameter names to 1d arrays of values
+        """
+        abd = self.thermalisation_coefficients(params["mej"], params["vej"])
+        self.coefficient_cache = dict(zip(zip(params["mej"], params["vej"]), abd))
+
     def set_params(self, params, t_bounds):
         """
         Method to set the parameters for lightcurve
@@ -79,9 +144,10 @@ class kilonova(model_base):
         ### compute photosphere radius and temperature
         # SCALAR VALUED CODE
         mej, vej, kappa = params["mej"], params["vej"], params["kappa"]
-        a = self.fa([mej, vej])[0]
-        b = self.fb([mej, vej])[0]
-        d = self.fd([mej, vej])[0]
+        abd = self.coefficient_cache.get((mej, vej))
+        if abd is None:
+            abd = self.thermalisation_coefficients(mej, vej)[0]
+        a, b, d = abd
         vej *= c
         td = np.sqrt(2.0 * kappa * (mej * Msun) / (beta * vej * c))
         L_in = 4.0e18 * (mej * Msun) * (0.5 - np.arctan((t - t0) / sigma) / np.pi)**1.3
@@ -117,23 +183,30 @@ class kilonova(model_base):
         band : string
             Band to evaluate
         """
-        c = 2.99792458e10 # cm/s
-        h = 6.626e-27 # erg * s
-        kb = 1.38e-16 # erg/K
-        Mpc = 3.08e24 # cm
-        D = 1.0e-5 * Mpc # fiducial distance
+        return self.evaluate_bands({band:tvec_days})[band]
 
-        lmbda = self.lmbda_dict[band] * 1.0e-7 # convert to cm
-        nu = c / lmbda
+    def evaluate_bands(self, tvec_dict):
+        """
+        Evaluate model in several bands at once using the current parameters.
+        The blackbody SED is computed for all bands on the photosphere time grid
+        in a single array operation, and then interpolated to the requested
+        times for each band.
 
-        B_nu = (2.0 * h * nu**3 / c**2) / np.expm1(h * nu / (kb * self.T_photo))
-        F_nu = B_nu * np.pi * self.R_photo**2 / D**2
-        
-        mAB = -2.5 * np.log10(F_nu) - 48.6
-        mask = np.isfinite(mAB)
-        f = interp1d(self.tdays[mask], mAB[mask], fill_value="extrapolate")
+        Parameters
+        ----------
+        tvec_dict : dict
+            Dictionary mapping band names to time values
+        """
+        c = 2.99792458e10 # cm/s
+        bands = list(tvec_dict.keys())
+        lmbda = np.array([self.lmbda_dict[band] for band in bands]) * 1.0e-7 # convert to cm
+        mAB = _blackbody_mags(c / lmbda, [self.R_photo], [self.T_photo])
         dist_correct_mag = 0
         if self.distance_Mpc:
             dist_correct_mag = 5*np.log10(self.distance_Mpc*1e6)-5 # distance in Mpc, factor of 10 pc taken care of with "-5" term
-        return f(tvec_days)+  dist_correct_mag, self.sigma
-
+        ret = {}
+        for i, band in enumerate(bands):
+            mask = np.isfinite(mAB[i])
+            f = interp1d(self.tdays[mask], mAB[i][mask], fill_value="extrapolate")
+            ret[band] = (f(tvec_dict[band]) + dist_correct_mag, self.sigma)
+        return ret
@@ -1,9 +1,28 @@
 import numpy as np
 from scipy.interpolate import interp1d
-from joblib import load
 import os
 
-from .model import model_base
+from .model import model_base, batch_chunks
+
+### number of (n_samples x n_train) float arrays assumed to be alive at once
+### during a GP evaluation
+GP_ARRAYS_PER_SAMPLE = 4
+
+### training set size assumed for GPs that do not expose their training data
+DEFAULT_N_TRAIN = 2000
+
+def _training_size(gp):
+    ### number of training points of a saved GP, from its training inputs or
+    ### (square) kernel matrix, or None if neither can be found
+    for attr in ["X_train_", "x", "X", "x_train", "X_train"]:
+        value = getattr(gp, attr, None)
+        if isinstance(value, np.ndarray) and value.ndim == 2:
+            return value.shape[0]
+    for attr in ["L_", "L", "K", "K_inv"]:
+        value = getattr(gp, attr, None)
+        if isinstance(value, np.ndarray) and value.ndim == 2 and value.shape[0] == value.shape[1]:
+            return value.shape[0]
+    return None
 
 class kn_interp(model_base):
     def __init__(self):
@@ -12,6 +31,7 @@ class kn_interp(model_base):
         bands = ["g", "r", "i", "z", "y", "J", "H", "K"]
         model_base.__init__(self, name, param_names, bands)
         self.vectorized = True
+        from joblib import load
         
         interp_loc = os.environ["INTERP_LOC"]
         if interp_loc[-1] != "/":
@@ -35,6 +55,12 @@ class kn_interp(model_base):
                 continue
             print("loading interpolator", suffix)
             self.interpolators.append(load(interp_loc + "saved_models/time_" + suffix + ".joblib"))
+
+        ### memory per sample of the GP intermediates, for the largest training set
+        n_train = [_training_size(interpolator.GP) for interpolator in self.interpolators]
+        if any(n is None for n in n_train):
+            print("Could not find the training set size of every interpolator, assuming", DEFAULT_N_TRAIN)
+        self.bytes_per_sample = GP_ARRAYS_PER_SAMPLE * 8 * max(DEFAULT_N_TRAIN if n is None else n for n in n_train)
         
         self.lmbda_dict = { # dictionary of wavelengths corresponding to bands
                 "u":354.3,
@@ -68,8 +94,11 @@ class kn_interp(model_base):
         mags_interp = np.empty((self.params_array.shape[0], self.t_interp.size))
         mags_err_interp = np.empty((self.params_array.shape[0], self.t_interp.size))
         
+        ### evaluate in chunks, so the GP intermediates for large batches stay inside the memory budget
+        chunks = batch_chunks(self.params_array.shape[0], self.bytes_per_sample)
         for i, interpolator in enumerate(self.interpolators):
-            mags_interp[:,i], mags_err_interp[:,i] = interpolator.GP.evaluate(self.params_array)
+            for chunk in chunks:
+                mags_interp[chunk,i], mags_err_interp[chunk,i] = interpolator.GP.evaluate(self.params_array[chunk])
             mags_interp[:,i] *= interpolator.std
             mags_interp[:,i] += interpolator.mean
             mags_err_interp[:,i] *= interpolator.std
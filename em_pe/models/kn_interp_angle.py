@@ -3,15 +3,20 @@ from scipy.interpolate import interp1d
 import os
 import sys
 import json
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, WhiteKernel, ConstantKernel as C
 from functools import lru_cache
 from scipy.linalg import cholesky, cho_solve
 
-from .model import model_base
+from .model import model_base, batch_chunks
+
+### number of (n_samples x n_train) float arrays alive at once in _gp_predict:
+### the kernel's squared distances and their exponential, K_trans and cho_solve's result
+GP_ARRAYS_PER_SAMPLE = 4
 
 @lru_cache(maxsize=64)
 def _load_gp(fname_base):
+    ### sklearn is only imported when a GP is actually loaded
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, WhiteKernel
     kernel=None
     with open(fname_base+".json",'r') as f:
         print('loading GP from json')
@@ -43,17 +48,32 @@ def _load_gp(fname_base):
     gp._y_train_mean = float(my_json['y_train_mean'])
     return gp
 
-def _model_predict(model, inputs):#, fix_log=False):
-    K = model.kernel_(model.X_train_)
-    K[np.diag_indices_from(K)] += model.alpha
-    model.L_ = cholesky(K, lower=True) # recalculating L matrix since this is what makes the pickled models bulky
-    model._K_inv = None # has to be set to None so the GP knows to re-calculate matrices used for uncertainty
-    K_trans = model.kernel_(inputs, model.X_train_)
-    pred = K_trans.dot(model.alpha_)
+def _gp_predict(model, inputs, chunk_size=None):
+    ### GP mean and standard deviation in the (log luminosity) space the GP was trained in
+    if getattr(model, "L_", None) is None:
+        ### the L matrix is not saved with the model since it is what makes the pickled models bulky,
+        ### so calculate it once and keep it with the (cached) GP
+        K = model.kernel_(model.X_train_)
+        K[np.diag_indices_from(K)] += model.alpha
+        model.L_ = cholesky(K, lower=True)
+        model._K_inv = None # has to be set to None so the GP knows to re-calculate matrices used for uncertainty
+    ### the samples are evaluated in chunks, so that the (n_samples x n_train)
+    ### intermediate arrays stay inside the memory budget for large batches.
+    ### the rounding of cho_solve depends on its block size, so the errors can
+    ### differ between chunk sizes at the ~1e-11 relative level
+    pred = np.empty(inputs.shape[0])
+    err = np.empty(inputs.shape[0])
+    for chunk in batch_chunks(inputs.shape[0], GP_ARRAYS_PER_SAMPLE * 8 * model.X_train_.shape[0], chunk_size):
+        K_trans = model.kernel_(inputs[chunk], model.X_train_)
+        pred[chunk] = K_trans.dot(model.alpha_)
+        v = cho_solve((model.L_, True), K_trans.T)
+        ### only the diagonal of the predictive covariance is needed
+        err[chunk] = np.sqrt(model.kernel_.diag(inputs[chunk]) - np.einsum("ij,ji->i", K_trans, v))
     pred = model._y_train_std * pred + model._y_train_mean
-    v = cho_solve((model.L_, True), K_trans.T)
-    y_cov = model.kernel_(inputs) - K_trans.dot(v)
-    err = np.sqrt(np.diag(y_cov))
+    return pred, err
+
+def _model_predict(model, inputs):#, fix_log=False):
+    pred, err = _gp_predict(model, inputs)
     
     ### temporary hack to fix log issue
     #if fix_log:
@@ -65,6 +85,87 @@ def _model_predict(model, inputs):#, fix_log=False):
 
     return mags, mags_error
 
+def _save_gp(gp, fname_base):
+    ### save a fitted GP in the format read by _load_gp()
+    my_json = {"kernel":list(gp.kernel_.theta),
+               "kernel_params":{},
+               "y_train_std":float(gp._y_train_std),
+               "y_train_mean":float(gp._y_train_mean)}
+    with open(fname_base + ".json", "w") as f:
+        json.dump(my_json, f)
+    np.savetxt(fname_base + "_X.dat", gp.X_train_)
+    np.savetxt(fname_base + "_y.dat", gp.y_train_)
+    np.savetxt(fname_base + "_alpha.dat", gp.alpha_)
+
+@lru_cache(maxsize=16)
+def _load_pca(pca_dir):
+    ### time-PCA surrogate for one angle: mean lightcurve, components, and one GP per component
+    mean = np.loadtxt(pca_dir + "mean.dat")
+    components = np.atleast_2d(np.loadtxt(pca_dir + "components.dat"))
+    gps = [_load_gp(pca_dir + "gp_%03d" % k) for k in range(components.shape[0])]
+    return mean, components, gps
+
+def _pca_predict(pca_dir, inputs):
+    ### reconstruct the lightcurves at every time node with a single matrix multiply
+    mean, components, gps = _load_pca(pca_dir)
+    coeffs = np.empty((inputs.shape[0], len(gps)))
+    coeffs_err = np.empty((inputs.shape[0], len(gps)))
+    for k, gp in enumerate(gps):
+        coeffs[:,k], coeffs_err[:,k] = _gp_predict(gp, inputs)
+    log_lums = mean + coeffs.dot(components)
+    err = np.sqrt((coeffs_err**2).dot(components**2))
+    return _log_lums_to_mags(log_lums), 2.5 * err
+
+def fit_pca_surrogate(gp_fnames, pca_dir, n_components=10):
+    '''
+    Fit a time-PCA surrogate from the training data of a set of per-time GPs.
+    The lightcurves are projected onto their first principal components over
+    time, and one GP is trained for each component.
+
+    Parameters
+    ----------
+    gp_fnames : list
+        Base filenames of the per-time GPs, in time order
+    pca_dir : string
+        Directory to save the surrogate to
+    n_components : int
+        Number of principal components to keep
+
+    Returns
+    -------
+    float
+        Fraction of the lightcurve variance captured by the components kept
+    '''
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, WhiteKernel, ConstantKernel as C
+    X = None
+    Y = []
+    for fname in gp_fnames:
+        gp = _load_gp(fname)
+        if X is None:
+            X = gp.X_train_
+        elif gp.X_train_.shape != X.shape or not np.allclose(gp.X_train_, X):
+            raise ValueError("GPs were not trained on the same inputs: " + fname)
+        Y.append(gp._y_train_std * gp.y_train_ + gp._y_train_mean)
+    Y = np.array(Y).T # (training point x time)
+    mean = np.mean(Y, axis=0)
+    U, S, Vt = np.linalg.svd(Y - mean, full_matrices=False)
+    n_components = min(n_components, S.size)
+    components = Vt[:n_components]
+    coeffs = U[:,:n_components] * S[:n_components]
+    if not os.path.exists(pca_dir):
+        os.makedirs(pca_dir)
+    np.savetxt(pca_dir + "mean.dat", mean)
+    np.savetxt(pca_dir + "components.dat", components)
+    for k in range(n_components):
+        print("  fitting GP for component {} of {}".format(k + 1, n_components))
+        ### same kernel structure that _load_gp() expects
+        kernel = WhiteKernel() + C() * RBF(length_scale=np.ones(X.shape[1]))
+        gp = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=0, normalize_y=True)
+        gp.fit(X, coeffs[:,k])
+        _save_gp(gp, pca_dir + "gp_%03d" % k)
+    return np.sum(S[:n_components]**2) / np.sum(S**2)
+
 def _log_lums_to_mags(log_lums):
     d = 3.086e18 # parsec in cm
     d *= 10 # distance of 10 pc
@@ -90,6 +191,7 @@ class kn_interp_angle(model_base):
                              }
         interp_loc += morph_comp_models[morph_comp]
         print(interp_loc)
+        self.interp_loc = interp_loc
         #interp_loc += "saved_models/2021_Wollaeger_TorusPeanut/"
         #interp_loc += "surrogate_data/2021_Wollaeger_TorusPeanut/"
         #interp_loc += "saved_models/2021_Wollaeger_TorusSphericalWind1/"
@@ -234,6 +336,52 @@ class kn_interp_angle(model_base):
             return mags_out.flatten(), mags_err_out.flatten()
         return mags_out, mags_err_out
 
+class kn_interp_angle_pca(kn_interp_angle):
+    '''
+    Same as kn_interp_angle, but uses the time-PCA surrogates (see
+    scripts/fit_pca_surrogate.py) rather than one GP per time step.
+    '''
+    def __init__(self, morph_comp="TP2"):
+        kn_interp_angle.__init__(self, morph_comp)
+        self.name = "kn_interp_angle_pca"
+        self.pca_dirs = {angle:self.interp_loc + "theta" + ("00" if angle == 0 else str(angle)) + "deg/pca/" for angle in self.angles}
+
+    def evaluate(self, tvec_days, band):
+        self.params_array[:,4] = self.lmbda_dict[band]
+
+        ### full lightcurves (at every time node) for each row of self.params_array
+        mags_interp = np.empty((self.params_array.shape[0], self.t_interp_full.size))
+        mags_err_interp = np.empty((self.params_array.shape[0], self.t_interp_full.size))
+
+        ### iterate over angular bins
+        for angle_index in range(len(self.angles) - 1):
+            theta_lower = self.angles[angle_index]
+            theta_upper = self.angles[angle_index + 1]
+            delta_theta = float(theta_upper) - float(theta_lower)
+            param_indices = self.index_dict[(theta_lower, theta_upper)]
+            if param_indices.size == 0:
+                continue
+            mags_lower, mags_err_lower = _pca_predict(self.pca_dirs[theta_lower], self.params_array[param_indices])
+            mags_upper, mags_err_upper = _pca_predict(self.pca_dirs[theta_upper], self.params_array[param_indices])
+            weight_lower = ((theta_upper - self.theta[param_indices]) / delta_theta)[:,np.newaxis]
+            weight_upper = ((self.theta[param_indices] - theta_lower) / delta_theta)[:,np.newaxis]
+            mags_interp[param_indices] = weight_lower * mags_lower + weight_upper * mags_upper
+            mags_err_interp[param_indices] = weight_lower * mags_err_lower + weight_upper * mags_err_upper
+
+        if not(self.distance_Mpc is None):
+            dist_correct_mag = 5*np.log10(self.distance_Mpc*1e6)-5 # distance in Mpc, factor of 10 pc taken care of with "-5" term
+        else: dist_correct_mag=np.zeros(self.params_array.shape[0])
+
+        ### interpolate all the lightcurves to the user-requested times at once
+        mags_out = interp1d(self.t_interp_full, mags_interp, axis=1, fill_value="extrapolate")(tvec_days)
+        mags_out += np.reshape(dist_correct_mag, (-1, 1))
+        mags_err_out = interp1d(self.t_interp_full, mags_err_interp, axis=1, fill_value="extrapolate")(tvec_days)
+
+        if self.params_array.shape[0] == 1:
+            ### if the model is being used in non-vectorized form, return 1d arrays
+            return mags_out.flatten(), mags_err_out.flatten()
+        return mags_out, mags_err_out
+
 class kn_interp_angle_no_mej_dyn(kn_interp_angle):
     def __init__(self):
         kn_interp_angle.__init__(self)
@@ -5,6 +5,42 @@ Model
 Base class for lightcurve models
 '''
 from __future__ import print_function
+import os
+
+### memory budget (in bytes) for the intermediate arrays of one batched
+### surrogate evaluation, set with EM_PE_MEMORY_BUDGET_MB (default 256 MB).
+### larger batches are evaluated in chunks. the budget does not include models
+### that are already loaded (e.g. the GPs cached by kn_interp_angle._load_gp,
+### each holding an (n_train x n_train) Cholesky factor).
+MEMORY_BUDGET = float(os.environ.get("EM_PE_MEMORY_BUDGET_MB", 256)) * 2**20
+
+def batch_chunks(n, bytes_per_sample, chunk_size=None, memory_budget=None):
+    '''
+    Split a batch of samples into chunks whose intermediate arrays fit in the
+    memory budget.
+
+    Parameters
+    ----------
+    n : int
+        Number of samples in the batch
+    bytes_per_sample : float
+        Memory used by the intermediate arrays for each sample
+    chunk_size : int
+        Number of samples per chunk (overrides the memory budget)
+    memory_budget : float
+        Memory budget in bytes (defaults to MEMORY_BUDGET)
+
+    Returns
+    -------
+    list
+        List of slices covering the batch
+    '''
+    if chunk_size is None:
+        if memory_budget is None:
+            memory_budget = MEMORY_BUDGET
+        chunk_size = int(memory_budget // bytes_per_sample)
+    chunk_size = max(chunk_size, 1)
+    return [slice(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
 
 class model_base:
     '''
@@ -44,6 +80,19 @@ class model_base:
         self.params = params
         self.t_bounds = t_bounds
 
+    def prepare_batch(self, params):
+        '''
+        Method called with a whole batch of parameter samples before they are
+        passed to set_params() one at a time. Non-vectorized models can override
+        this to precompute anything that vectorizes over the batch.
+
+        Parameters
+        ----------
+        params : dict
+            Dictionary mapping parameter names to 1d arrays of values
+        '''
+        pass
+
     ### Functions that should be implemented by child classes.
     ### NOTE: These could be seen as (and maybe should be) abstract methods
 
@@ -60,3 +109,21 @@ class model_base:
             Band to evaluate
         '''
         pass
+
+    def evaluate_bands(self, tvec_dict):
+        '''
+        Method to evaluate model in several bands at once using the current
+        parameters. The default implementation just calls evaluate() for each
+        band; child classes should override it if the bands share work.
+
+        Parameters
+        ----------
+        tvec_dict : dict
+            Dictionary mapping band names to time values
+
+        Returns
+        -------
+        dict
+            Dictionary mapping band names to (magnitude, magnitude error) pairs
+        '''
+        return {band:self.evaluate(tvec_dict[band], band) for band in tvec_dict}
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Model Server
+------------
+Long-running local service that holds one warm copy of a model (e.g. the
+kn_interp_angle GP library) and evaluates it for many clients, along with the
+"remote" proxy model that clients use through model_dict.
+
+The server listens on a Unix socket (any address without a ":") or on
+host:port. Requests and replies are pickled over multiprocessing.connection,
+authenticated with a random key the server writes to a key file readable only
+by its user ([address].key for Unix sockets, or
+$EM_PE_CACHE/model_server_[host]_[port].key). Clients find the server through
+the EM_PE_MODEL_SERVER environment variable.
+
+To start a server::
+
+    python -m em_pe.models.model_server --m kn_interp_angle --morph-comp TP2 --address /tmp/em_pe_model.sock
+
+and to use it, set EM_PE_MODEL_SERVER=/tmp/em_pe_model.sock and pass
+``--m remote`` to the sampler or plotting scripts.
+"""
+
+from __future__ import print_function
+import os
+import argparse
+import threading
+from multiprocessing.connection import Listener, Client
+import numpy as np
+
+from .model import model_base
+from ..utils.cosmology import distance_modulus
+
+def _parse_address(address):
+    ### "host:port" for TCP, anything else is a Unix socket path
+    if ":" in address and "/" not in address:
+        host, port = address.rsplit(":", 1)
+        return (host, int(port))
+    return address
+
+def _key_file(address):
+    if isinstance(address, tuple):
+        cache_dir = os.environ.get("EM_PE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "em_pe"))
+        return os.path.join(cache_dir, "model_server_{}_{}.key".format(*address))
+    return address + ".key"
+
+def gaussian_lnL(mags, mags_err, data, ignore_m_err=False):
+    '''
+    Gaussian log-likelihood of data given model magnitudes, summed over bands
+    (the same likelihood the sampler uses).
+
+    Parameters
+    ----------
+    mags : dict
+        Dictionary mapping bands to (n x T) arrays of model magnitudes
+    mags_err : dict
+        Dictionary mapping bands to (n x T) arrays of model errors
+    data : dict
+        Dictionary mapping bands to (T x 4) data arrays (time, unused,
+        magnitude, error)
+    ignore_m_err : bool
+        Fix the model error to 0
+
+    Returns
+    -------
+    np.ndarray
+        (n) array of log-likelihoods
+    '''
+    lnL = 0.0
+    for band in data:
+        x = data[band][:,2]
+        err = data[band][:,3]
+        m_err = 0.0 * mags_err[band] if ignore_m_err else mags_err[band]
+        var = err**2 + m_err**2
+        lnL = lnL + np.sum((x - mags[band])**2 / var + np.log(2.0 * np.pi * var), axis=1)
+    return -0.5 * lnL
+
+class ModelServer:
+    '''
+    Serve a model to local clients.
+
+    Parameters
+    ----------
+    m : string
+        Name of model to serve
+    address : string
+        Unix socket path or host:port
+    morph_comp : string
+        Morphology/composition (kn_interp_angle models only)
+    '''
+    def __init__(self, m, address, morph_comp="TP2"):
+        from . import model_dict
+        self.m = m
+        self.address = _parse_address(address)
+        if m in ["kn_interp_angle", "kn_interp_angle_pca"]:
+            self.model = model_dict[m](morph_comp)
+        else:
+            self.model = model_dict[m]()
+        ### models keep their parameters as state, so evaluations are serialized
+        self.lock = threading.Lock()
+
+    def evaluate(self, params, t_bounds, tvec_dict):
+        '''
+        Evaluate the model for a batch of parameters.
+
+        Parameters
+        ----------
+        params : dict
+            Dictionary mapping parameter names to values or arrays of values
+        t_bounds : list
+            [lower bound, upper bound] pair for time values
+        tvec_dict : dict
+            Dictionary mapping band names to time values
+
+        Returns
+        -------
+        dict
+            Dictionary mapping band names to (n x T) arrays of magnitudes and
+            magnitude errors
+        '''
+        n = max([np.size(params[p]) for p in params] + [1])
+        params = {p:np.broadcast_to(np.atleast_1d(params[p]), (n,)) for p in params}
+        tvec_dict = {band:np.atleast_1d(tvec_dict[band]) for band in tvec_dict}
+        ret = {}
+        with self.lock:
+            if self.model.vectorized:
+                self.model.set_params(params, t_bounds)
+                for band, (mags, mags_err) in self.model.evaluate_bands(tvec_dict).items():
+                    T = tvec_dict[band].size
+                    ret[band] = (np.broadcast_to(np.reshape(mags, (-1, T)), (n, T)).copy(),
+                                 np.broadcast_to(np.reshape(mags_err, (-1, T)), (n, T)).copy())
+            else:
+                self.model.prepare_batch(params)
+                for band in tvec_dict:
+                    ret[band] = (np.empty((n, tvec_dict[band].size)), np.empty((n, tvec_dict[band].size)))
+                for row in range(n):
+                    self.model.set_params({p:params[p][row] for p in params}, t_bounds)
+                    for band, (mags, mags_err) in self.model.evaluate_bands(tvec_dict).items():
+                        ret[band][0][row] = mags
+                        ret[band][1][row] = mags_err
+        return ret
+
+    def _handle(self, request):
+        op = request["op"]
+        if op == "info":
+            return {"m":self.m, "name":self.model.name, "param_names":self.model.param_names, "bands":self.model.bands}
+        if op == "evaluate":
+            return self.evaluate(request["params"], request["t_bounds"], request["tvec_dict"])
+        if op == "lnL":
+            data = request["data"]
+            lcs = self.evaluate(request["params"], request["t_bounds"], {band:data[band][:,0] for band in data})
+            mags = {band:lcs[band][0] for band in data}
+            if "dist" in request["params"]:
+                dist_mod = distance_modulus(np.atleast_1d(request["params"]["dist"]))
+                mags = {band:mags[band] + dist_mod.reshape((-1, 1)) for band in mags}
+            return gaussian_lnL(mags, {band:lcs[band][1] for band in data}, data, request.get("ignore_m_err", False))
+        raise ValueError("Unknown request '" + str(op) + "'")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    conn.send(("ok", self._handle(request)))
+                except Exception as e:
+                    conn.send(("error", repr(e)))
+
+    def serve_forever(self):
+        '''
+        Accept clients (each in its own thread) until interrupted.
+        '''
+        authkey = os.urandom(32)
+        key_file = _key_file(self.address)
+        if not os.path.exists(os.path.dirname(os.path.abspath(key_file))):
+            os.makedirs(os.path.dirname(os.path.abspath(key_file)))
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.remove(self.address) # stale socket from an earlier server
+        with Listener(self.address, authkey=authkey) as listener:
+            if not isinstance(self.address, tuple):
+                os.chmod(self.address, 0o600)
+            fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(authkey)
+            print("Serving", self.m, "at", self.address)
+            try:
+                while True:
+                    try:
+                        conn = listener.accept()
+                    except Exception as e: # e.g. a client with the wrong key
+                        print("Rejected connection:", repr(e))
+                        continue
+                    threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+            finally:
+                os.remove(key_file)
+
+class remote(model_base):
+    '''
+    Proxy for a model served by a ModelServer. The server address is read from
+    the EM_PE_MODEL_SERVER environment variable unless given.
+
+    Parameters
+    ----------
+    address : string
+        Unix socket path or host:port of the server
+    '''
+    def __init__(self, address=None):
+        if address is None:
+            if "EM_PE_MODEL_SERVER" not in os.environ:
+                raise RuntimeError("Set EM_PE_MODEL_SERVER to the address of a model server to use the remote model")
+            address = os.environ["EM_PE_MODEL_SERVER"]
+        self.address = _parse_address(address)
+        self.conn = None
+        info = self._request({"op":"info"})
+        model_base.__init__(self, info["name"], info["param_names"], info["bands"])
+        self.served_model = info["m"] # name of the served model in model_dict
+        self.vectorized = True # batches are evaluated on the server in a single request
+
+    def _connect(self):
+        with open(_key_file(self.address), "rb") as f:
+            self.conn = Client(self.address, authkey=f.read())
+
+    def _request(self, request):
+        ### connect on first use, so copies that are never evaluated (e.g. the
+        ### models pickled along with the sampler for each pool task) do not connect
+        if self.conn is None:
+            self._connect()
+        self.conn.send(request)
+        status, result = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError("Model server error: " + result)
+        return result
+
+    def __getstate__(self):
+        ### copies sent to other processes (e.g. the sampler's pool) open their own connection when first used
+        state = dict(self.__dict__)
+        state["conn"] = None
+        return state
+
+    def evaluate_bands(self, tvec_dict):
+        ret = self._request({"op":"evaluate", "params":self.params, "t_bounds":self.t_bounds, "tvec_dict":tvec_dict})
+        if all(np.ndim(self.params[p]) == 0 for p in self.params):
+            ### scalar parameter sets give 1d arrays, as for local models (batches,
+            ### even of length 1, give (n x T) arrays)
+            ret = {band:(ret[band][0][0], ret[band][1][0]) for band in ret}
+        return ret
+
+    def evaluate(self, tvec_days, band):
+        return self.evaluate_bands({band:tvec_days})[band]
+
+    def log_likelihood(self, params, data, t_bounds, ignore_m_err=False):
+        '''
+        Evaluate the likelihood on the server.
+
+        Parameters
+        ----------
+        params : dict
+            Dictionary mapping parameter names to arrays of values (including
+            "dist" if the distance modulus should be applied)
+        data : dict
+            Dictionary mapping bands to (T x 4) data arrays
+        t_bounds : list
+            [lower bound, upper bound] pair for time values
+        ignore_m_err : bool
+            Fix the model error to 0
+
+        Returns
+        -------
+        np.ndarray
+            Array of log-likelihoods
+        '''
+        return self._request({"op":"lnL", "params":params, "data":data, "t_bounds":t_bounds, "ignore_m_err":ignore_m_err})
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a model to local sampler and plotting processes")
+    parser.add_argument("--m", help="Name of model to serve")
+    parser.add_argument("--morph-comp", default="TP2", help="Morphology and composition specification (kn_interp_angle models only)")
+    parser.add_argument("--address", help="Unix socket path, or host:port, to listen on")
+    args = parser.parse_args()
+    ModelServer(args.m, args.address, morph_comp=args.morph_comp).serve_forever()
+
+if __name__ == "__main__":
+    main()
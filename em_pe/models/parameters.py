@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.stats import loguniform, norm
 
 class Parameter:
     def __init__(self, name, llim, rlim):
@@ -11,12 +10,26 @@ class Parameter:
         self.llim = llim
         self.rlim = rlim
 
+    def _in_bounds(self, x):
+        return (x >= self.llim) & (x <= self.rlim)
+
+    def log_prior(self, x):
+        '''
+        Log prior density, for single values or arrays (-inf outside the
+        limits). Must be implemented by child classes.
+        '''
+        raise NotImplementedError
+
+    def prior(self, x):
+        return np.exp(self.log_prior(x))
+
 class UniformPriorParameter(Parameter):
     def __init__(self, name, llim, rlim):
         Parameter.__init__(self, name, llim, rlim)
 
-    def prior(self, x):
-        return 1.0 / (self.rlim - self.llim)
+    def log_prior(self, x):
+        x = np.asarray(x, dtype=float)
+        return np.where(self._in_bounds(x), -np.log(self.rlim - self.llim), -np.inf)
 
     def sample_from_prior(self, size=1, width=1.0):
         d = (self.rlim - self.llim) * (1.0 - width) / 2.0
@@ -28,24 +41,73 @@ class LogUniformPriorParameter(Parameter):
     def __init__(self, name, llim, rlim):
         Parameter.__init__(self, name, llim, rlim)
 
-    def prior(self, x):
-        return loguniform.pdf(x, self.llim, self.rlim) # FIXME should I be setting the loc and scale for this?
+    def log_prior(self, x):
+        ### p(x) = 1 / (x * log(rlim / llim))
+        x = np.asarray(x, dtype=float)
+        in_bounds = self._in_bounds(x)
+        return np.where(in_bounds, -np.log(np.where(in_bounds, x, 1.0)) - np.log(np.log(self.rlim / self.llim)), -np.inf)
 
     def sample_from_prior(self, size=1, width=1.0):
-        ret = loguniform.rvs(*loguniform.interval(width, self.llim, self.rlim), size=size)
+        ### uniform in log(x), over the central fraction "width" of the prior mass
+        log_llim, log_rlim = np.log(self.llim), np.log(self.rlim)
+        d = (log_rlim - log_llim) * (1.0 - width) / 2.0
+        ret = np.exp(np.random.uniform(log_llim + d, log_rlim - d, size=size))
         return ret if size != 1 else ret[0]
 
 class GaussianPriorParameter(Parameter):
+    '''
+    Gaussian prior, truncated to the parameter limits
+    '''
     def __init__(self, name, llim, rlim, mean, std):
         self.mean = mean
         self.std = std
         Parameter.__init__(self, name, llim, rlim)
+        self._log_mass() # fail early if there is no prior mass inside the limits
 
-    def prior(self, x):
-        return norm.pdf(x, loc=self.mean, scale=self.std)
+    def update_limits(self, llim, rlim):
+        Parameter.update_limits(self, llim, rlim)
+        self._log_mass()
+
+    def _standardized_limits(self):
+        ### limits in standard deviations from the mean, mirrored if they are both
+        ### above the mean (where the CDF rounds to 1), along with the mirroring sign
+        a = (self.llim - self.mean) / self.std
+        b = (self.rlim - self.mean) / self.std
+        if a > 0:
+            return -b, -a, -1.0
+        return a, b, 1.0
+
+    def _log_mass(self):
+        ### log of the Gaussian probability inside the limits, computed in log space
+        from scipy.special import log_ndtr
+        a, b, _ = self._standardized_limits()
+        log_cdf_a, log_cdf_b = log_ndtr(a), log_ndtr(b)
+        if not log_cdf_b > log_cdf_a:
+            raise ValueError("Gaussian prior for " + self.name + " has no mass between its limits")
+        return log_cdf_b + np.log1p(-np.exp(log_cdf_a - log_cdf_b))
+
+    def log_prior(self, x):
+        x = np.asarray(x, dtype=float)
+        log_norm = np.log(self.std * np.sqrt(2.0 * np.pi)) + self._log_mass()
+        return np.where(self._in_bounds(x), -0.5 * ((x - self.mean) / self.std)**2 - log_norm, -np.inf)
 
     def sample_from_prior(self, size=1, width=1.0):
-        raise NotImplementedError("Need to implement Gaussian prior sampling")
+        ### inverse-CDF sampling of the truncated Gaussian, over the central
+        ### fraction "width" of the prior mass, done in log space so that limits
+        ### far in the tail (where the CDF underflows) can still be sampled
+        from scipy.special import log_ndtr
+        try:
+            from scipy.special import ndtri_exp
+        except ImportError:
+            ### older scipy, fall back to inverting the linear CDF
+            from scipy.special import ndtri
+            ndtri_exp = lambda log_u: ndtri(np.exp(log_u))
+        a, b, sign = self._standardized_limits()
+        v = np.random.uniform((1.0 - width) / 2.0, (1.0 + width) / 2.0, size=size)
+        ### log(cdf(a) + v * (cdf(b) - cdf(a)))
+        log_u = np.logaddexp(log_ndtr(a), np.log(v) + self._log_mass())
+        ret = np.clip(self.mean + sign * self.std * ndtri_exp(log_u), self.llim, self.rlim)
+        return ret if size != 1 else ret[0]
 
 class Distance(UniformPriorParameter):
     def __init__(self):
@@ -142,3 +204,11 @@ class Sigma(UniformPriorParameter):
 class Theta(UniformPriorParameter):
     def __init__(self):
         UniformPriorParameter.__init__(self, "theta", 0.0, 90.0)
+
+class ComponentMass1(UniformPriorParameter):
+    def __init__(self):
+        UniformPriorParameter.__init__(self, "m1", 1.0, 2.0)
+
+class ComponentMass2(UniformPriorParameter):
+    def __init__(self):
+        UniformPriorParameter.__init__(self, "m2", 1.0, 2.0)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Tabulated Model
+---------------
+Model evaluated by interpolating a table of lightcurves precomputed from
+another model (see scripts/tabulate_model.py)
+"""
+import numpy as np
+from scipy.interpolate import interp1d, RegularGridInterpolator
+from scipy.ndimage import map_coordinates, spline_filter
+
+from .model import model_base
+
+def load_table(fname):
+    '''
+    Load a lightcurve table written by scripts/tabulate_model.py
+
+    Parameters
+    ----------
+    fname : string
+        Name of table file
+
+    Returns
+    -------
+    dict
+        Dictionary mapping table entries to their values
+    '''
+    with np.load(fname) as f:
+        table = {key:f[key] for key in f.files}
+    for key in ["name", "source", "mode", "interpolation"]:
+        table[key] = str(table[key])
+    table["param_names"] = [str(p) for p in table["param_names"]]
+    table["bands"] = [str(b) for b in table["bands"]]
+    return table
+
+def save_table(fname, table):
+    '''
+    Save a lightcurve table. Lightcurves are stored in single precision to keep
+    the file compact.
+
+    Parameters
+    ----------
+    fname : string
+        Name of table file
+    table : dict
+        Dictionary mapping table entries to their values
+    '''
+    table = dict(table)
+    table["mags"] = np.asarray(table["mags"], dtype=np.float32)
+    table["mags_err"] = np.asarray(table["mags_err"], dtype=np.float32)
+    np.savez_compressed(fname, **table)
+
+def _rbf_kernel(x, centers):
+    ### linear radial basis function, which is well-posed for any set of distinct centers
+    return np.sqrt(np.sum((x[:,np.newaxis,:] - centers[np.newaxis,:,:])**2, axis=2))
+
+class tabulated(model_base):
+    '''
+    Model evaluated from a precomputed table of lightcurves
+
+    Parameters
+    ----------
+    fname : string
+        Name of table file
+    interpolation : string
+        Interpolation method for gridded tables ("linear" or "cubic"). Defaults
+        to the method stored in the table.
+    '''
+    def __init__(self, fname, interpolation=None):
+        table = load_table(fname)
+        param_names = list(table["param_names"])
+        self.has_distance = bool(table["has_distance"])
+        if self.has_distance:
+            param_names.append("distance")
+        model_base.__init__(self, table["name"], param_names, table["bands"])
+        self.vectorized = True
+
+        self.source = table["source"]
+        self.mode = table["mode"]
+        self.interpolation = interpolation if interpolation is not None else table["interpolation"]
+        self.table_params = table["param_names"]
+        self.log_params = table["log_params"]
+        self.llim = table["llim"]
+        self.rlim = table["rlim"]
+        self.t_interp = table["times"]
+        self.error_rms = table["error_rms"]
+        self.error_max = table["error_max"]
+
+        ### flatten the bands and times into a single output dimension, so every
+        ### lightcurve in the table is interpolated in one call
+        n_out = len(self.bands) * self.t_interp.size
+        values = np.concatenate([table["mags"].reshape(-1, n_out), table["mags_err"].reshape(-1, n_out)], axis=1).astype(float)
+
+        if self.mode == "grid":
+            self.axes = [table["axis_%d" % i] for i in range(len(self.table_params))]
+            values = values.reshape([axis.size for axis in self.axes] + [2 * n_out])
+            if self.interpolation == "linear":
+                self.interpolator = RegularGridInterpolator(self.axes, values, bounds_error=False, fill_value=None)
+            elif self.interpolation == "cubic":
+                ### prefilter once so evaluations only need map_coordinates
+                self.coefficients = np.empty(values.shape)
+                for i in range(2 * n_out):
+                    self.coefficients[...,i] = spline_filter(values[...,i], order=3)
+            else:
+                raise ValueError("Unknown interpolation method '" + self.interpolation + "'")
+        elif self.mode == "lhs":
+            self.centers = self._normalize(table["points"])
+            self.rbf_weights = np.linalg.solve(_rbf_kernel(self.centers, self.centers), values)
+        else:
+            raise ValueError("Unknown table mode '" + self.mode + "'")
+
+        self.params_array = None
+        self.distance_Mpc = None
+
+    def _transform(self, x):
+        ### tables are built in log space for log-uniform parameters
+        x = np.array(x, dtype=float)
+        x[:,self.log_params] = np.log10(x[:,self.log_params])
+        return x
+
+    def _normalize(self, x):
+        ### map the prior box onto the unit hypercube
+        llim = self._transform(self.llim.reshape(1, -1))[0]
+        rlim = self._transform(self.rlim.reshape(1, -1))[0]
+        return (self._transform(x) - llim) / (rlim - llim)
+
+    def set_params(self, params, t_bounds):
+        n = np.atleast_1d(params[self.table_params[0]]).size
+        self.params_array = np.empty((n, len(self.table_params)))
+        for i, p in enumerate(self.table_params):
+            self.params_array[:,i] = params[p]
+        if self.has_distance and "distance" in params:
+            self.distance_Mpc = np.atleast_1d(params["distance"]) * np.ones(n)
+        else:
+            self.distance_Mpc = None
+
+    def _interpolate_table(self):
+        if self.mode == "lhs":
+            x = self._normalize(self.params_array)
+            ret = np.empty((x.shape[0], self.rbf_weights.shape[1]))
+            for start in range(0, x.shape[0], 1000): # chunked to bound the size of the kernel matrix
+                ret[start:start + 1000] = _rbf_kernel(x[start:start + 1000], self.centers).dot(self.rbf_weights)
+            return ret
+        x = self._transform(self.params_array)
+        if self.interpolation == "linear":
+            return self.interpolator(x)
+        ### fractional grid indices for the spline coefficients (the axes are evenly spaced)
+        coords = np.array([(x[:,i] - axis[0]) / (axis[1] - axis[0]) if axis.size > 1 else np.zeros(x.shape[0])
+                           for i, axis in enumerate(self.axes)])
+        return np.array([map_coordinates(self.coefficients[...,i], coords, order=3, mode="nearest", prefilter=False)
+                         for i in range(self.coefficients.shape[-1])]).T
+
+    def evaluate(self, tvec_days, band):
+        return self.evaluate_bands({band:tvec_days})[band]
+
+    def evaluate_bands(self, tvec_dict):
+        n = self.params_array.shape[0]
+        n_out = len(self.bands) * self.t_interp.size
+        values = self._interpolate_table()
+        mags = values[:,:n_out].reshape((n, len(self.bands), self.t_interp.size))
+        mags_err = values[:,n_out:].reshape((n, len(self.bands), self.t_interp.size))
+        dist_correct_mag = np.zeros((n, 1))
+        if self.distance_Mpc is not None:
+            dist_correct_mag[:,0] = 5*np.log10(self.distance_Mpc*1e6)-5 # distance in Mpc, factor of 10 pc taken care of with "-5" term
+        ret = {}
+        for band in tvec_dict:
+            i = self.bands.index(band)
+            f = interp1d(self.t_interp, mags[:,i], axis=1, fill_value="extrapolate")
+            f_err = interp1d(self.t_interp, mags_err[:,i], axis=1, fill_value="extrapolate")
+            mags_out = f(tvec_dict[band]) + dist_correct_mag
+            mags_err_out = f_err(tvec_dict[band])
+            if n == 1:
+                ### if the model is being used in non-vectorized form, return 1d arrays
+                mags_out, mags_err_out = mags_out.flatten(), mags_err_out.flatten()
+            ret[band] = (mags_out, mags_err_out)
+        return ret
@@ -1 +1 @@
-from .parse_json import parse_json
+from .parse_json import parse_json, parse_json_dir
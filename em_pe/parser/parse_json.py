@@ -5,7 +5,10 @@ import numpy as np
 import argparse
 import sys
 import json
-from astropy.time import Time
+import os
+import re
+
+from em_pe.utils.event_data import save_event_data
 
 predefined_bands = ["g", "r", "i", "z", "y", "J", "H", "K"]
 
@@ -16,6 +19,7 @@ def _parse_command_line_args():
     parser = argparse.ArgumentParser(description='Parse Open Astronomy Catalog (OAC) JSON files')
     parser.add_argument('--t0', type=float, default=0, help='Initial time (t=0 for event)')
     parser.add_argument('--f', help='Filename for JSON file')
+    parser.add_argument('--dir', help='Directory of JSON files to parse (each event is saved in its own subdirectory of --out)')
     parser.add_argument('--b', action='append', help='Data bands to store')
     parser.add_argument('--out', help='Directory to save data to')
     parser.add_argument('--maxpts', type=float, default=np.inf, help='Maximum number of points to keep for each band')
@@ -26,38 +30,143 @@ def _parse_command_line_args():
         parser.add_argument('--tmax-' + b, type=float, help="Upper bound for time in " + b + " band")
     return parser.parse_args()
 
-def _read_data(t0, file, bands, out, maxpts, tmax, telescopes, args):
+_TOKEN = re.compile(r'["{}\[\]]')
+_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"', re.S)
+_WHITESPACE = re.compile(r'\s*')
+_SEPARATOR = re.compile(r'[\s,]*')
+
+class _json_stream:
+    '''
+    Minimal incremental JSON reader. It skips through the document chunk by
+    chunk until it reaches a given key, and then decodes the elements of the
+    array stored under that key one at a time, so memory use does not depend on
+    the size of the file.
+    '''
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        ### drop everything that has already been consumed and read another chunk
+        chunk = self.f.read(self.chunk_size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def _match(self, regex, pos=None):
+        ### match from pos (by default the current position), reading more data if the match could be incomplete
+        offset = 0 if pos is None else pos - self.pos
+        while True:
+            m = regex.match(self.buf, self.pos + offset)
+            if m is not None and (m.end() < len(self.buf) or self.eof):
+                return m
+            if not self._fill():
+                return regex.match(self.buf, self.pos + offset)
+
+    def find(self, path):
+        '''
+        Skip ahead to the value stored under a sequence of nested object keys
+        (e.g. [event_name, 'photometry']).
+        '''
+        path = list(path)
+        keys = [] # keys of the containers we are currently inside
+        pending_key = None
+        while True:
+            m = _TOKEN.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise KeyError("'" + "/".join(path) + "' not found")
+                continue
+            self.pos = m.start()
+            c = m.group()
+            if c == '"':
+                string = self._match(_STRING)
+                if string is None:
+                    raise ValueError("Unterminated string in JSON file")
+                self.pos = self._match(_WHITESPACE, string.end()).end()
+                if self.buf[self.pos:self.pos + 1] != ':': # just a value
+                    continue
+                self.pos += 1
+                pending_key = json.loads(string.group())
+                if keys[1:] + [pending_key] == path:
+                    return
+            elif c in '{[':
+                keys.append(pending_key)
+                pending_key = None
+                self.pos += 1
+            else:
+                keys.pop()
+                pending_key = None
+                self.pos += 1
+
+    def iter_array(self):
+        '''
+        Decode the elements of the array at the current position one at a time.
+        '''
+        decoder = json.JSONDecoder()
+        self.pos = self._match(_SEPARATOR).end()
+        if self.buf[self.pos:self.pos + 1] != '[':
+            raise ValueError("Expected a JSON array")
+        self.pos += 1
+        while True:
+            self.pos = self._match(_SEPARATOR).end()
+            if self.buf[self.pos:self.pos + 1] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                ### the element continues past the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            yield element
+
+def _iter_photometry(file, name):
+    ### stream the photometry entries for an event without loading the whole file
+    with open(file, "r", encoding="UTF-8") as read_file:
+        stream = _json_stream(read_file)
+        stream.find([name, 'photometry'])
+        for entry in stream.iter_array():
+            yield entry
+
+def _collect_columns(photometry, telescope_flag):
+    ### single pass over the photometry entries, collecting the columns of the usable ones into lists
+    time, magnitude, e_magnitude, band, telescope = [], [], [], [], []
+    for entry in photometry:
+        ### skip entries without an error magnitude, upper limits, etc. before converting anything
+        if not ('band' in entry and 'e_magnitude' in entry and telescope_flag in entry and 'source' in entry
+                and 'realization' not in entry and 'upperlimit' not in entry):
+            continue
+        time.append(entry['time'])
+        magnitude.append(entry['magnitude'])
+        e_magnitude.append(entry['e_magnitude'])
+        band.append(entry['band'])
+        telescope.append(entry.get('telescope', ''))
+    return {'time':np.array(time, dtype=float), 'magnitude':np.array(magnitude, dtype=float),
+            'e_magnitude':np.array(e_magnitude, dtype=float), 'band':np.array(band, dtype=str),
+            'telescope':np.array(telescope, dtype=str)}
+
+def _filter_columns(columns, t0, bands, maxpts, tmax, telescopes, args):
+    ### apply all the filters as vectorized masks, and split the data by band
+    mask = np.isin(columns['band'], bands)
     if telescopes is not None:
-        telescopes = set(telescopes)
-    name = file.split('/')[-1] # get rid of path except for filename
-    name = name.split('.')[0] # get event name from filename
-    # GRB data uses different format of reporting telescopes/instruments, adjust accordingly
-    if 'GW' in name: telescope_flag = 'telescope'
-    if 'GRB' in name: telescope_flag = 'instrument'
-    ### read in the data
-    with open(file, "r") as read_file:
-        data = json.load(read_file, encoding="UTF-8")[name]['photometry']
-    ### create empty data arrays
+        mask &= np.isin(columns['telescope'], list(telescopes))
+    t = columns['time'] - t0
     data_dict = {}
     for band in bands:
-        data_dict[band] = np.empty((4, 0))
-    for entry in data:
-        if 'band' in entry:
-            band = entry['band']
-            ### check that it's a band we want and that it has an error magnitude
-            if (band in bands and 'e_magnitude' in entry and telescope_flag in entry and 'source' in entry
-                and (telescopes is None or entry['telescope'] in telescopes)
-                and 'realization' not in entry and 'upperlimit' not in entry):
-                ### [time, time error, magnitude, magnitude error]
-                to_append = np.array([[entry['time']], [0], [entry['magnitude']], [entry['e_magnitude']]]).astype(float)
-                to_append[0] -= t0
-                tmax_here = tmax
-                if "tmax_" + band in args.keys() and args["tmax_" + band] is not None:
-                    tmax_here = min(tmax, args["tmax_" + band])
-                if to_append[0] < tmax_here:
-                    data_dict[band] = np.append(data_dict[band], to_append, axis=1)
-    for band in data_dict:
-        data = data_dict[band]
+        tmax_here = tmax
+        if "tmax_" + band in args.keys() and args["tmax_" + band] is not None:
+            tmax_here = min(tmax, args["tmax_" + band])
+        band_mask = mask & (columns['band'] == band) & (t < tmax_here)
+        ### [time, time error, magnitude, magnitude error]
+        data = np.array([t[band_mask], np.zeros(np.sum(band_mask)), columns['magnitude'][band_mask], columns['e_magnitude'][band_mask]])
         ### check if we have too much data
         if data.shape[1] > maxpts:
             ### basically, generate random indices, take the columns (data points)
@@ -67,15 +176,33 @@ def _read_data(t0, file, bands, out, maxpts, tmax, telescopes, args):
             cols = np.random.randint(0, data.shape[1], int(maxpts))
             data = data[:,cols]
             data = data[:,data[0].argsort()]
-            data_dict[band] = data
+        data_dict[band] = data
     return data_dict
 
-def _save_data(out, data_dict):
+def _read_data(t0, file, bands, out, maxpts, tmax, telescopes, args):
+    if telescopes is not None:
+        telescopes = set(telescopes)
+    name = file.split('/')[-1] # get rid of path except for filename
+    name = name.split('.')[0] # get event name from filename
+    # GRB data uses different format of reporting telescopes/instruments, adjust accordingly
+    if 'GW' in name: telescope_flag = 'telescope'
+    if 'GRB' in name: telescope_flag = 'instrument'
+    ### stream in the data, only keeping entries in the bands (and from the telescopes) we want
+    data = (entry for entry in _iter_photometry(file, name) if entry.get('band') in bands
+            and (telescopes is None or entry.get('telescope') in telescopes))
+    columns = _collect_columns(data, telescope_flag)
+    return _filter_columns(columns, t0, bands, maxpts, tmax, telescopes, args)
+
+def _save_data(out, data_dict, **metadata):
     for band in data_dict:
         filename = out + band + '.txt'
         np.savetxt(filename, data_dict[band].T)
+    ### also store everything in one binary file, which is what the sampler reads first
+    save_event_data(out, {band:data_dict[band].T for band in data_dict}, **metadata)
 
 def _convert_time(t0):
+    ### astropy is only needed for GPS times
+    from astropy.time import Time
     t = Time(t0, format='gps')
     return t.mjd
 
@@ -102,10 +229,55 @@ def parse_json(t0, file, bands, out, maxpts=np.inf, tmax=np.inf, gps_time=False,
     if gps_time:
         t0 = _convert_time(t0)
     data_dict = _read_data(t0, file, bands, out, maxpts, tmax, telescopes, args)
-    _save_data(out, data_dict)
+    _save_data(out, data_dict, t0=t0, source=file)
+
+def parse_json_dir(t0, directory, bands, out, maxpts=np.inf, tmax=np.inf, gps_time=False, telescopes=None, args={}):
+    '''
+    Parse every JSON file in a directory. The data for each event is saved in
+    its own subdirectory of out, named after the event.
+
+    Parameters
+    ----------
+    t0 : float or dict
+        Initial time (t=0) for all events, or a dictionary mapping event names
+        to their initial times
+    directory : string
+        Directory containing the JSON files
+    bands : list
+        List of names of data bands to keep
+    out : string
+        Directory to save data to
+    maxpts : int
+        Maximum number of points to keep for each band
+    tmax : float
+        Upper bound for time points to keep
+
+    Returns
+    -------
+    dict
+        Dictionary mapping event names to their data
+    '''
+    ret = {}
+    for fname in sorted(os.listdir(directory)):
+        if not fname.endswith('.json'):
+            continue
+        name = fname.split('.')[0]
+        t0_here = t0[name] if isinstance(t0, dict) else t0
+        if gps_time:
+            t0_here = _convert_time(t0_here)
+        data_dict = _read_data(t0_here, os.path.join(directory, fname), bands, out, maxpts, tmax, telescopes, args)
+        event_out = os.path.join(out, name) + '/'
+        if not os.path.exists(event_out):
+            os.makedirs(event_out)
+        _save_data(event_out, data_dict, t0=t0_here, source=os.path.join(directory, fname))
+        ret[name] = data_dict
+    return ret
 
 def main():
     args = _parse_command_line_args()
+    if args.dir is not None:
+        parse_json_dir(args.t0, args.dir, args.b, args.out, args.maxpts, args.tmax, (args.time_format == 'gps'), args.telescopes, vars(args))
+        return
     parse_json(args.t0, args.f, args.b, args.out, args.maxpts, args.tmax, (args.time_format == 'gps'), args.telescopes, vars(args))
 
 if __name__ == '__main__':
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Binned Corner
+-------------
+Corner plots drawn from weighted 1-D and 2-D histograms that are accumulated
+by streaming through the posterior sample files in chunks, so the memory and
+plotting cost do not depend on the number of samples.
+"""
+
+from __future__ import print_function
+import numpy as np
+
+from em_pe.utils.sample_io import read_sample_names, iter_sample_chunks
+from em_pe.utils.posterior import weight_statistics
+
+N_FINE = 1000 # number of bins used for the 1-D histograms the quantiles are computed from
+
+def _columns(names, params, log_params):
+    ### map parameter names (possibly "log_" versions of sample columns) to columns
+    cols = []
+    for p in params:
+        if p in log_params:
+            cols.append(names.index(p[4:]))
+        else:
+            cols.append(names.index(p))
+    return cols
+
+def _transform(chunk, cols, params, log_params):
+    x = chunk[:,cols]
+    for i, p in enumerate(params):
+        if p in log_params:
+            x[:,i] = np.log10(x[:,i])
+    return x
+
+def accumulate_binned_summaries(sample_files, params, nbins=50, min_lnL=-np.inf, min_weight=0.0, log_params=(), chunk_size=100000):
+    '''
+    Stream through posterior sample files and accumulate the weighted
+    histograms and quantiles needed for a corner plot. All the files are
+    treated as a single (combined) sample set.
+
+    Parameters
+    ----------
+    sample_files : list
+        List of posterior sample files (text or .npy)
+    params : list
+        List of parameter names to plot
+    nbins : int
+        Number of bins per parameter
+    min_lnL : float
+        Minimum lnL for samples to keep
+    min_weight : float
+        Minimum (normalized) weight for samples to keep
+    log_params : list
+        Names in params of the form "log_[column]", which are plotted as the
+        log10 of that sample column
+    chunk_size : int
+        Number of samples to read at a time
+
+    Returns
+    -------
+    dict
+        Dictionary with the parameter names, plotting ranges, bin edges, 1-D
+        and 2-D histograms, quantiles (5%, 16%, 50%, 84%, 95%), and effective
+        number of samples
+    '''
+    nparams = len(params)
+    names = [read_sample_names(fname) for fname in sample_files]
+    ### the files may have their columns in different orders
+    cols = [_columns(n, params, log_params) for n in names]
+    transforms = [lambda chunk, c=c: _transform(chunk, c, params, log_params) for c in cols]
+
+    ### first pass: maximum lnL, sum of weights, and parameter ranges
+    stats = weight_statistics(sample_files, chunk_size, min_lnL, transform=transforms)
+    max_lnL, sum_w, max_w = stats["max_lnL"], stats["sum_w"], stats["max_w"]
+    lo, hi = stats["lo"], stats["hi"]
+    same = lo == hi
+    lo[same] -= 0.5
+    hi[same] += 0.5
+    edges = [np.linspace(lo[i], hi[i], nbins + 1) for i in range(nparams)]
+    fine_edges = [np.linspace(lo[i], hi[i], N_FINE + 1) for i in range(nparams)]
+
+    ### second pass: weighted histograms
+    hist1d = np.zeros((nparams, nbins))
+    hist1d_fine = np.zeros((nparams, N_FINE))
+    hist2d = np.zeros((nparams, nparams, nbins, nbins))
+    n_kept = 0
+    for fname, transform in zip(sample_files, transforms):
+        for chunk in iter_sample_chunks(fname, chunk_size):
+            chunk = chunk[chunk[:,0] > min_lnL]
+            w = np.exp(chunk[:,0] - max_lnL) * chunk[:,1] / chunk[:,2] / sum_w
+            mask = w > min_weight
+            w = w[mask]
+            x = transform(chunk[mask])
+            n_kept += w.size
+            for i in range(nparams):
+                hist1d[i] += np.histogram(x[:,i], bins=edges[i], weights=w)[0]
+                hist1d_fine[i] += np.histogram(x[:,i], bins=fine_edges[i], weights=w)[0]
+                for j in range(i):
+                    hist2d[j,i] += np.histogram2d(x[:,j], x[:,i], bins=[edges[j], edges[i]], weights=w)[0]
+
+    ### quantiles from the cumulative distribution of the fine histograms
+    q = np.array([0.05, 0.16, 0.5, 0.84, 0.95])
+    quantiles = np.empty((nparams, q.size))
+    for i in range(nparams):
+        cdf = np.append(0.0, np.cumsum(hist1d_fine[i]))
+        cdf /= cdf[-1]
+        quantiles[i] = np.interp(q, cdf, fine_edges[i])
+    print("eff samp:", sum_w / max_w)
+    print(n_kept, 'samples with weight >', min_weight)
+    return {"params":list(params), "ranges":np.array([lo, hi]).T, "edges":edges, "hist1d":hist1d,
+            "hist2d":hist2d, "quantile_levels":q, "quantiles":quantiles, "eff_samp":sum_w / max_w}
+
+def _credible_thresholds(H, levels):
+    ### density thresholds enclosing the given fractions of the total weight
+    Hflat = np.sort(H.flatten())[::-1]
+    cumulative = np.cumsum(Hflat)
+    cumulative /= cumulative[-1]
+    thresholds = [Hflat[min(np.searchsorted(cumulative, level), Hflat.size - 1)] for level in levels]
+    return np.unique(thresholds)
+
+def plot_binned_corner(summary, fig=None, color="black", labels=None, truths=None, levels=None, plot_density=True, font_size=16):
+    '''
+    Draw a corner plot from binned summaries.
+
+    Parameters
+    ----------
+    summary : dict
+        Binned summaries (see accumulate_binned_summaries)
+    fig : matplotlib.figure.Figure
+        Existing corner plot figure to draw on
+    color : str
+        Color for this sample set
+    labels : list
+        Axis labels
+    truths : list
+        True parameter values
+    levels : list
+        Credible levels for the 2-D contours (defaults to the same levels as
+        corner.py)
+    plot_density : bool
+        Shade the 2-D histograms
+    font_size : float
+        Font size for labels
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        Corner plot figure
+    '''
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap, to_rgba
+    nparams = len(summary["params"])
+    if labels is None:
+        labels = summary["params"]
+    if levels is None:
+        levels = 1.0 - np.exp(-0.5 * np.arange(0.5, 2.1, 0.5)**2)
+    if fig is None:
+        fig, axes = plt.subplots(nparams, nparams, figsize=(2.5 * nparams, 2.5 * nparams), squeeze=False)
+        fig.subplots_adjust(wspace=0.05, hspace=0.05)
+    else:
+        axes = np.array(fig.axes).reshape((nparams, nparams))
+    cmap = LinearSegmentedColormap.from_list("density", [to_rgba(color, 0.0), to_rgba(color, 0.6)])
+    edges = summary["edges"]
+    for i in range(nparams):
+        ax = axes[i,i]
+        ax.step(edges[i], np.append(summary["hist1d"][i], summary["hist1d"][i][-1]), where="post", color=color)
+        q05, q16, q50, q84, q95 = summary["quantiles"][i]
+        for value in [q05, q95]:
+            ax.axvline(value, color=color, linestyle="dashed")
+        if truths is not None:
+            ax.axvline(truths[i], color="#4682b4")
+        ax.set_title("{} = ${:.3g}^{{+{:.2g}}}_{{-{:.2g}}}$".format(labels[i], q50, q84 - q50, q50 - q16), fontsize=0.6 * font_size)
+        ax.set_xlim(edges[i][0], edges[i][-1])
+        ax.set_yticklabels([])
+        for j in range(nparams):
+            if j > i:
+                axes[i,j].set_visible(False)
+                continue
+            if j < i:
+                ax = axes[i,j]
+                H = summary["hist2d"][j,i].T
+                centers_x = 0.5 * (edges[j][1:] + edges[j][:-1])
+                centers_y = 0.5 * (edges[i][1:] + edges[i][:-1])
+                if plot_density:
+                    ax.pcolormesh(edges[j], edges[i], H, cmap=cmap)
+                thresholds = _credible_thresholds(H, levels)
+                if thresholds.size > 0 and np.max(H) > 0:
+                    ax.contour(centers_x, centers_y, H, levels=thresholds, colors=color)
+                if truths is not None:
+                    ax.axvline(truths[j], color="#4682b4")
+                    ax.axhline(truths[i], color="#4682b4")
+                ax.set_xlim(edges[j][0], edges[j][-1])
+                ax.set_ylim(edges[i][0], edges[i][-1])
+            ax = axes[i,j]
+            if i < nparams - 1:
+                ax.set_xticklabels([])
+            else:
+                ax.set_xlabel(labels[j], fontsize=font_size)
+            if j > 0 or i == 0:
+                ax.set_yticklabels([])
+            else:
+                ax.set_ylabel(labels[i], fontsize=font_size)
+    return fig
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Lightcurve Cube
+---------------
+Posterior-predictive lightcurves: the model evaluated for weighted draws from
+a posterior sample file, stored as a (draw x band x time) magnitude cube. Cubes
+are cached on disk (in $EM_PE_CACHE/lc_cubes, or ~/.cache/em_pe/lc_cubes by
+default), keyed by the sample file and every input that affects them, so plots
+and other diagnostics can be re-rendered without re-evaluating the model.
+"""
+
+from __future__ import print_function
+import os
+import json
+import hashlib
+import numpy as np
+
+from em_pe.models import model_dict
+from em_pe.utils.sample_io import load_samples
+from em_pe.utils.posterior import sample_weights, weighted_quantiles
+from em_pe.utils.cosmology import distance_modulus
+
+def _cache_dir():
+    return os.path.join(os.environ.get("EM_PE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "em_pe")), "lc_cubes")
+
+def compute_lc_cube(sample_file, m, bands, tmin, tmax, fixed_params=None, morph_comp="TP2", num_draws=100, n_pts=25, seed=None):
+    '''
+    Evaluate a model for weighted draws from a posterior sample file.
+
+    Parameters
+    ----------
+    sample_file : str
+        Posterior sample file
+    m : str
+        Name of model to use
+    bands : list
+        List of data bands
+    tmin : float
+        Start time
+    tmax : float
+        End time
+    fixed_params : list
+        List of [param_name, value] pairs
+    morph_comp : str
+        Morphology/composition (kn_interp_angle models only)
+    num_draws : int
+        Number of posterior draws. The first draw is replaced by the weighted
+        median of each parameter.
+    n_pts : int
+        Number of (log-spaced) times
+    seed : int
+        Random seed for the draws
+
+    Returns
+    -------
+    dict
+        Dictionary with the times ("t"), bands, parameter names and values of
+        the draws ("param_names", "params"), and the (draw x band x time)
+        magnitudes and magnitude errors ("mags", "mags_err")
+    '''
+    if m in ["kn_interp_angle", "kn_interp_angle_pca"]:
+        model = model_dict[m](morph_comp)
+    else:
+        model = model_dict[m]()
+    samples, header = load_samples(sample_file)
+    weights = sample_weights(samples)
+    param_names = header[3:]
+    rng = np.random.RandomState(seed)
+    param_array = samples[:,3:][rng.choice(weights.size, p=weights, size=num_draws)]
+    param_array[0] = weighted_quantiles(samples[:,3:], weights, 0.5)
+    t = np.logspace(np.log10(tmin), np.log10(tmax), n_pts)
+
+    params = dict(zip(param_names, param_array.T))
+    if fixed_params is not None:
+        for [name, val] in fixed_params:
+            params[name] = np.ones(num_draws) * float(val)
+    mags = np.empty((num_draws, len(bands), n_pts))
+    mags_err = np.empty((num_draws, len(bands), n_pts))
+    if model.vectorized:
+        model.set_params(params, [tmin, tmax])
+        lcs = model.evaluate_bands({band:t for band in bands})
+        for j, band in enumerate(bands):
+            mags[:,j] = np.reshape(lcs[band][0], (num_draws, n_pts))
+            mags_err[:,j] = np.broadcast_to(np.reshape(lcs[band][1], (-1, n_pts)), (num_draws, n_pts))
+    else:
+        model.prepare_batch(params)
+        for row in range(num_draws):
+            model.set_params({p:params[p][row] for p in params}, [tmin, tmax])
+            lcs = model.evaluate_bands({band:t for band in bands})
+            for j, band in enumerate(bands):
+                mags[row,j], mags_err[row,j] = lcs[band]
+    ### (for the remote model, this depends on the model being served)
+    if getattr(model, "served_model", m) not in ["kn_interp_angle", "kn_interp_angle_pca"]:
+        mags += distance_modulus(params["distance"]).reshape((-1, 1, 1))
+    return {"t":t, "bands":list(bands), "param_names":param_names, "params":param_array, "mags":mags, "mags_err":mags_err}
+
+def load_lc_cube(sample_file, m, bands, tmin, tmax, fixed_params=None, morph_comp="TP2", num_draws=100, n_pts=25, seed=None, cache=True):
+    '''
+    Get the lightcurve cube for a posterior sample file, from the on-disk cache
+    if it has already been computed (see compute_lc_cube for the parameters).
+    The cache is keyed by the sample file's path, size and modification time
+    along with all the other inputs.
+
+    Parameters
+    ----------
+    cache : bool
+        Read and write the on-disk cache
+
+    Returns
+    -------
+    dict
+        Lightcurve cube (see compute_lc_cube)
+    '''
+    stat = os.stat(sample_file)
+    key = json.dumps([os.path.abspath(sample_file), stat.st_size, stat.st_mtime, m, list(bands), tmin, tmax,
+                      [[name, float(val)] for [name, val] in fixed_params] if fixed_params is not None else None,
+                      morph_comp, num_draws, n_pts, seed])
+    fname = os.path.join(_cache_dir(), hashlib.sha1(key.encode()).hexdigest() + ".npz")
+    if cache and os.path.exists(fname):
+        with np.load(fname) as f:
+            cube = {k:f[k] for k in f.files}
+        cube["bands"] = [str(band) for band in cube["bands"]]
+        cube["param_names"] = [str(p) for p in cube["param_names"]]
+        return cube
+    cube = compute_lc_cube(sample_file, m, bands, tmin, tmax, fixed_params, morph_comp, num_draws, n_pts, seed)
+    if cache:
+        try:
+            if not os.path.exists(_cache_dir()):
+                os.makedirs(_cache_dir())
+            tmp_fname = fname + ".{}.tmp.npz".format(os.getpid())
+            np.savez(tmp_fname, **cube)
+            os.replace(tmp_fname, fname)
+        except OSError:
+            pass # the cache is only an optimization
+    return cube
+
+def lc_quantiles(cube, q):
+    '''
+    Quantiles of the posterior-predictive lightcurves.
+
+    Parameters
+    ----------
+    cube : dict
+        Lightcurve cube (see compute_lc_cube)
+    q : float or list
+        Quantile(s) to compute
+
+    Returns
+    -------
+    np.ndarray
+        (band x time) array of magnitudes, or (quantile x band x time) if q is
+        a list
+    '''
+    return np.quantile(cube["mags"], q, axis=0)
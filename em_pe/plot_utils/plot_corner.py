@@ -8,6 +8,9 @@ import numpy as np
 import corner
 import argparse
 
+from em_pe.utils.posterior import importance_weights
+from em_pe.plot_utils.binned_corner import accumulate_binned_summaries, plot_binned_corner
+
 #try:
 #    import matplotlib.pyplot as plt
 #except:
@@ -36,10 +39,55 @@ def _parse_command_line_args():
     parser.add_argument('--simulation-lnL', help='File with simulation log likelihoods')
     parser.add_argument('--font-size', type=float, default=16, help='Size of font for corner plot')
     parser.add_argument('--label-pad', type=float, default=1.3, help='Label padding to allow for larger font size')
+    parser.add_argument('--binned', action='store_true', help='Stream the samples into fixed-size weighted histograms and plot those, instead of loading every sample (for very large sample files)')
+    parser.add_argument('--bins', type=int, default=50, help='Number of bins per parameter for --binned')
     return parser.parse_args()
 
+def _generate_binned_corner_plot(sample_files, out, params, truths_dict, min_lnL, leg, cl, title, combine,
+                                 min_weight, log_mass, sim_points, font_size, label_pad, bins, tex_dict, color_list):
+    ### binned mode of generate_corner_plot(), which streams the samples into
+    ### fixed-size histograms instead of loading them
+    if sim_points is not None:
+        print('--simulation-points is not supported with --binned')
+    file_sets = [[file] for file in sample_files]
+    if combine:
+        file_sets.append(list(sample_files))
+        if leg is not None:
+            leg.append('combined')
+    plot_params = []
+    log_params = []
+    for name in params:
+        if log_mass and name in ["mej_dyn", "mej_wind"]:
+            name = "log_" + name
+            log_params.append(name)
+        plot_params.append(name)
+    if truths_dict is not None:
+        truths = np.array([truths_dict[name] for name in params])
+    else:
+        truths = None
+    labels = [tex_dict[param] if param in tex_dict else param for param in plot_params]
+    plt.rc('font', size=font_size)
+    plt.rc('lines', lw=2*float(font_size/16.))
+    fig_base = None
+    for ind, file_set in enumerate(file_sets):
+        summary = accumulate_binned_summaries(file_set, plot_params, nbins=bins, min_lnL=min_lnL, min_weight=min_weight, log_params=log_params)
+        plot_density = len(file_sets) == 1 or (combine and ind == len(file_sets) - 1)
+        fig_base = plot_binned_corner(summary, fig=fig_base, color=color_list[ind], labels=labels, truths=truths,
+                                      levels=None if cl in [None, 'default'] else cl, plot_density=plot_density, font_size=font_size)
+    if title is not None:
+        plt.title(title)
+    fig_base.subplots_adjust(right=label_pad, top=label_pad)
+    if leg is not None:
+        lgd = plt.legend(leg, bbox_to_anchor=(0, len(params)), loc='upper left', prop={"size":float(font_size*1.5)})
+        for i, handle in enumerate(lgd.legendHandles):
+            handle.set_color(color_list[i])
+        plt.savefig(out, bbox_extra_artists=(lgd,), bbox_inches='tight', pad_inches=label_pad/2)
+    else:
+        plt.savefig(out, bbox_inches='tight', pad_inches=label_pad/2)
+
 def generate_corner_plot(sample_files, out, params, truths=None, cutoff=0, frac=1.0, leg=None,
-                  cl='default', title=None, combine=False, min_weight=0, log_mass=False, sim_points=None, sim_lnL=None, font_size=16, label_pad=1.3):
+                  cl='default', title=None, combine=False, min_weight=0, log_mass=False, sim_points=None, sim_lnL=None, font_size=16, label_pad=1.3,
+                  binned=False, bins=50):
     '''
     Generates a corner plot for the specified posterior samples and parameters.
 
@@ -67,6 +115,12 @@ def generate_corner_plot(sample_files, out, params, truths=None, cutoff=0, frac=
     combine : bool
         Combine samples for all bands into a single dataset and plot this in
         addition to individual bands (useful for generating density gradient)
+    binned : bool
+        Stream the samples into fixed-size weighted 1-D and 2-D histograms and
+        plot those, so memory and plotting time do not grow with the number of
+        samples (--frac is not supported in this mode)
+    bins : int
+        Number of bins per parameter for binned mode
     '''
     ### colors to iterate through
     color_list=['black', 'red', 'blue', 'green', 'cyan', 'orange',
@@ -119,6 +173,13 @@ def generate_corner_plot(sample_files, out, params, truths=None, cutoff=0, frac=
                     truths_dict[name] = np.log10(truths_dict[name])
     else:
         truths_dict = None
+    if binned:
+        ### stream the samples into fixed-size histograms instead of loading them
+        if frac != 1.0:
+            print('--frac is not supported with --binned, use --c instead')
+        _generate_binned_corner_plot(sample_files, out, params, truths_dict, min_lnL, leg, cl, title, combine,
+                                     min_weight, log_mass, sim_points, font_size, label_pad, bins, tex_dict, color_list)
+        return
     fig_base = None
     i = 0
     total_samples = []
@@ -178,11 +239,8 @@ def generate_corner_plot(sample_files, out, params, truths=None, cutoff=0, frac=
         p_s = p_s[mask]
         ### get columns of array corresponding to actual parameter samples
         x = samples[:,[index_dict[name] for name in params]]
-        ### shift all the lnL values up so that we don't have rounding issues
-        lnL -= np.max(lnL)
-        L = np.exp(lnL)
         ### calculate weights
-        weights = L * p / p_s
+        weights = importance_weights(lnL, p, p_s)
         print("eff samp:", np.sum(weights) / np.max(weights))
         weights /= np.sum(weights)
         ### throw out points with weight less than minimum weight
@@ -286,4 +344,5 @@ if __name__ == '__main__':
     font_size = args.font_size
     label_pad = args.label_pad
     generate_corner_plot(sample_files, out, params, truths, cutoff, frac, leg, cl,
-                  title, combine, min_weight, log_mass, sim_points, sim_lnL, font_size=font_size, label_pad=label_pad)
+                  title, combine, min_weight, log_mass, sim_points, sim_lnL, font_size=font_size, label_pad=label_pad,
+                  binned=args.binned, bins=args.bins)
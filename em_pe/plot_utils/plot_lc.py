@@ -12,7 +12,9 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
-from em_pe.models import model_dict
+from em_pe.utils.event_data import load_band_data
+from em_pe.plot_utils.lc_cube import load_lc_cube
+from em_pe.utils.posterior import weighted_quantiles
 
 def _parse_command_line_args():
     '''
@@ -65,89 +67,21 @@ def generate_lc_plot(out, b, tmin, tmax, m=None, sample_file=None, lc_file=None,
     offsets = {"K":0, "H":1, "J":2, "y":3, "z":4, "i":5, "r":6, "g":7}
     plt.figure(figsize=(12, 8))
     if m is not None:
-        #model = model_dict[m](self)
-        if m == "kn_interp_angle":
-            model = model_dict[m](morph_comp)
-        else:
-            model = model_dict[m](self)
-        with open(sample_file) as f:
-            ### the "header" contains the column names
-            header = f.readline().strip().split(' ')
-        samples = np.loadtxt(sample_file)
-        header = header[1:]
-        lnL = samples[:,0]
-        #best_params = samples[np.argmax(lnL)][3:]
-        p = samples[:,1]
-        p_s = samples[:,2]
-        ### shift all the lnL values up so that we don't have rounding issues
-        lnL -= np.max(lnL)
-        L = np.exp(lnL)
-        ### calculate weights
-        weights = L * p / p_s
-        best_params = np.array([_quantile(samples[:,i], [0.5], weights=(weights / np.sum(weights)))[0] for i in range(3, len(header))])
-        _, c = samples.shape
-        num_samples = 100
-        random_param_ind = np.random.choice(np.arange(weights.size), p=(weights / np.sum(weights)), size=num_samples)
-        param_array = samples[:,3:][random_param_ind]
-        #for col in range(3, c):
-        #    p = header[col]
-        #    values = samples[:,col]
-        #    ### get intervals of parameters
-        #    lower = _quantile(values, 0.05, weights)
-        #    upper = _quantile(values, 0.95, weights)
-        #    ### randomly sample some points in this range
-        #    param_array[:,col - 3] = np.random.uniform(lower, upper, num_samples)
-        n_pts = 25
-        t = np.logspace(np.log10(tmin), np.log10(tmax), n_pts)
-        param_names = header[3:]
-        param_array[0] = best_params
-        #best_params = dict(zip(param_names, best_params))
-        #if fixed_params is not None:
-        #    for [name, val] in fixed_params:
-        #        best_params[name] = val
-        for band in b:
-            #model.set_params(best_params, [tmin, tmax])
-            #best_lc = model.evaluate(t, band)[0] + 5.0 * (np.log10(best_params['dist'] * 1.0e6) - 1.0)
+        ### the model is evaluated once per sample file (and cached), so re-plotting is cheap
+        cube = load_lc_cube(sample_file, m, b, tmin, tmax, fixed_params=fixed_params, morph_comp=morph_comp)
+        t = cube["t"]
+        for j, band in enumerate(b):
             if band in colors:
                 color = colors[band]
             else:
                 print("No matching color for band", band)
                 color=None
-            plot_ranges = True
-            if plot_ranges:
-                if model.vectorized:
-                    params = dict(zip(param_names, [param_array[:,i] for i in range(len(param_names))]))
-                    if fixed_params is not None:
-                        for [name, val] in fixed_params:
-                            params[name] = np.ones(num_samples) * val
-                    model.set_params(params, [tmin, tmax])
-                    lc_array, lc_err_array = model.evaluate(t, band)
-                    if m != "kn_interp_angle":
-                        for i in range(num_samples):
-                            lc_array[i] += 5.0 * (np.log10(params["distance"][i] * 1.0e6) - 1.0)
-                else:
-                    lc_array = np.empty((num_samples, n_pts))
-                    lc_err_array = np.empty((num_samples, n_pts))
-                    for row in range(num_samples):
-                        params = dict(zip(param_names, param_array[row]))
-                        if fixed_params is not None:
-                            for [name, val] in fixed_params:
-                                params[name] = val
-                        model.set_params(params, [tmin, tmax])
-                        dist = params['distance']
-                        lc_array[row], lc_err_array[row] = model.evaluate(t, band)
-                        if m != "kn_interp_angle":
-                            lc_array[row] += 5.0 * (np.log10(dist * 1.0e6) - 1.0)
-                lc_array += offsets[band]
-                #min_lc = np.amin(lc_array, axis=0)
-                #max_lc = np.amax(lc_array, axis=0)
-                best_lc = lc_array[0]
-                #plt.plot(t, min_lc, color=color, label=band)
-                #plt.plot(t, max_lc, color=color)
-                plt.plot(t, best_lc, color=color, label=band + " + " + str(offsets[band]))
-                min_lc = np.quantile(lc_array, 0.05, axis=0)
-                max_lc = np.quantile(lc_array, 0.95, axis=0)
-                plt.fill_between(t, min_lc, max_lc, color=color, alpha=0.1)
+            lc_array = cube["mags"][:,j] + offsets[band]
+            best_lc = lc_array[0]
+            plt.plot(t, best_lc, color=color, label=band + " + " + str(offsets[band]))
+            min_lc = np.quantile(lc_array, 0.05, axis=0)
+            max_lc = np.quantile(lc_array, 0.95, axis=0)
+            plt.fill_between(t, min_lc, max_lc, color=color, alpha=0.1)
     if lc_file is not None:
         minval = np.inf
         maxval = -np.inf
@@ -158,7 +92,7 @@ def generate_lc_plot(out, b, tmin, tmax, m=None, sample_file=None, lc_file=None,
             else:
                 print("No matching color for band", band)
                 color=None
-            lc = np.loadtxt(fname)
+            lc = load_band_data(fname)
             if lc.ndim == 1:
                 t = lc[0]
                 err = lc[3]
@@ -236,15 +170,7 @@ def _quantile(x, q, weights=None):
     if weights is None:
         return np.percentile(x, list(100.0 * q))
     else:
-        weights = np.atleast_1d(weights)
-        if len(x) != len(weights):
-            raise ValueError("Dimension mismatch: len(weights) != len(x)")
-        idx = np.argsort(x)
-        sw = weights[idx]
-        cdf = np.cumsum(sw)[:-1]
-        cdf /= cdf[-1]
-        cdf = np.append(0, cdf)
-    return np.interp(q, cdf, x[idx]).tolist()
+        return weighted_quantiles(x, weights, q).tolist()
 
 def main():
     args = _parse_command_line_args()
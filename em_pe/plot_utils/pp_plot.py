@@ -6,8 +6,11 @@ import matplotlib.pyplot as plt
 import argparse
 import os
 import json
+from functools import partial
+from multiprocessing import Pool
 
 from em_pe.models import model_dict, param_dict
+from em_pe.utils.posterior import summarize_sample_file
 
 parser = argparse.ArgumentParser(description="Script to generate PP plot")
 parser.add_argument("--m", help="Model to use")
@@ -15,10 +18,7 @@ parser.add_argument("--directory", help="PP plot run directory")
 parser.add_argument("--name", help="Name")
 parser.add_argument("--exclude-param", action="append", help="parameter to exclude from plot")
 parser.add_argument("--exclude-dir", action="append", help="Exclude a run by directory name")
-args = parser.parse_args()
-
-exclude_params = args.exclude_param if args.exclude_param is not None else []
-exclude_dir = args.exclude_dir if args.exclude_dir is not None else []
+parser.add_argument("--nprocs", type=int, default=1, help="Number of parallel processes to use for reading new or changed runs")
 
 eff_samp_cutoff = 10.0
 
@@ -50,128 +50,172 @@ tex_dict = {'mej':'$m_{ej}$',
             'sigma':'$\\sigma$'
 }
 
-base_dir = args.directory
-if base_dir[-1] != "/":
-    base_dir += "/"
-
-base_dir += args.name
-if base_dir[-1] != "/":
-    base_dir += "/"
-
-m = model_dict[args.m]()
-ordered_params = m.param_names + ["dist"]
-params = {p:param_dict[p]() for p in ordered_params}
-params_used = set()
-
-cache = {}
-eff_samp_list = []
-dir_list = []
-
-for d in os.listdir(base_dir):
-    curr_dir = base_dir + d + "/"
-    if not os.path.isdir(curr_dir) or "samples.txt" not in os.listdir(curr_dir) or curr_dir in exclude_dir or d in exclude_dir:
-        continue
-    print("reading samples from", curr_dir)
-    s = np.loadtxt(curr_dir + "samples.txt")
+def _file_key(fname):
+    ### (size, modification time) of a file, to tell when a run has changed
+    stat = os.stat(fname)
+    return [stat.st_size, stat.st_mtime]
+
+def _summarize_run(curr_dir, ordered_params):
+    ### reduce a run to its effective sample size and, for each parameter, the
+    ### credible level of the true value, the true value, and the max-lnL value
     truths = np.loadtxt(curr_dir + "test_truths.txt")
     truths = dict(zip(ordered_params, truths))
-    with open(curr_dir + "samples.txt") as f:
-        ### the "header" contains the column names
-        header = f.readline().strip().split(" ")[1:]
-    samples = {header[i]:s[:,i] for i in range(len(header))}
-    lnL = samples["lnL"]
-    p = samples["p"]
-    p_s = samples["p_s"]
-    temp = np.exp(lnL) * p / p_s
-    eff_samp = np.sum(temp) / np.max(temp)
-    print("    eff_samp = {}".format(eff_samp))
-    eff_samp_list.append(eff_samp)
-    dir_list.append(d)
-    L = np.exp(lnL - np.max(lnL))
-    weights = L * p / p_s
-    weights /= np.sum(weights)
-    for i in range(3, len(header)):
-        p = header[i]
+    ### streamed in chunks, so large sample files are never loaded at once
+    stats = summarize_sample_file(curr_dir + "samples.txt", truths=truths)
+    summary = {"eff_samp":float(stats["eff_samp"]), "params":{}}
+    for i, p in enumerate(stats["names"]):
+        summary["params"][p] = {"CDF":float(stats["CDF"][i]), "true":float(truths[p]), "ML":float(stats["ML"][i])}
+    return curr_dir, summary
+
+def main():
+    args = parser.parse_args()
+
+    exclude_params = args.exclude_param if args.exclude_param is not None else []
+    exclude_dir = args.exclude_dir if args.exclude_dir is not None else []
+
+    base_dir = args.directory
+    if base_dir[-1] != "/":
+        base_dir += "/"
+
+    base_dir += args.name
+    if base_dir[-1] != "/":
+        base_dir += "/"
+
+    m = model_dict[args.m]()
+    ordered_params = m.param_names + ["dist"]
+    params = {p:param_dict[p]() for p in ordered_params}
+    params_used = set()
+
+    ### per-run summaries are cached in an index in the run directory, keyed by the
+    ### sizes and modification times of each run's files, so only new or changed
+    ### runs are reprocessed
+    index_fname = base_dir + "pp_index.json"
+    index = {"params":ordered_params, "runs":{}}
+    if os.path.exists(index_fname):
+        with open(index_fname) as f:
+            old_index = json.load(f)
+        if old_index.get("params") == ordered_params:
+            index = old_index
+
+    run_dirs = []
+    stale = []
+    for d in sorted(os.listdir(base_dir)):
+        curr_dir = base_dir + d + "/"
+        if not os.path.isdir(curr_dir) or "samples.txt" not in os.listdir(curr_dir):
+            continue
+        run_dirs.append(d)
+        key = _file_key(curr_dir + "samples.txt") + _file_key(curr_dir + "test_truths.txt")
+        if d not in index["runs"] or index["runs"][d]["key"] != key:
+            index["runs"][d] = {"key":key}
+            stale.append(curr_dir)
+    ### forget runs that no longer exist
+    index["runs"] = {d:index["runs"][d] for d in run_dirs}
+
+    if len(stale) > 0:
+        print("reading samples from", len(stale), "new or changed runs (" + str(len(run_dirs) - len(stale)), "cached)")
+        with Pool(min(args.nprocs, len(stale))) as pool:
+            for curr_dir, summary in pool.imap_unordered(partial(_summarize_run, ordered_params=ordered_params), stale):
+                d = curr_dir.rstrip("/").split("/")[-1]
+                print("    {}: eff_samp = {}".format(d, summary["eff_samp"]))
+                index["runs"][d]["summary"] = summary
+        tmp_fname = index_fname + ".{}.tmp".format(os.getpid())
+        with open(tmp_fname, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_fname, index_fname)
+
+    cache = {}
+    eff_samp_list = []
+    dir_list = []
+
+    for d in run_dirs:
+        curr_dir = base_dir + d + "/"
+        if curr_dir in exclude_dir or d in exclude_dir:
+            continue
+        summary = index["runs"][d]["summary"]
+        eff_samp_list.append(summary["eff_samp"])
+        dir_list.append(d)
+        for p in summary["params"]:
+            if p in exclude_params: continue
+            if p not in params_used:
+                cache[p] = {"CDF":[], "true":[], "ML":[]}
+                params_used.add(p)
+            for key in ["CDF", "true", "ML"]:
+                cache[p][key].append(summary["params"][p][key])
+
+    eff_samp = np.array(eff_samp_list)
+    mask = eff_samp > eff_samp_cutoff
+    npts = eff_samp.size
+    npts_valid = np.sum(mask)
+
+    out_dict = {
+            i:{"params":{p:{} for p in params_used}, "eff_samp":eff_samp[i], "directory":dir_list[i]
+        } for i in range(npts)
+    }
+
+    plt.figure(figsize=(8, 8))
+
+    markers = {
+            "mej":"x",
+            "mej_red":"x",
+            "mej_purple":"x",
+            "mej_blue":"x",
+            "vej":"o",
+            "vej_red":"o",
+            "vej_purple":"o",
+            "vej_blue":"o",
+            "sigma":"+"
+    }
+    colors = {
+            "mej":"red",
+            "mej_red":"red",
+            "mej_purple":"purple",
+            "mej_blue":"blue",
+            "vej":"blue",
+            "vej_red":"red",
+            "vej_purple":"purple",
+            "vej_blue":"blue",
+            "sigma":"black"
+    }
+
+    for p in params_used:
         if p in exclude_params: continue
-        if p not in params_used:
-            cache[p] = {"CDF":[], "true":[], "ML":[]}
-            params_used.add(p)
-        cdf = np.sum(weights[samples[p] < truths[p]])
-        cache[p]["CDF"].append(cdf)
-        cache[p]["true"].append(truths[p])
-        cache[p]["ML"].append(samples[p][np.argmax(lnL)])
-
-eff_samp = np.array(eff_samp_list)
-mask = eff_samp > eff_samp_cutoff
-npts = eff_samp.size
-npts_valid = np.sum(mask)
-
-out_dict = {
-        i:{"params":{p:{} for p in params_used}, "eff_samp":eff_samp[i], "directory":dir_list[i]
-    } for i in range(npts)
-}
-
-plt.figure(figsize=(8, 8))
-
-markers = {
-        "mej":"x",
-        "mej_red":"x",
-        "mej_purple":"x",
-        "mej_blue":"x",
-        "vej":"o",
-        "vej_red":"o",
-        "vej_purple":"o",
-        "vej_blue":"o",
-        "sigma":"+"
-}
-colors = {
-        "mej":"red",
-        "mej_red":"red",
-        "mej_purple":"purple",
-        "mej_blue":"blue",
-        "vej":"blue",
-        "vej_red":"red",
-        "vej_purple":"purple",
-        "vej_blue":"blue",
-        "sigma":"black"
-}
-
-for p in params_used:
-    if p in exclude_params: continue
-    cdf = np.array(cache[p]["CDF"])
-    ind = np.argsort(cdf[mask])
-    j = 0.0
-    for i in range(npts):
-        out_dict[i]["params"][p]["CDF"] = cache[p]["CDF"][i]
-        out_dict[i]["params"][p]["true"] = cache[p]["true"][i]
-        out_dict[i]["params"][p]["ML"] = cache[p]["ML"][i]
-        if mask[i]:
-            (xval,) = np.where(ind == j)[0] / npts_valid
-            j += 1.0
-        else:
-            xval = np.nan
-        out_dict[i]["params"][p]["xval"] = xval
-    cdf = cdf[mask][ind]
-    plt.scatter(np.arange(npts_valid) / float(npts_valid), cdf,
-            label=(tex_dict[p] if p in tex_dict.keys() else p),
-            marker=(markers[p] if p in markers.keys() else None),
-            color=(colors[p] if p in colors.keys() else None)
-    )
-    
-
-
-xvals = np.linspace(0.0, 1.0, 100)
-plt.plot(xvals, xvals, "--", color="black")
-pvals_lims = binomial_credible_interval_default(xvals, npts_valid, nParams=(len(params_used) + len(exclude_params)))
-plt.plot(xvals, pvals_lims[:,0], color='k', ls=':')
-plt.plot(xvals, pvals_lims[:,1], color='k', ls=':')
-
-plt.xlabel("$P(x_{\\rm inj})$")
-plt.ylabel("$\hat{P}$")
-plt.legend()
-plt.tight_layout()
-
-plt.savefig("pp_plot.png")
-
-with open("out.json", "w") as f:
-    json.dump(out_dict, f, indent=4)
+        cdf = np.array(cache[p]["CDF"])
+        ind = np.argsort(cdf[mask])
+        j = 0.0
+        for i in range(npts):
+            out_dict[i]["params"][p]["CDF"] = cache[p]["CDF"][i]
+            out_dict[i]["params"][p]["true"] = cache[p]["true"][i]
+            out_dict[i]["params"][p]["ML"] = cache[p]["ML"][i]
+            if mask[i]:
+                (xval,) = np.where(ind == j)[0] / npts_valid
+                j += 1.0
+            else:
+                xval = np.nan
+            out_dict[i]["params"][p]["xval"] = xval
+        cdf = cdf[mask][ind]
+        plt.scatter(np.arange(npts_valid) / float(npts_valid), cdf,
+                label=(tex_dict[p] if p in tex_dict.keys() else p),
+                marker=(markers[p] if p in markers.keys() else None),
+                color=(colors[p] if p in colors.keys() else None)
+        )
+
+
+
+    xvals = np.linspace(0.0, 1.0, 100)
+    plt.plot(xvals, xvals, "--", color="black")
+    pvals_lims = binomial_credible_interval_default(xvals, npts_valid, nParams=(len(params_used) + len(exclude_params)))
+    plt.plot(xvals, pvals_lims[:,0], color='k', ls=':')
+    plt.plot(xvals, pvals_lims[:,1], color='k', ls=':')
+
+    plt.xlabel("$P(x_{\\rm inj})$")
+    plt.ylabel("$\hat{P}$")
+    plt.legend()
+    plt.tight_layout()
+
+    plt.savefig("pp_plot.png")
+
+    with open("out.json", "w") as f:
+        json.dump(out_dict, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,29 @@
 from __future__ import print_function
 import numpy as np
 import argparse
+import os
 import sys
 from multiprocessing import Pool
 
 ### hacky fix because the import system is different when run as a package vs.
 ### run as a script
 try:
-    from models import model_dict, param_dict
+    from models import model_dict, param_dict, GaussianPriorParameter
+    from utils.event_data import load_event_data
+    from utils.sample_io import save_samples
+    from utils.posterior import equal_weight_samples
+    from utils.cosmology import distance_modulus
 except ModuleNotFoundError:
-    from .models import model_dict, param_dict
+    from .models import model_dict, param_dict, GaussianPriorParameter
+    from .utils.event_data import load_event_data
+    from .utils.sample_io import save_samples
+    from .utils.posterior import equal_weight_samples
+    from .utils.cosmology import distance_modulus
 
-import RIFT.integrators.MonteCarloEnsemble as monte_carlo_integrator
-
-def _parse_command_line_args():
+def _parse_command_line_args(argv=None):
     '''
-    Parses and returns the command line arguments.
+    Parses and returns the command line arguments (from sys.argv, or from argv
+    if it is given).
     '''
     parser = argparse.ArgumentParser(description='Generate posterior parameter samples from lightcurve data')
     parser.add_argument('--dat', help='Path to data directory')
@@ -27,7 +35,7 @@ def _parse_command_line_args():
     parser.add_argument('--f', action='append', help='Name of a data file')
     parser.add_argument('--min', default=20, type=int, help='Minimum number of integrator iterations')
     parser.add_argument('--max', default=20, type=int, help='Maximum number of integrator iterations')
-    parser.add_argument('--out', help='Location to store posterior samples')
+    parser.add_argument('--out', help='Location to store posterior samples (.npy for binary output)')
     parser.add_argument('--ncomp', action='append', nargs=2, help='Number of Gaussian components for a given dimension')
     parser.add_argument('--fixed-param', action='append', nargs=2, help='Parameters with fixed values')
     parser.add_argument('--estimate-dist', action="store_true", help='Estimate distance')
@@ -44,7 +52,11 @@ def _parse_command_line_args():
     parser.add_argument('--rprocess-prior', action="store_true", help='Use r-process prior during sampling')
     parser.add_argument('--scale-factor', type=float, default=1.0, help='Scaling factor for r-process prior likelihood evaluation')
     parser.add_argument('--morph-comp', type=str, default="TP2", help='Morphology and composition specification')
-    return parser.parse_args()
+    parser.add_argument('--screen-model', help='Cheap model used to screen samples before evaluating the full model')
+    parser.add_argument('--screen-margin', type=float, default=10.0, help='Samples with screening lnL within this margin of the maximum screening lnL are evaluated with the full model')
+    parser.add_argument('--equal-weight-out', help='Also write an equal-weight posterior (drawn by systematic resampling) to this file')
+    parser.add_argument('--equal-weight-npts', type=int, default=5000, help='Number of samples in the equal-weight posterior')
+    return parser.parse_args(argv)
 
 class sampler:
     '''
@@ -70,12 +82,30 @@ class sampler:
         Number of Gaussian components to use for integrator
     fixed_params : list
         List of [param_name, value] pairs
+    screen_model : string
+        Name of a cheap model used to screen samples. If set, samples are
+        first scored with this model, and only those within screen_margin of
+        the maximum screening lnL (over all iterations so far) are evaluated
+        with the full model.
+    screen_margin : float
+        lnL margin for evaluating samples with the full model
+    model_cache : dict
+        Dictionary used to reuse model objects across sampler instances (e.g.
+        by a campaign runner). Models created by this sampler are stored in it,
+        and models already in it are used instead of creating new ones.
+    equal_weight_out : string
+        If set, also write an equal-weight posterior (systematically resampled
+        from the final samples, with the effective sample size in its
+        metadata) to this file
+    equal_weight_npts : int
+        Number of samples in the equal-weight posterior
     '''
     def __init__(self, data_loc, m, files, out, v=True, L_cutoff=0, min_iter=20,
                  max_iter=20, ncomp=None, fixed_params=None,
                  estimate_dist=True, epoch=5, correlate_dims=None, burn_in_length=None,
                  beta_start=1.0, beta_end=1.0, keep_npts=None, nprocs=1, limits=None, ignore_m_err=False, gaussian_prior_theta=None,
-                 rprocess_prior=True, scale_factor=1.0, morph_comp="TP2"):
+                 rprocess_prior=True, scale_factor=1.0, morph_comp="TP2", screen_model=None, screen_margin=10.0,
+                 model_cache=None, equal_weight_out=None, equal_weight_npts=5000):
         ### parameters passed in from user or main()
         self.data_loc = data_loc
         self.m = m
@@ -101,6 +131,11 @@ class sampler:
         self.rprocess_prior = rprocess_prior
         self.scale_factor = scale_factor
         self.morph_comp = morph_comp
+        self.screen_model = screen_model
+        self.screen_margin = screen_margin
+        self.model_cache = model_cache if model_cache is not None else {}
+        self.equal_weight_out = equal_weight_out
+        self.equal_weight_npts = equal_weight_npts
         self.limits = limits if limits is not None else {}
         if ncomp is None:
             self.ncomp = 1
@@ -117,6 +152,7 @@ class sampler:
         self.data = None
         self.bands_used = None
         self.models = []
+        self.screen_models = []
         self.params = None
         self.ordered_params = None
         self.bounds = None
@@ -125,6 +161,8 @@ class sampler:
         self.iteration_size = 0
 
         self.cumulative_lnL = np.array([])
+        self.cumulative_full_eval = np.array([], dtype=bool) # which samples were evaluated with the full model
+        self.max_screen_lnL = -1 * np.inf # maximum screening lnL so far (reference for the screening margin)
 
         ### initialization things
         self._read_data()
@@ -133,12 +171,10 @@ class sampler:
     def _read_data(self):
         if self.v:
             print('Loading data... ', end='')
-        data = {}
-        bands_used = []
-        for fname in self.files:
-            band = fname.split('.txt')[0]
-            data[band] = np.loadtxt(self.data_loc + fname)
-            bands_used.append(band)
+        ### bands are read from the event's binary container if there is one,
+        ### falling back to the individual [band].txt files
+        bands_used = [fname.split('.txt')[0] for fname in self.files]
+        data, _ = load_event_data(self.data_loc, bands_used)
         if self.v:
             print('finished')
         self.data = data
@@ -149,11 +185,10 @@ class sampler:
             print('Initializing models... ', end='')
         ### initialize model objects (one for each parallel process)
         for i in range(self.nprocs):
-            if self.m == "kn_interp_angle":
-                model = model_dict[self.m](self.morph_comp)
-            else:
-                model = model_dict[self.m]()
+            model = self._make_model(self.m, i)
             self.models.append(model)
+            if self.screen_model is not None:
+                self.screen_models.append(self._make_model(self.screen_model, i))
             ordered_params = [] # keep track of all parameters used
             bounds = [] # bounds for each parameter
             params = {}
@@ -177,6 +212,14 @@ class sampler:
             ordered_params.append('dist')
             params["dist"] = param_dict["dist"]()
             bounds.append([params["dist"].llim, params["dist"].rlim])
+        if self.gaussian_prior_theta is not None and "theta" in params:
+            ### replaces the default uniform prior, truncated to the same limits
+            mean, std = self.gaussian_prior_theta
+            params["theta"] = GaussianPriorParameter("theta", params["theta"].llim, params["theta"].rlim, mean, std)
+        for model in self.screen_models[:1]:
+            for param in model.param_names:
+                if param not in ordered_params and param not in self.fixed_params and param != "distance":
+                    raise ValueError("Screening model parameter '" + param + "' is not a parameter of " + self.m)
         self.params = params
         self.ordered_params = ordered_params
         self.bounds = bounds
@@ -184,18 +227,25 @@ class sampler:
         if self.v:
             print('finished')
 
+    def _make_model(self, m, index=0):
+        ### each parallel process gets its own model object, so cache them by index
+        key = (m, self.morph_comp, index)
+        if key not in self.model_cache:
+            if m in ["kn_interp_angle", "kn_interp_angle_pca"]:
+                self.model_cache[key] = model_dict[m](self.morph_comp)
+            else:
+                self.model_cache[key] = model_dict[m]()
+        return self.model_cache[key]
+
     def _prior(self, sample_array):
         n, m = sample_array.shape
-        ret = np.ones(n)
         index_dict = dict(zip(self.ordered_params, range(len(self.ordered_params))))
-        ### evaluate the prior for each parameter
+        ### sum the log priors for the whole batch (note that the integrator
+        ### takes prior densities, so the sum is exponentiated at the end, and
+        ### can still underflow for very small priors)
+        log_prior = np.zeros(n)
         for p in self.ordered_params:
-            x = sample_array[:,index_dict[p]]
-            if self.gaussian_prior_theta is not None and p == "theta":
-                from scipy.stats import norm
-                ret *= norm.pdf(x, loc=self.gaussian_prior_theta[0], scale=self.gaussian_prior_theta[1])
-            else:
-                ret *= self.params[p].prior(x)
+            log_prior += self.params[p].log_prior(sample_array[:,index_dict[p]])
         if self.rprocess_prior:
             from scipy.interpolate import interp2d
             x = sample_array[:, index_dict['mej_dyn']]
@@ -212,8 +262,8 @@ class sampler:
             r -= np.min(r)
             log_prior_joint = interp2d(md, mw, r, kind='cubic')
             prior_2d = np.array([log_prior_joint(x[i], y[i]) for i in range(x.shape[0])])
-            ret *= np.exp(-self.scale_factor*prior_2d).flatten()
-        return ret.reshape((n, 1))
+            log_prior -= self.scale_factor*prior_2d.flatten()
+        return np.exp(log_prior).reshape((n, 1))
 
     def _evaluate_lnL(self, params, model, vectorized=False):
         temp_data = {} # used to hold model data and squared model error
@@ -221,23 +271,23 @@ class sampler:
             temp_data[band] = [None, None]
         ### evaluate each model for the params, in the required bands
         model.set_params(params, self.t_bounds)
+        tvec_dict = {}
         for band in model.bands:
             if band not in self.bands_used:
                 continue
             try:
-                t = self.data[band][:,0]
+                tvec_dict[band] = self.data[band][:,0]
             except IndexError:
-                t = np.array(self.data[band][0]).reshape(1)
-            m, m_err = model.evaluate(t, band)
+                tvec_dict[band] = np.array(self.data[band][0]).reshape(1)
+        for band, (m, m_err) in model.evaluate_bands(tvec_dict).items():
             temp_data[band][0] = m
             temp_data[band][1] = m_err
             if 'dist' in params:
-                dist = params['dist']
+                ### apply the distance modulus to the whole batch at once
                 if vectorized:
-                    for i in range(dist.size):
-                        temp_data[band][0][i] += 5.0 * (np.log10(dist[i] * 1.0e6) - 1.0)
+                    temp_data[band][0] = temp_data[band][0] + distance_modulus(params['dist']).reshape((-1, 1))
                 else:
-                    temp_data[band][0] += 5.0 * (np.log10(dist * 1.0e6) - 1.0)
+                    temp_data[band][0] += distance_modulus(params['dist'])
 
         if vectorized:
             for band in self.bands_used:
@@ -270,29 +320,35 @@ class sampler:
             lnL += np.sum(diff**2 / (err**2 + m_err**2) + np.log(2.0 * np.pi * (err**2 + m_err**2)))
         return -0.5 * lnL
 
-    def _get_current_samples(self):
+    def _get_current_samples(self, return_flags=False):
         samples = np.copy(self.cumulative_lnL).reshape((self.cumulative_lnL.size, 1))
         samples = np.append(samples, self.integrator.cumulative_p, axis=1)
         samples = np.append(samples, self.integrator.cumulative_p_s, axis=1)
         samples = np.append(samples, self.integrator.cumulative_samples, axis=1)
+        full_eval = self.cumulative_full_eval
         if self.keep_npts is not None and self.keep_npts < samples.shape[0]:
             ind_sorted = np.argsort(samples[:,0])
             samples = samples[ind_sorted[samples.shape[0] - self.keep_npts:]]
+            full_eval = full_eval[ind_sorted[full_eval.size - self.keep_npts:]]
+        if return_flags:
+            return samples, full_eval
         return samples
 
     def _integrand_subprocess(self, arg):
         model, samples = arg
 
+        params = {}
+        for i, p in enumerate(self.ordered_params):
+            params[p] = samples[:,i]
+        for p in self.fixed_params:
+            params[p] = self.fixed_params[p] * np.ones(samples.shape[0])
+
         ### if the model is vectorized, use that
         if model.vectorized:
-            params = {}
-            for i, p in enumerate(self.ordered_params):
-                params[p] = samples[:,i]
-            for p in self.fixed_params:
-                params[p] = self.fixed_params[p] * np.ones(samples.shape[0])
             return self._evaluate_lnL(params, model, vectorized=True)
 
-        ### otherwise do it in a loop
+        ### otherwise do it in a loop, after letting the model precompute anything it can for the whole batch
+        model.prepare_batch(params)
         ret = np.empty(samples.shape[0])
         for i in range(samples.shape[0]):
             row = samples[i]
@@ -302,15 +358,28 @@ class sampler:
             ret[i] = self._evaluate_lnL(params, model)
         return ret
 
+    def _evaluate_samples(self, models, samples):
+        ### evaluate lnL for an array of samples, split over the parallel processes
+        nprocs = min(self.nprocs, samples.shape[0])
+        if nprocs == 1:
+            return self._integrand_subprocess((models[0], samples))
+        elif nprocs > 1:
+            samples_split = np.array_split(samples, nprocs)
+            args = zip(models, samples_split)
+            with Pool(nprocs) as p:
+                return np.concatenate(p.map(self._integrand_subprocess, args))
+        elif self.nprocs < 1:
+            raise RuntimeError("nprocs < 1: How can you have less than 1 process?")
+        return np.empty(0)
+
     def _integrand(self, samples):
         if self.v:
             print("Iteration", self.iteration)
         if self.iteration > 0:
-            header = 'lnL p p_s ' + ' '.join(self.ordered_params)
             if self.v:
                 print("saving intermediate samples...")
             fname = self.out.split(".")[0] + "_intermediate" + str(self.iteration) + "." + "".join(self.out.split(".")[1:])
-            np.savetxt(fname, self._get_current_samples()[-self.iteration_size:], header=header)
+            save_samples(fname, self._get_current_samples()[-self.iteration_size:], ['lnL', 'p', 'p_s'] + self.ordered_params)
         if self.burn_in_length is not None and self.iteration < self.burn_in_length:
             beta = np.exp((1.0 - self.iteration / (self.burn_in_length + 1.0)) * np.log(self.beta_start)
                     + self.iteration * np.log(self.beta_end) / (self.burn_in_length + 1.0)) # evenly-spaced on log scale
@@ -318,20 +387,27 @@ class sampler:
             beta = self.beta_end
         n, _ = samples.shape
         self.iteration_size = n
-        if self.nprocs == 1:
-            ret = self._integrand_subprocess((self.models[0], samples))
-        elif self.nprocs > 1:
-            samples_split = np.array_split(samples, self.nprocs)
-            args = zip(self.models, samples_split)
-            with Pool(self.nprocs) as p:
-                ret = np.concatenate(p.map(self._integrand_subprocess, args))
+        if self.screen_models:
+            ### score everything with the cheap model, and only use the full model for samples that could matter
+            ret = self._evaluate_samples(self.screen_models, samples)
+            ret[np.isnan(ret)] = -1 * np.inf
+            ### the margin is measured from the maximum screening lnL (not the full model's), so a
+            ### screening model that is biased relative to the full model does not shift the cut
+            self.max_screen_lnL = max(self.max_screen_lnL, np.max(ret))
+            full_eval = ret >= self.max_screen_lnL - self.screen_margin
+            if np.any(full_eval):
+                ret[full_eval] = self._evaluate_samples(self.models, samples[full_eval])
+            if self.v:
+                print("points evaluated with full model:", np.sum(full_eval), "of", n)
         else:
-            raise RuntimeError("nprocs < 1: How can you have less than 1 process?")
+            ret = self._evaluate_samples(self.models, samples)
+            full_eval = np.ones(n, dtype=bool)
         ret = ret.reshape((n, 1))
         #print(np.min(ret), np.max(ret))
         ret[np.isnan(ret)] = -1 * np.inf
         self.iteration += 1
         self.cumulative_lnL = np.append(self.cumulative_lnL, ret)
+        self.cumulative_full_eval = np.append(self.cumulative_full_eval, full_eval)
         ret *= beta
         if self.v:
             print("points with non-zero likelihood:", np.sum(np.exp(ret - np.max(ret)) > 0.0))
@@ -369,7 +445,9 @@ class sampler:
                     if ind in ind_tuple:
                         ncomp[ind_tuple] = self.ncomp[p]
                         break
-        ### initialize and run the integrator
+        ### initialize and run the integrator (RIFT is only imported here, so
+        ### importing the sampler module stays cheap)
+        import RIFT.integrators.MonteCarloEnsemble as monte_carlo_integrator
         self.integrator = monte_carlo_integrator.integrator(dim, self.bounds, gmm_dict, ncomp,
                         proc_count=None, L_cutoff=self.L_cutoff, use_lnL=True,
                         user_func=sys.stdout.flush(), prior=self._prior)
@@ -385,8 +463,19 @@ class sampler:
         Generate posterior samples.
         '''
         samples = self._generate_samples()
-        header = 'lnL p p_s ' + ' '.join(self.ordered_params)
-        np.savetxt(self.out, samples, header=header)
+        if self.screen_models:
+            ### flag which rows were evaluated with the full model (the others have the screening model's lnL)
+            _, full_eval = self._get_current_samples(return_flags=True)
+            fname = os.path.splitext(self.out)[0] + "_full_eval.txt"
+            np.savetxt(fname, full_eval.astype(int), fmt="%d", header="full_eval")
+        if self.equal_weight_out is not None:
+            equal_samples, metadata = equal_weight_samples(samples, self.equal_weight_npts)
+            save_samples(self.equal_weight_out, equal_samples, ['lnL', 'p', 'p_s'] + self.ordered_params, metadata=metadata)
+            if self.v:
+                print('Effective sample size:', metadata['ess'])
+        ### the main sample file is written last (and atomically), so that its
+        ### existence means the run and all its outputs are complete
+        save_samples(self.out, samples, ['lnL', 'p', 'p_s'] + self.ordered_params)
 
     def log_likelihood(self, samples, vect=False):
         '''
@@ -420,8 +509,8 @@ class sampler:
             sample_array[:,col] = samples[self.ordered_params[col]]
         return self._integrand(sample_array)
 
-def main():
-    args = _parse_command_line_args()
+def main(argv=None, model_cache=None):
+    args = _parse_command_line_args(argv)
     data_loc = args.dat
     m = args.m
     v = args.v
@@ -454,7 +543,9 @@ def main():
         limits = None
     s = sampler(data_loc, m, files, out, v=v, L_cutoff=L_cutoff, min_iter=min_iter, max_iter=max_iter, ncomp=ncomp, 
             fixed_params=fixed_params, estimate_dist=estimate_dist, epoch=epoch, correlate_dims=correlate_dims,
-            burn_in_length=burn_in_length, beta_start=beta_start, beta_end=beta_end, keep_npts=keep_npts, nprocs=nprocs, limits=limits, ignore_m_err=args.ignore_model_error, gaussian_prior_theta=args.gaussian_prior_theta, rprocess_prior=args.rprocess_prior, scale_factor=scale_factor, morph_comp=morph_comp)
+            burn_in_length=burn_in_length, beta_start=beta_start, beta_end=beta_end, keep_npts=keep_npts, nprocs=nprocs, limits=limits, ignore_m_err=args.ignore_model_error, gaussian_prior_theta=args.gaussian_prior_theta, rprocess_prior=args.rprocess_prior, scale_factor=scale_factor, morph_comp=morph_comp,
+            screen_model=args.screen_model, screen_margin=args.screen_margin, model_cache=model_cache,
+            equal_weight_out=args.equal_weight_out, equal_weight_npts=args.equal_weight_npts)
     #        burn_in_length, burn_in_start, beta_start, keep_npts, nprocs)
     s.generate_samples()
 
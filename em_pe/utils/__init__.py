@@ -1 +1,5 @@
 from .utils import *
+from .cosmology import distance_table, redshift_from_distance, distance_from_redshift, distance_modulus
+from .event_data import save_event_data, load_event_data, load_band_data
+from .sample_io import save_samples, load_samples, read_sample_names, read_sample_metadata, iter_sample_chunks
+from .posterior import importance_weights, sample_weights, effective_sample_size, weighted_quantiles, credible_levels, summarize_samples, summarize_sample_file, weight_statistics, systematic_resample, equal_weight_samples, resample_sample_file
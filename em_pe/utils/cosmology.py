@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Cosmology
+---------
+Luminosity distance/redshift lookup tables for flat Lambda-CDM cosmologies.
+Tables are computed once per (H0, Om0), cached on disk (in $EM_PE_CACHE, or
+~/.cache/em_pe by default), and evaluated with vectorized interpolation.
+"""
+
+import os
+from functools import lru_cache
+import numpy as np
+
+C_KM_S = 299792.458 # speed of light in km/s
+
+def _cache_dir():
+    return os.environ.get("EM_PE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "em_pe"))
+
+def _compute_table(H0, Om0, zmax=10.0, npts=20000):
+    ### comoving distance is (c / H0) * int_0^z dz' / E(z'), and the luminosity
+    ### distance is (1 + z) times that (the same as astropy's FlatLambdaCDM with
+    ### no radiation)
+    z = np.linspace(0.0, zmax, npts)
+    inv_E = 1.0 / np.sqrt(Om0 * (1.0 + z)**3 + 1.0 - Om0)
+    d_C = np.empty(npts)
+    d_C[0] = 0.0
+    d_C[1:] = np.cumsum(0.5 * (inv_E[1:] + inv_E[:-1]) * np.diff(z))
+    d_L = (1.0 + z) * d_C * C_KM_S / H0
+    return z, d_L
+
+@lru_cache(maxsize=None)
+def distance_table(H0=70.0, Om0=0.3):
+    """
+    Get the luminosity distance table for a cosmology, computing and caching it
+    if needed.
+
+    Parameters
+    ----------
+    H0 : float
+        Hubble constant (in km/s/Mpc)
+    Om0 : float
+        Matter density parameter
+
+    Returns
+    -------
+    tuple
+        Arrays of redshifts and luminosity distances (in Mpc)
+    """
+    fname = os.path.join(_cache_dir(), "cosmology_H0_{:g}_Om0_{:g}.npz".format(H0, Om0))
+    if os.path.exists(fname):
+        with np.load(fname) as f:
+            return f["z"], f["d_L"]
+    z, d_L = _compute_table(H0, Om0)
+    try:
+        if not os.path.exists(_cache_dir()):
+            os.makedirs(_cache_dir())
+        ### write to a temporary file first, so concurrent processes never see a partial table
+        tmp_fname = fname + ".{}.tmp.npz".format(os.getpid())
+        np.savez(tmp_fname, z=z, d_L=d_L)
+        os.replace(tmp_fname, fname)
+    except OSError:
+        pass # the cache is only an optimization
+    return z, d_L
+
+def redshift_from_distance(d, H0=70.0, Om0=0.3):
+    """
+    Redshift at given luminosity distances.
+
+    Parameters
+    ----------
+    d : float or np.ndarray
+        Luminosity distance(s) (in Mpc)
+    H0 : float
+        Hubble constant (in km/s/Mpc)
+    Om0 : float
+        Matter density parameter
+
+    Returns
+    -------
+    float or np.ndarray
+        Redshift(s)
+    """
+    z, d_L = distance_table(H0, Om0)
+    return np.interp(d, d_L, z)
+
+def distance_from_redshift(z, H0=70.0, Om0=0.3):
+    """
+    Luminosity distance at given redshifts.
+
+    Parameters
+    ----------
+    z : float or np.ndarray
+        Redshift(s)
+    H0 : float
+        Hubble constant (in km/s/Mpc)
+    Om0 : float
+        Matter density parameter
+
+    Returns
+    -------
+    float or np.ndarray
+        Luminosity distance(s) (in Mpc)
+    """
+    z_table, d_L = distance_table(H0, Om0)
+    return np.interp(z, z_table, d_L)
+
+def distance_modulus(d):
+    """
+    Distance modulus for given luminosity distances.
+
+    Parameters
+    ----------
+    d : float or np.ndarray
+        Luminosity distance(s) (in Mpc)
+
+    Returns
+    -------
+    float or np.ndarray
+        Distance modulus (in magnitudes)
+    """
+    return 5.0 * (np.log10(np.asarray(d) * 1.0e6) - 1.0)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Event data
+----------
+Binary container holding the lightcurve data for all bands of an event, with
+transparent fallback to the per-band text files ([band].txt). A band's text
+file takes precedence over the container when it is newer (e.g. after it has
+been edited by hand or rewritten by another tool).
+
+Each band is stored as an (n x 4) array with columns [time, time error,
+magnitude, magnitude error], the same layout as the text files.
+"""
+
+import os
+import json
+import numpy as np
+
+EVENT_FNAME = "event.npz"
+
+def save_event_data(out, data_dict, **metadata):
+    """
+    Save the data for all bands of an event in a single binary file.
+
+    Parameters
+    ----------
+    out : string
+        Directory to save data to
+    data_dict : dict
+        Dictionary mapping band names to (n x 4) data arrays
+    metadata : dict
+        Extra information about the event (e.g. t0, source), stored as JSON
+    """
+    arrays = {"band_" + band:np.reshape(data_dict[band], (-1, 4)) for band in data_dict}
+    arrays["metadata"] = np.array(json.dumps(metadata))
+    np.savez(os.path.join(out, EVENT_FNAME), **arrays)
+
+def load_event_data(data_loc, bands=None):
+    """
+    Load the data for an event. Bands are read from the binary container if it
+    exists, and from [band].txt otherwise or if the text file is newer than the
+    container.
+
+    Parameters
+    ----------
+    data_loc : string
+        Directory containing the data
+    bands : list
+        Bands to load (defaults to all bands in the container)
+
+    Returns
+    -------
+    tuple
+        Dictionary mapping band names to data arrays, and dictionary of metadata
+    """
+    data = {}
+    metadata = {}
+    fname = os.path.join(data_loc, EVENT_FNAME)
+    if os.path.exists(fname):
+        container_mtime = os.path.getmtime(fname)
+        with np.load(fname) as f:
+            metadata = json.loads(str(f["metadata"]))
+            for key in f.files:
+                band = key[5:]
+                if key.startswith("band_") and (bands is None or band in bands):
+                    txt_fname = os.path.join(data_loc, band + ".txt")
+                    if os.path.exists(txt_fname) and os.path.getmtime(txt_fname) > container_mtime:
+                        ### the container is stale for this band
+                        data[band] = np.loadtxt(txt_fname)
+                    else:
+                        data[band] = f[key]
+    if bands is not None:
+        for band in bands:
+            if band not in data:
+                data[band] = np.loadtxt(os.path.join(data_loc, band + ".txt"))
+    return data, metadata
+
+def load_band_data(fname):
+    """
+    Load the data for one band given the name of its text file ([band].txt),
+    reading it from the binary container in the same directory if there is one.
+
+    Parameters
+    ----------
+    fname : string
+        Name of the band's text file
+
+    Returns
+    -------
+    np.ndarray
+        Data array
+    """
+    data_loc, band = os.path.split(fname)
+    band = band.split(".txt")[0]
+    data, _ = load_event_data(data_loc, [band])
+    return data[band]
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Posterior
+---------
+Importance weights of posterior samples (exp(lnL - max(lnL)) * p / p_s), their
+effective sample size, weighted summaries (quantiles, credible levels of true
+values, maximum-likelihood values) for every parameter at once, and
+equal-weight posteriors drawn from them by systematic resampling. Everything
+works either on in-memory arrays or by streaming through sample files in
+chunks. Equal-weight sample files keep the usual columns, with p and p_s set so
+that every row has the same weight, so existing tools can read them unchanged.
+"""
+
+import numpy as np
+
+from .sample_io import read_sample_names, iter_sample_chunks, save_samples
+
+def importance_weights(lnL, p, p_s):
+    """
+    Unnormalized importance weights, exp(lnL - max(lnL)) * p / p_s.
+
+    Parameters
+    ----------
+    lnL : np.ndarray
+        Log-likelihoods
+    p : np.ndarray
+        Prior densities
+    p_s : np.ndarray
+        Sampling densities
+
+    Returns
+    -------
+    np.ndarray
+        Weights (with a maximum-likelihood sample having weight p / p_s)
+    """
+    ### shift all the lnL values up so that we don't have rounding issues
+    return np.exp(lnL - np.max(lnL)) * p / p_s
+
+def sample_weights(samples):
+    """
+    Normalized importance weights of posterior samples.
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        (n x ncol) array of samples, with lnL, p, and p_s in the first three
+        columns
+
+    Returns
+    -------
+    np.ndarray
+        Weights (summing to 1)
+    """
+    weights = importance_weights(samples[:,0], samples[:,1], samples[:,2])
+    return weights / np.sum(weights)
+
+def effective_sample_size(weights):
+    """
+    Kish effective sample size, (sum(w))^2 / sum(w^2).
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        Sample weights (need not be normalized)
+
+    Returns
+    -------
+    float
+        Effective sample size
+    """
+    return np.sum(weights)**2 / np.sum(weights**2)
+
+def weighted_quantiles(x, weights, q):
+    """
+    Weighted quantiles of every column of an array, with one argsort per
+    column. Uses the same interpolation as corner.py.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        (n) or (n x k) array of samples
+    weights : np.ndarray
+        Sample weights (need not be normalized)
+    q : float or list
+        Quantile(s) to compute, between 0 and 1
+
+    Returns
+    -------
+    np.ndarray
+        Quantiles, with shape q.shape + x.shape[1:]
+    """
+    x = np.asarray(x, dtype=float)
+    q = np.asarray(q, dtype=float)
+    if np.any(q < 0.0) or np.any(q > 1.0):
+        raise ValueError("Quantiles must be between 0 and 1")
+    if x.shape[0] != np.size(weights):
+        raise ValueError("Dimension mismatch: len(weights) != len(x)")
+    x2 = x.reshape((x.shape[0], -1))
+    idx = np.argsort(x2, axis=0)
+    x_sorted = np.take_along_axis(x2, idx, axis=0)
+    cdf = np.cumsum(np.asarray(weights)[idx], axis=0)[:-1]
+    cdf = np.concatenate([np.zeros((1, x2.shape[1])), cdf / cdf[-1]], axis=0)
+    ret = np.array([np.interp(q.ravel(), cdf[:,j], x_sorted[:,j]) for j in range(x2.shape[1])]).T
+    return ret.reshape(q.shape + x.shape[1:])
+
+def credible_levels(x, weights, truths):
+    """
+    Credible level of a value in each column: the weighted fraction of samples
+    below it.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        (n x k) array of samples
+    weights : np.ndarray
+        Sample weights (need not be normalized)
+    truths : np.ndarray
+        (k) array of values
+
+    Returns
+    -------
+    np.ndarray
+        (k) array of credible levels
+    """
+    return np.dot(weights, x < np.asarray(truths)) / np.sum(weights)
+
+def summarize_samples(samples, names, q=(0.05, 0.5, 0.95), truths=None):
+    """
+    Summarize an array of posterior samples.
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        (n x ncol) array of samples, with lnL, p, and p_s in the first three
+        columns
+    names : list
+        Column names
+    q : list
+        Quantiles to compute
+    truths : dict
+        True parameter values, for credible levels
+
+    Returns
+    -------
+    dict
+        Dictionary with the parameter names ("names"), effective sample sizes
+        ("ess", Kish, and "eff_samp", sum(w) / max(w)), quantile levels and
+        (quantile x parameter) quantiles, medians, maximum-likelihood values
+        ("ML"), and, if truths are given, the credible level of each true value
+        ("CDF")
+    """
+    weights = importance_weights(samples[:,0], samples[:,1], samples[:,2])
+    x = samples[:,3:]
+    q = np.atleast_1d(q)
+    ### the median is computed along with the other quantiles, so each column is only sorted once
+    quantiles = weighted_quantiles(x, weights, np.append(q, 0.5))
+    summary = {"names":list(names[3:]), "ess":effective_sample_size(weights),
+               "eff_samp":np.sum(weights) / np.max(weights), "quantile_levels":q,
+               "quantiles":quantiles[:-1], "median":quantiles[-1],
+               "ML":x[np.argmax(samples[:,0])]}
+    if truths is not None:
+        summary["CDF"] = credible_levels(x, weights, [truths[name] for name in summary["names"]])
+    return summary
+
+def weight_statistics(fnames, chunk_size=100000, min_lnL=-np.inf, transform=None):
+    """
+    Stream through sample files and accumulate the weight normalization and
+    parameter ranges. Weights are kept relative to the running maximum lnL, and
+    rescaled whenever it changes.
+
+    Parameters
+    ----------
+    fnames : str or list
+        Sample file(s), treated as a single sample set
+    chunk_size : int
+        Number of rows to read at a time
+    min_lnL : float
+        Minimum lnL for samples to keep
+    transform : function or list
+        Function mapping a chunk of samples to the (n x k) array of values whose
+        ranges are tracked (by default, the parameter columns), or a list with
+        one such function per file (e.g. for files with different column orders)
+
+    Returns
+    -------
+    dict
+        Dictionary with the maximum lnL ("max_lnL"), sum of weights and squared
+        weights and maximum weight (all relative to exp(max_lnL)), number of
+        samples ("n"), minimum and maximum values ("lo", "hi"), and the
+        maximum-likelihood row ("ML")
+    """
+    if isinstance(fnames, str):
+        fnames = [fnames]
+    if transform is None:
+        transform = lambda chunk: chunk[:,3:]
+    transforms = transform if isinstance(transform, (list, tuple)) else [transform] * len(fnames)
+    stats = {"max_lnL":-np.inf, "sum_w":0.0, "sum_w2":0.0, "max_w":0.0, "n":0, "lo":None, "hi":None, "ML":None}
+    for fname, transform in zip(fnames, transforms):
+        for chunk in iter_sample_chunks(fname, chunk_size):
+            chunk = chunk[chunk[:,0] > min_lnL]
+            if chunk.shape[0] == 0:
+                continue
+            new_max = max(stats["max_lnL"], np.max(chunk[:,0]))
+            scale = np.exp(stats["max_lnL"] - new_max) if np.isfinite(stats["max_lnL"]) else 0.0
+            w = np.exp(chunk[:,0] - new_max) * chunk[:,1] / chunk[:,2]
+            stats["sum_w"] = stats["sum_w"] * scale + np.sum(w)
+            stats["sum_w2"] = stats["sum_w2"] * scale**2 + np.sum(w**2)
+            stats["max_w"] = max(stats["max_w"] * scale, np.max(w))
+            if new_max > stats["max_lnL"]:
+                stats["ML"] = chunk[np.argmax(chunk[:,0])]
+            stats["max_lnL"] = new_max
+            stats["n"] += chunk.shape[0]
+            x = transform(chunk)
+            lo, hi = np.min(x, axis=0), np.max(x, axis=0)
+            stats["lo"] = lo if stats["lo"] is None else np.minimum(stats["lo"], lo)
+            stats["hi"] = hi if stats["hi"] is None else np.maximum(stats["hi"], hi)
+    if stats["sum_w"] == 0.0:
+        raise ValueError("No samples with nonzero weight in " + ", ".join(fnames))
+    return stats
+
+def summarize_sample_file(fname, q=(0.05, 0.5, 0.95), truths=None, chunk_size=100000, nbins=10000):
+    """
+    Summarize a posterior sample file by streaming through it in chunks (two
+    passes), so that memory use does not depend on its size. Credible levels,
+    effective sample sizes and maximum-likelihood values are exact; quantiles
+    are interpolated from nbins-bin weighted histograms of each parameter.
+
+    Parameters
+    ----------
+    fname : str
+        Sample file
+    q : list
+        Quantiles to compute
+    truths : dict
+        True parameter values, for credible levels
+    chunk_size : int
+        Number of rows to read at a time
+    nbins : int
+        Number of histogram bins per parameter for the quantiles
+
+    Returns
+    -------
+    dict
+        Summary (see summarize_samples)
+    """
+    names = read_sample_names(fname)[3:]
+    stats = weight_statistics(fname, chunk_size)
+    lo, hi = stats["lo"], stats["hi"]
+    hi = np.where(hi > lo, hi, lo + 1.0)
+    edges = np.linspace(lo, hi, nbins + 1).T
+    hist = np.zeros((len(names), nbins))
+    cdf_truths = np.zeros(len(names))
+    if truths is not None:
+        truth_array = np.array([truths[name] for name in names])
+    for chunk in iter_sample_chunks(fname, chunk_size):
+        w = np.exp(chunk[:,0] - stats["max_lnL"]) * chunk[:,1] / chunk[:,2]
+        x = chunk[:,3:]
+        ### bin index of every value, for all parameters at once
+        ind = np.clip(((x - lo) / (hi - lo) * nbins).astype(int), 0, nbins - 1)
+        for j in range(len(names)):
+            hist[j] += np.bincount(ind[:,j], weights=w, minlength=nbins)
+        if truths is not None:
+            cdf_truths += np.dot(w, x < truth_array)
+    q = np.atleast_1d(q)
+    cdf = np.concatenate([np.zeros((len(names), 1)), np.cumsum(hist, axis=1)], axis=1)
+    cdf /= cdf[:,-1:]
+    quantiles = np.array([np.interp(q, cdf[j], edges[j]) for j in range(len(names))]).T
+    summary = {"names":names, "ess":stats["sum_w"]**2 / stats["sum_w2"],
+               "eff_samp":stats["sum_w"] / stats["max_w"], "quantile_levels":q, "quantiles":quantiles,
+               "median":np.array([np.interp(0.5, cdf[j], edges[j]) for j in range(len(names))]),
+               "ML":stats["ML"][3:]}
+    if truths is not None:
+        summary["CDF"] = cdf_truths / stats["sum_w"]
+    return summary
+
+def systematic_resample(weights, n, seed=None):
+    """
+    Draw indices by systematic resampling: a single uniform offset u, and
+    positions (k + u) / n for k = 0, ..., n - 1 on the cumulative weights.
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        Sample weights (need not be normalized)
+    n : int
+        Number of indices to draw
+    seed : int
+        Random seed
+
+    Returns
+    -------
+    np.ndarray
+        Sorted array of n indices (with repeats for heavy samples)
+    """
+    cdf = np.cumsum(weights)
+    positions = (np.arange(n) + np.random.RandomState(seed).uniform()) / n * cdf[-1]
+    return np.minimum(np.searchsorted(cdf, positions, side="right"), weights.size - 1)
+
+def _equal_weight_columns(samples):
+    ### set p = 1 and p_s = exp(lnL - max(lnL)), so every row's weight
+    ### exp(lnL - max(lnL)) * p / p_s is 1
+    out = np.array(samples, dtype=float)
+    out[:,1] = 1.0
+    out[:,2] = np.maximum(np.exp(out[:,0] - np.max(out[:,0])), np.finfo(float).tiny)
+    return out
+
+def equal_weight_samples(samples, n, seed=None):
+    """
+    Equal-weight posterior from an array of importance-weighted samples.
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        (n x ncol) array of samples, with lnL, p, and p_s in the first three
+        columns
+    n : int
+        Number of samples to draw
+    seed : int
+        Random seed
+
+    Returns
+    -------
+    tuple
+        (n x ncol) array of equal-weight samples, and metadata dictionary
+        (effective sample size of the input, number of input samples, and
+        resampling settings)
+    """
+    weights = sample_weights(samples)
+    out = _equal_weight_columns(samples[systematic_resample(weights, n, seed)])
+    metadata = {"ess":float(effective_sample_size(weights)), "n_input":int(samples.shape[0]),
+                "resampling":"systematic", "seed":seed}
+    return out, metadata
+
+def resample_sample_file(fname, out, n, seed=None, chunk_size=100000):
+    """
+    Write an equal-weight posterior for a sample file, streaming through the
+    file in chunks (two passes) so that memory use does not depend on its size.
+
+    Parameters
+    ----------
+    fname : string
+        Input (importance-weighted) sample file
+    out : string
+        Output sample file (.npy for binary output)
+    n : int
+        Number of samples to draw
+    seed : int
+        Random seed
+    chunk_size : int
+        Number of rows to read at a time
+
+    Returns
+    -------
+    dict
+        Metadata stored with the output (see equal_weight_samples)
+    """
+    names = read_sample_names(fname)
+    ### first pass: maximum lnL and weight sums
+    stats = weight_statistics(fname, chunk_size)
+    max_lnL, sum_w = stats["max_lnL"], stats["sum_w"]
+    ### second pass: pick the rows the systematic positions fall in
+    positions = (np.arange(n) + np.random.RandomState(seed).uniform()) / n * sum_w
+    rows = []
+    offset = 0.0
+    start = 0
+    last = None
+    for chunk in iter_sample_chunks(fname, chunk_size):
+        cdf = offset + np.cumsum(np.exp(chunk[:,0] - max_lnL) * chunk[:,1] / chunk[:,2])
+        stop = np.searchsorted(positions, cdf[-1], side="left")
+        if stop > start:
+            rows.append(chunk[np.searchsorted(cdf, positions[start:stop], side="right")])
+            start = stop
+        offset = cdf[-1]
+        last = chunk[-1:]
+    if start < n:
+        ### positions lost to rounding at the very end of the cumulative weights
+        rows.append(np.repeat(last, n - start, axis=0))
+    samples = _equal_weight_columns(np.concatenate(rows, axis=0))
+    metadata = {"ess":float(sum_w**2 / stats["sum_w2"]), "n_input":stats["n"], "resampling":"systematic", "seed":seed, "source":fname}
+    save_samples(out, samples, names, metadata=metadata)
+    return metadata
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Sample I/O
+----------
+Reading and writing posterior sample files. Samples are stored either as text
+(with the column names in a "# " header line) or, for filenames ending in
+.npy, as a binary structured array whose field names are the column names.
+Optional metadata (a JSON dictionary) is stored in a second header line for
+text files, or in a [fname].json file alongside .npy files. Files are written
+to a temporary name and then renamed, so a sample file that exists is always
+complete.
+"""
+
+import os
+import json
+import itertools
+import numpy as np
+from numpy.lib import recfunctions
+
+def save_samples(fname, samples, names, metadata=None):
+    """
+    Save an array of samples.
+
+    Parameters
+    ----------
+    fname : string
+        Name of sample file
+    samples : np.ndarray
+        (n x ncol) array of samples
+    names : list
+        Column names
+    metadata : dict
+        JSON-serializable metadata to store with the samples
+    """
+    ### the temporary file keeps the extension, which sets the format
+    tmp_fname = os.path.join(os.path.dirname(fname), ".tmp_" + os.path.basename(fname))
+    if fname.endswith(".npy"):
+        samples = np.reshape(samples, (-1, len(names)))
+        out = np.empty(samples.shape[0], dtype=[(name, float) for name in names])
+        for i, name in enumerate(names):
+            out[name] = samples[:,i]
+        if metadata is not None:
+            ### the metadata is written first, so it is there whenever the samples are
+            with open(tmp_fname, "w") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_fname, fname + ".json")
+        with open(tmp_fname, "wb") as f:
+            np.save(f, out)
+    else:
+        header = " ".join(names)
+        if metadata is not None:
+            header += "\n" + json.dumps(metadata)
+        np.savetxt(tmp_fname, samples, header=header)
+    os.replace(tmp_fname, fname)
+
+def read_sample_names(fname):
+    """
+    Read the column names of a sample file.
+
+    Parameters
+    ----------
+    fname : string
+        Name of sample file
+
+    Returns
+    -------
+    list
+        Column names
+    """
+    if fname.endswith(".npy"):
+        names = np.load(fname, mmap_mode="r").dtype.names
+        if names is None:
+            raise ValueError("'" + fname + "' does not contain named columns")
+        return list(names)
+    with open(fname) as f:
+        ### the "header" contains the column names
+        return f.readline().strip().split(" ")[1:]
+
+def read_sample_metadata(fname):
+    """
+    Read the metadata stored with a sample file.
+
+    Parameters
+    ----------
+    fname : string
+        Name of sample file
+
+    Returns
+    -------
+    dict
+        Metadata (empty if the file has none)
+    """
+    if fname.endswith(".npy"):
+        if not os.path.exists(fname + ".json"):
+            return {}
+        with open(fname + ".json") as f:
+            return json.load(f)
+    with open(fname) as f:
+        f.readline()
+        line = f.readline()
+    if line.startswith("# {"):
+        return json.loads(line[2:])
+    return {}
+
+def iter_sample_chunks(fname, chunk_size=100000):
+    """
+    Iterate over a sample file in chunks, without loading all of it.
+
+    Parameters
+    ----------
+    fname : string
+        Name of sample file
+    chunk_size : int
+        Maximum number of rows per chunk
+
+    Yields
+    ------
+    np.ndarray
+        (n x ncol) array of samples, with n <= chunk_size
+    """
+    if fname.endswith(".npy"):
+        samples = np.load(fname, mmap_mode="r")
+        for start in range(0, samples.shape[0], chunk_size):
+            yield recfunctions.structured_to_unstructured(samples[start:start + chunk_size]).astype(float)
+        return
+    with open(fname) as f:
+        lines = (line for line in f if not line.startswith("#"))
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if len(chunk) == 0:
+                return
+            yield np.loadtxt(chunk, ndmin=2)
+
+def load_samples(fname):
+    """
+    Load a sample file.
+
+    Parameters
+    ----------
+    fname : string
+        Name of sample file
+
+    Returns
+    -------
+    tuple
+        (n x ncol) array of samples, and list of column names
+    """
+    names = read_sample_names(fname)
+    chunks = list(iter_sample_chunks(fname))
+    if len(chunks) == 0:
+        return np.empty((0, len(names))), names
+    return np.concatenate(chunks, axis=0), names
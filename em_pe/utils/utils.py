@@ -7,12 +7,10 @@ Useful functions for doing conversions, etc.
 Mostly taken from `here <https://github.com/mcoughlin/gwemlightcurves/blob/master/gwemlightcurves/EjectaFits/Di2018b.py>`_
 """
 
+from functools import lru_cache
 import numpy as np
-from scipy import interpolate
 
-import lal
-import lalsimulation as lalsim
-from astropy.cosmology import FlatLambdaCDM # is this the best choice?
+from .cosmology import redshift_from_distance
 
 def calc_mej(m1, lambda1, m2, lambda2):
     """
@@ -50,11 +48,75 @@ def calc_compactness(lambda1, lambda2):
 
     return c1, c2
 
-def precompute_redshift():
+def precompute_redshift(H0=70.0, Om0=0.3):
     """
-    Returns a function to compute redshift at a given distance (in Mpc)
+    Returns a function to compute redshift at a given distance (in Mpc), for
+    single values or arrays (see em_pe.utils.cosmology)
     """
-    cosmo = FlatLambdaCDM(H0=70, Om0=0.3)
-    z = np.logspace(-4, 1, 1000) # correct bounds? should it be logspace?
-    d = cosmo.luminosity_distance(z)
-    return interpolate.interp1d(d, z, fill_value="extrapolate")
+    return lambda d: redshift_from_distance(d, H0, Om0)
+
+@lru_cache(maxsize=None)
+def _eos_family(eos_name):
+    """
+    Returns the (cached) EOS and neutron star family for a given EOS name
+    """
+    ### lal is only imported by the functions that need an EOS, so the
+    ### ejecta fits can be used without it
+    import lalsimulation as lalsim
+    eos = lalsim.SimNeutronStarEOSByName(eos_name)
+    ### keep a reference to the EOS alongside the family built from it
+    return eos, lalsim.CreateSimNeutronStarFamily(eos)
+
+def lambda_from_m(m, eos_name="AP4"):
+    """
+    Function to calculate the dimensionless tidal deformability of a single
+    neutron star of mass m (in solar masses, or kg if m >= 1e15)
+
+    Borrowed from EOSManager.py
+    """
+    import lal
+    import lalsimulation as lalsim
+    _, eos_fam = _eos_family(eos_name)
+    if m<10**15:
+        m=m*lal.MSUN_SI
+    k2=lalsim.SimNeutronStarLoveNumberK2(m, eos_fam)
+    r=lalsim.SimNeutronStarRadius(m, eos_fam)
+    m=m*lal.G_SI/lal.C_SI**2
+    lam=2./(3*lal.G_SI)*k2*r**5
+    dimensionless_lam=lal.G_SI*lam*(1/m)**5
+    return dimensionless_lam
+
+@lru_cache(maxsize=None)
+def precompute_lambda(eos_name="AP4", npts=200):
+    """
+    Returns a function to compute the tidal deformability for arrays of masses
+    (in solar masses), interpolated from a table spanning the masses allowed
+    by the EOS. Raises a ValueError for masses outside that range.
+    """
+    import lal
+    import lalsimulation as lalsim
+    from scipy import interpolate
+    _, eos_fam = _eos_family(eos_name)
+    m_min = lalsim.SimNeutronStarFamMinimumMass(eos_fam) / lal.MSUN_SI
+    m_max = lalsim.SimNeutronStarMaximumMass(eos_fam) / lal.MSUN_SI
+    m = np.linspace(m_min, m_max, npts + 1)[:-1] # the maximum mass itself is not always evaluable
+    log_lambda = np.log([lambda_from_m(mi, eos_name) for mi in m])
+    f = interpolate.interp1d(m, log_lambda, kind="cubic")
+    def calc_lambda(x):
+        ### the interpolation table only covers the masses the EOS allows
+        x = np.asarray(x)
+        if np.any((x < m[0]) | (x > m[-1])):
+            raise ValueError("Component masses must be between {:.3f} and {:.3f} solar masses for EOS {} (got {:.3f} to {:.3f})".format(
+                m[0], m[-1], eos_name, np.min(x), np.max(x)))
+        return np.exp(f(x))
+    return calc_lambda
+
+def calc_ejecta_from_bns(m1, m2, eos_name="AP4"):
+    """
+    Function to calculate ejecta mass and velocity from BNS component masses
+    (in solar masses), for single values or arrays
+    """
+    calc_lambda = precompute_lambda(eos_name)
+    lambda1 = calc_lambda(m1)
+    lambda2 = calc_lambda(m2)
+    return calc_mej(m1, lambda1, m2, lambda2), calc_vej(m1, lambda1, m2, lambda2)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark GP chunking
+---------------------
+Measure the throughput and peak memory of batched GP surrogate predictions as a
+function of the chunk size, and check that every chunk size agrees with
+evaluating the whole batch at once. The predictive errors are not bit-for-bit
+identical across chunk sizes, since the rounding of the triangular solve
+depends on its block size, so they are compared at a relative tolerance
+(--rtol). Uses a saved GP (e.g. one of the kn_interp_angle interpolators) if one
+is given, or a synthetic GP with the same kernel otherwise.
+"""
+from __future__ import print_function
+import argparse
+import time
+import tracemalloc
+import numpy as np
+
+from em_pe.models.kn_interp_angle import _load_gp, _gp_predict, GP_ARRAYS_PER_SAMPLE
+from em_pe.models.model import MEMORY_BUDGET
+
+parser = argparse.ArgumentParser(description="Benchmark the throughput of chunked GP predictions against chunk size")
+parser.add_argument("--gp", help="Base name of a saved GP (e.g. $INTERP_LOC/2021_Wollaeger_TorusPeanutWind2/theta00deg/t_1.000_days/model), uses a synthetic GP if not given")
+parser.add_argument("--n-train", type=int, default=2000, help="Number of training points for the synthetic GP")
+parser.add_argument("--n-samples", type=int, default=20000, help="Number of samples in the batch")
+parser.add_argument("--chunk-size", type=int, action="append", help="Chunk size to time (can be given multiple times, defaults to powers of 4 up to the batch size)")
+parser.add_argument("--repeat", type=int, default=3, help="Number of timings per chunk size")
+parser.add_argument("--seed", type=int, default=0, help="Random seed")
+parser.add_argument("--rtol", type=float, default=1e-8, help="Relative tolerance for agreement with the whole-batch evaluation")
+args = parser.parse_args()
+
+np.random.seed(args.seed)
+
+if args.gp is not None:
+    gp = _load_gp(args.gp)
+else:
+    ### synthetic GP with the kernel used by the kn_interp_angle interpolators
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+    gp = GaussianProcessRegressor(kernel=WhiteKernel(1e-4) + 1.0 * RBF(length_scale=np.ones(5)))
+    gp.kernel_ = gp.kernel
+    gp.X_train_ = np.random.uniform(size=(args.n_train, 5))
+    gp.alpha_ = np.random.normal(size=args.n_train)
+    gp._y_train_std = 1.0
+    gp._y_train_mean = 0.0
+n_train, n_dim = gp.X_train_.shape
+inputs = np.random.uniform(np.min(gp.X_train_, axis=0), np.max(gp.X_train_, axis=0), size=(args.n_samples, n_dim))
+
+### the first call computes the cached L matrix, so it is not timed
+_gp_predict(gp, inputs[:1])
+
+if args.chunk_size is not None:
+    chunk_sizes = args.chunk_size
+else:
+    chunk_sizes = [4**k for k in range(int(np.log(args.n_samples) / np.log(4)) + 1)] + [args.n_samples]
+auto_chunk_size = int(MEMORY_BUDGET // (GP_ARRAYS_PER_SAMPLE * 8 * n_train))
+print("{} training points, {} samples, automatic chunk size {}".format(n_train, args.n_samples, auto_chunk_size))
+
+ref_pred, ref_err = _gp_predict(gp, inputs, chunk_size=args.n_samples)
+print("{:>10} {:>14} {:>14} {:>14} {:>8}".format("chunk", "samples/s", "peak MB", "max rel diff", "agrees"))
+for chunk_size in chunk_sizes + [None]:
+    times = []
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        pred, err = _gp_predict(gp, inputs, chunk_size=chunk_size)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    _gp_predict(gp, inputs, chunk_size=chunk_size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rel_diff = np.nanmax(np.abs(np.append(pred - ref_pred, err - ref_err)) / np.abs(np.append(ref_pred, ref_err)))
+    agrees = np.allclose(pred, ref_pred, rtol=args.rtol, atol=0.0) and np.allclose(err, ref_err, rtol=args.rtol, atol=0.0, equal_nan=True)
+    print("{:>10} {:>14.0f} {:>14.1f} {:>14.2e} {:>8}".format("auto" if chunk_size is None else chunk_size,
+            args.n_samples / np.min(times), peak / 2**20, rel_diff, str(agrees)))
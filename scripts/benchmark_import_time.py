@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark import time
+---------------------
+Time how long em_pe modules take to import in a fresh interpreter, and check
+that heavy dependencies (which should only be imported when they are actually
+used) are not loaded. Exits with a nonzero status if a check fails, so it can be
+used to guard the lazy-import behavior.
+"""
+from __future__ import print_function
+import argparse
+import json
+import subprocess
+import sys
+import numpy as np
+
+parser = argparse.ArgumentParser(description="Benchmark the import time of em_pe modules")
+parser.add_argument("--module", action="append", help="Module to import (can be given multiple times, defaults to em_pe.utils, em_pe.models and em_pe.sampler)")
+parser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters to time per module")
+parser.add_argument("--forbid", action="append", help="Top-level package that must not be loaded by the import (defaults to sklearn, joblib, RIFT, lal, lalsimulation and astropy)")
+parser.add_argument("--max-time", type=float, help="Fail if the median import time (in seconds) is above this")
+args = parser.parse_args()
+
+modules = args.module if args.module is not None else ["em_pe.utils", "em_pe.models", "em_pe.sampler"]
+forbidden = args.forbid if args.forbid is not None else ["sklearn", "joblib", "RIFT", "lal", "lalsimulation", "astropy"]
+
+### the timing starts after the interpreter (and numpy) are loaded, so only the
+### import itself is measured
+code = """
+import sys, time, json
+import numpy
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(set(name.split(".")[0] for name in sys.modules) & set({forbidden}))]))
+"""
+
+failed = False
+for module in modules:
+    times = []
+    loaded = set()
+    for i in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", code.format(module=module, forbidden=forbidden)],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if out.returncode != 0:
+            print(module + ": import failed")
+            print(out.stderr)
+            sys.exit(1)
+        elapsed, names = json.loads(out.stdout.strip().split("\n")[-1])
+        times.append(elapsed)
+        loaded.update(names)
+    median = np.median(times)
+    print("{}: median {:.3f} s, min {:.3f} s over {} imports".format(module, median, np.min(times), args.repeat))
+    if len(loaded) > 0:
+        print("    loaded heavy dependencies:", ", ".join(sorted(loaded)))
+        failed = True
+    if args.max_time is not None and median > args.max_time:
+        print("    slower than --max-time ({} s)".format(args.max_time))
+        failed = True
+
+sys.exit(1 if failed else 0)
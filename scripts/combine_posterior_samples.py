@@ -4,15 +4,18 @@ import numpy as np
 import argparse
 import sys
 
+from em_pe.utils.sample_io import read_sample_names, iter_sample_chunks, save_samples
+
 parser = argparse.ArgumentParser(description='Combine multiple posterior sample files into a single file.')
-parser.add_argument('--input-file', nargs="*", help='Input posterior sample file (can provide multiple instances)')
-parser.add_argument('--output-fname', default='samples-combined.txt', help='Filename for output')
+parser.add_argument('--input-file', nargs="*", help='Input posterior sample file (can provide multiple instances, text or .npy)')
+parser.add_argument('--output-fname', default='samples-combined.txt', help='Filename for output (.npy for binary output)')
 parser.add_argument('--keep-npts', type=int, help='Store the n highest-likelihood samples')
 parser.add_argument('--tempering-exp', default=1.0, type=float, help="Exponent for likelihoods")
 parser.add_argument('--max-lnL', default=np.inf, type=float, help="Maximum log-likelihood")
-parser.add_argument('--set-limit', action='append', nargs=3, help='Modify parameter limits (e.g. --set-limit mej_red 0.008 0.012)')
+parser.add_argument('--set-limit', action='append', nargs=3, help='Modify parameter limits (e.g. --set-limit mej_red 0.008 0.012). Samples outside the limits are dropped before the --keep-npts selection.')
+parser.add_argument('--chunk-size', default=100000, type=int, help='Number of rows to read at a time')
 args = parser.parse_args()
-    
+
 if args.set_limit is not None:
     limits = {name:(float(llim), float(rlim)) for (name, llim, rlim) in args.set_limit}
 else:
@@ -22,31 +25,40 @@ if args.input_file is None:
     print("No input files, exiting")
     sys.exit()
 
-out = []
+params = read_sample_names(args.input_file[0])
+for fname in args.input_file[1:]:
+    if read_sample_names(fname) != params:
+        print("Columns of {} do not match those of {}, exiting".format(fname, args.input_file[0]))
+        sys.exit()
+
+def _cut(chunk):
+    ### apply the lnL, tempering, and parameter limit cuts to a chunk of samples
+    chunk = chunk[chunk[:,0] < args.max_lnL]
+    chunk[:,0] *= args.tempering_exp
+    if limits is not None:
+        for i, p in enumerate(params):
+            if p in limits.keys():
+                llim, rlim = limits[p]
+                chunk = chunk[(chunk[:,i] > llim) & (chunk[:,i] < rlim)]
+    return chunk
+
+### only the current chunk and the (at most keep_npts) best samples so far are held in memory
+out = [np.empty((0, len(params)))]
+n_out = 0
 for fname in args.input_file:
     print("Loading samples from {}...".format(fname))
-    out.append(np.loadtxt(fname))
+    for chunk in iter_sample_chunks(fname, args.chunk_size):
+        out.append(_cut(chunk))
+        n_out += out[-1].shape[0]
+        if args.keep_npts is not None and n_out > 2 * args.keep_npts:
+            out = np.concatenate(out, axis=0)
+            out = [out[np.argpartition(out[:,0], out.shape[0] - args.keep_npts)[out.shape[0] - args.keep_npts:]]]
+            n_out = args.keep_npts
 
 out = np.concatenate(out, axis=0)
 
-with open(args.input_file[0], "r") as f:
-    header = f.readline()[2:] # read the header, remove the "# " at the beginning
-    header = header[:-1] # remove the '\n' at the end
-
-out = out[out[:,0] < args.max_lnL]
-out[:,0] *= args.tempering_exp
-
 if args.keep_npts is not None:
-    ind_sorted = np.argsort(out[:,0])
-    out = out[ind_sorted[out.shape[0] - args.keep_npts:]]
-
-if limits is not None:
-    params = header.split(" ")
-    for i, p in enumerate(params):
-        if p in limits.keys():
-            llim, rlim = limits[p]
-            out = out[out[:,i] > llim]
-            out = out[out[:,i] < rlim]
-
+    ind_sorted = np.argsort(out[:,0], kind="mergesort")
+    out = out[ind_sorted[max(out.shape[0] - args.keep_npts, 0):]]
 
-np.savetxt(args.output_fname, out, header=header)
+save_samples(args.output_fname, out, params)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Fit time-PCA surrogates
+-----------------------
+Fit the time-PCA surrogates used by the kn_interp_angle_pca model from the
+training data of the per-time GPs used by kn_interp_angle, and check them
+against the per-time GPs.
+"""
+from __future__ import print_function
+import argparse
+import numpy as np
+
+from em_pe.models import kn_interp_angle_pca, param_dict
+from em_pe.models.kn_interp_angle import fit_pca_surrogate, _load_gp, _model_predict, _pca_predict
+
+parser = argparse.ArgumentParser(description="Fit time-PCA surrogates from the per-time GP training data")
+parser.add_argument("--morph-comp", default="TP2", help="Morphology and composition specification")
+parser.add_argument("--n-components", type=int, default=10, help="Number of principal components to keep")
+parser.add_argument("--angle", type=int, action="append", help="Angle to fit (defaults to all angles)")
+parser.add_argument("--n-test", type=int, default=50, help="Number of random points to compare the surrogates and per-time GPs at")
+parser.add_argument("--skip-fit", action="store_true", help="Only compare existing surrogates against the per-time GPs")
+args = parser.parse_args()
+
+model = kn_interp_angle_pca(args.morph_comp)
+angles = args.angle if args.angle is not None else model.angles
+
+### random test points inside the prior box, in every band
+x_test = np.empty((args.n_test, 5))
+for i, p in enumerate(["mej_dyn", "vej_dyn", "mej_wind", "vej_wind"]):
+    x_test[:,i] = param_dict[p]().sample_from_prior(size=args.n_test)
+x_test[:,4] = np.random.choice(list(model.lmbda_dict.values()), size=args.n_test)
+
+for angle in angles:
+    if not args.skip_fit:
+        print("Fitting surrogate for theta = {} deg".format(angle))
+        explained = fit_pca_surrogate(model.interpolators[angle], model.pca_dirs[angle], args.n_components)
+        print("  {} components capture {:.6f} of the variance".format(args.n_components, explained))
+    if args.n_test > 0:
+        mags_pca, _ = _pca_predict(model.pca_dirs[angle], x_test)
+        mags_gp = np.empty(mags_pca.shape)
+        for j, fname in enumerate(model.interpolators[angle]):
+            mags_gp[:,j], _ = _model_predict(_load_gp(fname), x_test)
+        diff = np.abs(mags_pca - mags_gp)
+        print("  theta = {} deg: rms difference = {:.4f} mag, max difference = {:.4f} mag".format(angle, np.sqrt(np.mean(diff**2)), np.max(diff)))
@@ -9,14 +9,11 @@ from __future__ import print_function
 import numpy as np
 import argparse
 import sys
-from astropy.time import Time
 import json
 
-import lal
-import lalsimulation as lalsim
-
 from em_pe.models import model_dict
-from em_pe.utils import calc_mej, calc_vej
+from em_pe.utils import calc_ejecta_from_bns
+from em_pe.utils.event_data import save_event_data
 
 parser = argparse.ArgumentParser(description='Generate synthetic data for PE tests')
 parser.add_argument('--m', help='Name of model to use')
@@ -31,10 +28,12 @@ parser.add_argument('--t0', type=float, default=0, help='Start time for event')
 parser.add_argument('--time-format', default='gps', help='Time format for t0 (gps or mjd)')
 parser.add_argument('--json', action='store_true', help='Export data in JSON format')
 parser.add_argument('--bns-params', action='store_true', help='Calculate EM parameters using BNS parameters')
+parser.add_argument('--eos', default='AP4', help='EOS used to convert BNS parameters')
 parser.add_argument('--sigma', type=float, default=0.0, help='Extra error estimate to be fit as a parameter')
 args = parser.parse_args()
 
 def convert_time(t0):
+    from astropy.time import Time
     t = Time(t0, format='gps')
     return t.mjd
 
@@ -49,24 +48,8 @@ for p in params:
     params[p] = float(params[p])
 
 ### convert BNS parameters to EM parameters, if needed
-### borrowed from EOSManager.py
-def lambda_from_m(m):
-    eos = lalsim.SimNeutronStarEOSByName("AP4")
-    eos_fam = lalsim.CreateSimNeutronStarFamily(eos)
-    if m<10**15:
-        m=m*lal.MSUN_SI
-    k2=lalsim.SimNeutronStarLoveNumberK2(m, eos_fam)
-    r=lalsim.SimNeutronStarRadius(m, eos_fam)
-    m=m*lal.G_SI/lal.C_SI**2
-    lam=2./(3*lal.G_SI)*k2*r**5
-    dimensionless_lam=lal.G_SI*lam*(1/m)**5
-    return dimensionless_lam
-
 if args.bns_params:
-    lambda1 = lambda_from_m(params['m1'])
-    lambda2 = lambda_from_m(params['m2'])
-    params['mej'] = calc_mej(params['m1'], lambda1, params['m2'], lambda2)
-    params['vej'] = calc_vej(params['m1'], lambda1, params['m2'], lambda2)
+    params['mej'], params['vej'] = calc_ejecta_from_bns(params['m1'], params['m2'], args.eos)
 
 ### initialize the model
 if args.orientation is not None:
@@ -90,8 +73,9 @@ tdays = np.sort(tdays)
 data_dict = {}
 
 ### generate the data
+model_data = model.evaluate_bands({band:tdays for band in model.bands})
 for band in model.bands:
-    m, _ = model.evaluate(tdays, band)
+    m, _ = model_data[band]
     if 'distance' in params:
         dist = params['distance']
         m += 5*(np.log10(dist*1e6) - 1)
@@ -107,6 +91,7 @@ if not args.json:
         data = data_dict[band]
         filename = args.out + band + '.txt'
         np.savetxt(filename, data.T)
+    save_event_data(args.out, {band:data_dict[band].T for band in data_dict}, t0=delta_t, source=args.m, params=params)
 
 ### json
 else:
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+'''
+Generate injections in bulk
+---------------------------
+Draw many parameter sets from the priors (or read them from a file), evaluate
+the model for all of them at once, and write the synthetic data and true
+values for every injection in one pass.
+'''
+
+from __future__ import print_function
+import numpy as np
+import argparse
+import os
+
+from em_pe.models import model_dict, param_dict
+from em_pe.utils import calc_ejecta_from_bns
+from em_pe.utils.event_data import save_event_data
+
+parser = argparse.ArgumentParser(description='Generate synthetic data for many PE tests at once')
+parser.add_argument('--m', help='Name of model to use')
+parser.add_argument('--morph-comp', default='TP2', help='Morphology and composition specification (kn_interp_angle only)')
+parser.add_argument('--directory', help='Directory to write the injections to (injection i is written to [directory]/i/)')
+parser.add_argument('--n-inj', type=int, help='Number of injections to draw from the priors')
+parser.add_argument('--injection-file', help='File of parameter values to use instead of drawing them (one injection per row, parameter names in the header)')
+parser.add_argument('--fixed-param', action='append', nargs=2, help='Parameters with fixed values')
+parser.add_argument('--set-limit', action='append', nargs=3, help='Modify prior limits used for drawing (e.g. --set-limit mej 0.005 0.015, or --set-limit m1 1.2 1.6 with --bns-params)')
+parser.add_argument('--tmin', type=float, default=0.1, help='Minimum time (in days)')
+parser.add_argument('--tmax', type=float, default=30.0, help='Maximum time (in days)')
+parser.add_argument('--n', type=int, default=50, help='Number of data points per band')
+parser.add_argument('--err', type=float, default=0.2, help='Error std. dev.')
+parser.add_argument('--bns-params', action='store_true', help='Calculate mej and vej from the BNS component masses m1 and m2')
+parser.add_argument('--eos', default='AP4', help='EOS used to convert BNS parameters')
+parser.add_argument('--sigma', type=float, default=0.0, help='Extra error estimate to be fit as a parameter')
+parser.add_argument('--t0', type=float, default=0, help='Start time for events (MJD)')
+parser.add_argument('--n-grid', type=int, default=200, help='Number of (log-spaced) times to evaluate vectorized models at before interpolating to the data times')
+parser.add_argument('--batch-size', type=int, default=1000, help='Number of injections to evaluate at once')
+parser.add_argument('--skip-existing', action='store_true', help='Leave injections whose directory already has test_truths.txt untouched (e.g. when resuming a campaign)')
+args = parser.parse_args()
+
+def _make_model(m):
+    if m in ['kn_interp_angle', 'kn_interp_angle_pca']:
+        return model_dict[m](args.morph_comp)
+    return model_dict[m]()
+
+def _interp_log_time(t_grid, mags, t):
+    '''
+    Linearly interpolate each row of mags (evaluated at t_grid) to the
+    corresponding row of t, in log time.
+    '''
+    log_t_grid = np.log(t_grid)
+    log_t = np.log(t)
+    idx = np.clip(np.searchsorted(log_t_grid, log_t) - 1, 0, t_grid.size - 2)
+    w = (log_t - log_t_grid[idx]) / (log_t_grid[idx + 1] - log_t_grid[idx])
+    rows = np.arange(mags.shape[0])[:,np.newaxis]
+    return (1.0 - w) * mags[rows,idx] + w * mags[rows,idx + 1]
+
+def evaluate_injections(model, params, tdays, bands):
+    '''
+    Evaluate a model for every injection at its own data times.
+
+    Parameters
+    ----------
+    model : model_base
+        Model to evaluate
+    params : dict
+        Dictionary mapping parameter names to 1d arrays of values
+    tdays : np.ndarray
+        (n_inj x npts) array of times (in days)
+    bands : list
+        Bands to evaluate
+
+    Returns
+    -------
+    dict
+        Dictionary mapping bands to (n_inj x npts) arrays of magnitudes
+    '''
+    n_inj = tdays.shape[0]
+    t_bounds = [max(0.01, args.tmin), args.tmax]
+    ret = {band:np.empty(tdays.shape) for band in bands}
+    if model.vectorized:
+        ### evaluate every injection on a common time grid, then interpolate to
+        ### each injection's data times
+        t_grid = np.logspace(np.log10(args.tmin), np.log10(args.tmax), args.n_grid)
+        for start in range(0, n_inj, args.batch_size):
+            end = min(start + args.batch_size, n_inj)
+            model.set_params({p:params[p][start:end] for p in params}, t_bounds)
+            lcs = model.evaluate_bands({band:t_grid for band in bands})
+            for band in bands:
+                m = np.reshape(lcs[band][0], (end - start, t_grid.size))
+                ret[band][start:end] = _interp_log_time(t_grid, m, tdays[start:end])
+    else:
+        model.prepare_batch(params)
+        for i in range(n_inj):
+            model.set_params({p:params[p][i] for p in params}, t_bounds)
+            lcs = model.evaluate_bands({band:tdays[i] for band in bands})
+            for band in bands:
+                ret[band][i] = lcs[band][0]
+    return ret
+
+model = _make_model(args.m)
+fixed_params = {p:float(value) for [p, value] in args.fixed_param} if args.fixed_param is not None else {}
+if 'sigma' in model.param_names and 'sigma' not in fixed_params:
+    fixed_params['sigma'] = args.sigma
+
+### get the parameter values for every injection
+if args.injection_file is not None:
+    with open(args.injection_file) as f:
+        ### the "header" contains the column names
+        header = f.readline().strip().split(' ')[1:]
+    values = np.atleast_2d(np.loadtxt(args.injection_file))
+    params = {p:values[:,i] for i, p in enumerate(header)}
+    n_inj = values.shape[0]
+    if args.bns_params and not ('m1' in params and 'm2' in params):
+        raise ValueError('--bns-params needs m1 and m2 columns in the injection file')
+else:
+    n_inj = args.n_inj
+    limits = {p:(float(llim), float(rlim)) for [p, llim, rlim] in args.set_limit} if args.set_limit is not None else {}
+    ### with --bns-params, the component masses are drawn instead of mej and vej
+    draw_params = [p for p in model.param_names if not (args.bns_params and p in ['mej', 'vej'])]
+    if args.bns_params:
+        draw_params += ['m1', 'm2']
+    params = {}
+    for p in draw_params:
+        if p in fixed_params:
+            continue
+        prior = param_dict[p]()
+        if p in limits:
+            prior.update_limits(*limits[p])
+        params[p] = np.atleast_1d(prior.sample_from_prior(size=n_inj))
+for p in fixed_params:
+    if p not in params:
+        params[p] = fixed_params[p] * np.ones(n_inj)
+if args.bns_params:
+    params['mej'], params['vej'] = calc_ejecta_from_bns(params['m1'], params['m2'], args.eos)
+missing = [p for p in model.param_names if p not in params]
+if len(missing) > 0:
+    raise ValueError('No values for parameters: ' + ' '.join(missing))
+
+base_dir = args.directory
+if base_dir[-1] != '/':
+    base_dir += '/'
+
+### injections that are already complete are not regenerated with --skip-existing,
+### so their data still match any PE runs done on them
+todo = np.array([i for i in range(n_inj) if not (args.skip_existing and os.path.exists(base_dir + str(i) + '/test_truths.txt'))], dtype=int)
+
+### generate times (shared by all bands of an injection, as in generate_data.py)
+tdays = np.sort(np.exp(np.random.uniform(np.log(args.tmin), np.log(args.tmax), (todo.size, args.n))), axis=1)
+
+print('Evaluating', args.m, 'for', todo.size, 'of', n_inj, 'injections')
+if todo.size > 0:
+    mags = evaluate_injections(model, {p:params[p][todo] for p in params}, tdays, model.bands)
+else:
+    mags = {band:np.empty(tdays.shape) for band in model.bands}
+
+### add noise to every injection at once
+sigma = params['sigma'][todo] if 'sigma' in params else np.zeros(todo.size)
+for band in model.bands:
+    mags[band] += np.random.normal(loc=0.0, scale=args.err, size=tdays.shape)
+    mags[band] += np.random.normal(size=tdays.shape) * sigma[:,np.newaxis]
+
+### write the data and true values
+if not os.path.exists(base_dir):
+    os.makedirs(base_dir)
+### the component masses that mej and vej were calculated from are kept after the model parameters
+truth_params = model.param_names + (['m1', 'm2'] if args.bns_params else [])
+header = ' '.join(truth_params)
+truths = np.array([params[p] for p in truth_params]).T
+for i in set(range(n_inj)) - set(todo):
+    truths[i] = np.loadtxt(base_dir + str(i) + '/test_truths.txt')
+np.savetxt(base_dir + 'injections.txt', truths, header=header)
+for k, i in enumerate(todo):
+    curr_dir = base_dir + str(i) + '/'
+    if not os.path.exists(curr_dir):
+        os.mkdir(curr_dir)
+    data_dict = {}
+    for band in model.bands:
+        data = np.empty((args.n, 4))
+        data[:,0] = tdays[k] + args.t0
+        data[:,1] = 0.0
+        data[:,2] = mags[band][k]
+        data[:,3] = args.err
+        np.savetxt(curr_dir + band + '.txt', data)
+        data_dict[band] = data
+    save_event_data(curr_dir, data_dict, t0=args.t0, source=args.m, params={p:float(params[p][i]) for p in params})
+    np.savetxt(curr_dir + 'test_truths.txt', truths[i], header=header)
+
+print('Wrote', todo.size, 'injections to', base_dir)
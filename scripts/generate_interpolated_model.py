@@ -10,6 +10,8 @@ Generate Interpolated Models
 """
 import argparse
 import os
+import time
+from multiprocessing import Pool
 import numpy as np
 import pyDOE
 from scipy import interpolate
@@ -21,11 +23,7 @@ parser.add_argument("--tmin", type=float, default=0.0, help="Start time for inte
 parser.add_argument("--tmax", type=float, default=10.0, help="Stop time for interpolated model")
 parser.add_argument("--n", type=int, default=1000, help="Number of samples to use")
 parser.add_argument("--n-times", type=int, default=50, help="Number of time points to use")
-args = parser.parse_args()
-
-### surrogate model imports
-if args.m in ["me2017_lanthanide", "me2017_non_lanthanide"]:
-    from gwemlightcurves.KNModels.io import Me2017
+parser.add_argument("--nprocs", type=int, default=1, help="Number of parallel processes to use for evaluating the surrogate model")
 
 class surrogate_model:
     def __init__(self, args):
@@ -57,47 +55,120 @@ class surrogate_model:
             print("Error: model '" + self.name + "' does not exist")
             exit()
 
-    def me2017(self, band, t, mej, vej):
+    def me2017(self, t, mej, vej):
+        ### surrogate model import (done here so that worker processes get it too)
+        from gwemlightcurves.KNModels.io import Me2017
+        ### calc_lc computes every band at once, so keep all of them
         dt = 0.05
-        index_dict = dict(zip(self.bands, range(len(self.bands))))
         beta = 3.0
         kappa_r = self.fixed_params["kappa_r"]
-        tdays, L, lightcurves, Tobs = Me2017.calc_lc(args.tmin, args.tmax, dt, 
+        tdays, L, lightcurves, Tobs = Me2017.calc_lc(self.args.tmin, self.args.tmax, dt, 
                 mej, vej, beta, kappa_r)
-        lc = lightcurves[index_dict[band]]
-        mask = np.isfinite(lc) # filter out NaNs, since interp1d is undefined for them
-        f = interpolate.interp1d(tdays[mask], lc[mask], fill_value="extrapolate")
-        return f(t)
-
-### initialize surrogate model
-s_m = surrogate_model(args)
-
-ndim, _ = s_m.lims.shape
-
-### generate Latin hypercube samples and transform to correct intervals
-x = pyDOE.lhs(ndim, samples=args.n) - 0.5
-interval_lengths = s_m.lims[:,1] - s_m.lims[:,0]
-x *= interval_lengths
-centers = np.mean(s_m.lims, axis=1).flatten()
-x += centers
-
-
-### array of times for interpolation
-t_interp = np.linspace(args.tmin, args.tmax, args.n_times)
-
-### three-dimensional array to save as output
-lc_arr = np.empty((len(s_m.bands), args.n, args.n_times))
-
-for ind in range(len(s_m.bands)):
-    band = s_m.bands[ind]
-    print("Sampling and interpolating", band, "band...")
-    y = np.empty((args.n, args.n_times))
-    
-    ### evaluate full lightcurve for each parameter combination
-    for i in range(args.n):
-        params = x[i]
-        y[i] = s_m.lc_func(band, t_interp, *params)
-    lc_arr[ind] = y
-
-fname = os.environ["EM_PE_INSTALL_DIR"] + "/Data/" + args.m + ".npz"
-np.savez(fname, t_interp, x, lc_arr)
+        ret = np.empty((len(self.bands), t.size))
+        for ind in range(len(self.bands)):
+            lc = lightcurves[ind]
+            mask = np.isfinite(lc) # filter out NaNs, since interp1d is undefined for them
+            f = interpolate.interp1d(tdays[mask], lc[mask], fill_value="extrapolate")
+            ret[ind] = f(t)
+        return ret
+
+def _init_worker(model, times, points):
+    ### give each process the model and the points to evaluate
+    global s_m, t_interp, x
+    s_m, t_interp, x = model, times, points
+
+def _evaluate_point(i):
+    ### evaluate all bands for one parameter combination, and time it
+    start = time.time()
+    lcs = s_m.lc_func(t_interp, *x[i])
+    return i, time.time() - start, lcs
+
+def main():
+    args = parser.parse_args()
+
+    ### initialize surrogate model
+    s_m = surrogate_model(args)
+
+    ndim, _ = s_m.lims.shape
+    nbands = len(s_m.bands)
+
+    fname = os.environ["EM_PE_INSTALL_DIR"] + "/Data/" + args.m + ".npz"
+    ### the sample points and the results for each point are written to these as
+    ### the run goes, so an interrupted run can be resumed
+    points_fname = os.environ["EM_PE_INSTALL_DIR"] + "/Data/" + args.m + "_points.txt"
+    progress_fname = os.environ["EM_PE_INSTALL_DIR"] + "/Data/" + args.m + "_progress.txt"
+    settings = "{} {} {} {}".format(args.tmin, args.tmax, args.n, args.n_times)
+
+    if os.path.exists(points_fname):
+        with open(points_fname) as f:
+            if f.readline()[2:].strip() != settings:
+                print("Error: existing run in '" + points_fname + "' used different settings; remove it and '" + progress_fname + "' to start over")
+                exit()
+        print("Resuming from", points_fname)
+        x = np.loadtxt(points_fname).reshape((args.n, ndim))
+    else:
+        ### generate Latin hypercube samples and transform to correct intervals
+        x = pyDOE.lhs(ndim, samples=args.n) - 0.5
+        interval_lengths = s_m.lims[:,1] - s_m.lims[:,0]
+        x *= interval_lengths
+        centers = np.mean(s_m.lims, axis=1).flatten()
+        x += centers
+        np.savetxt(points_fname, x, header=settings)
+        if os.path.exists(progress_fname):
+            os.remove(progress_fname)
+
+
+    ### array of times for interpolation
+    t_interp = np.linspace(args.tmin, args.tmax, args.n_times)
+
+    ### three-dimensional array to save as output
+    lc_arr = np.empty((nbands, args.n, args.n_times))
+    eval_time = np.full(args.n, np.nan)
+
+    ### read points that are already done (ignoring a partially-written last line)
+    done = set()
+    if os.path.exists(progress_fname):
+        with open(progress_fname) as f:
+            lines = f.readlines()
+        if len(lines) > 0 and not lines[-1].endswith("\n"):
+            ### the last line was cut off mid-write, even if it has the right number
+            ### of values (the last one may be truncated), so remove it before new
+            ### lines are appended
+            lines = lines[:-1]
+            with open(progress_fname, "r+") as f:
+                f.truncate(sum(len(line) for line in lines))
+        for line in lines:
+            values = line.split()
+            if len(values) != 2 + nbands * args.n_times:
+                continue
+            i = int(values[0])
+            eval_time[i] = float(values[1])
+            lc_arr[:,i] = np.array(values[2:], dtype=float).reshape((nbands, args.n_times))
+            done.add(i)
+
+    todo = [i for i in range(args.n) if i not in done]
+    print("Evaluating", len(todo), "of", args.n, "points (all bands at once)...")
+
+    with open(progress_fname, "a") as f:
+        if args.nprocs > 1:
+            pool = Pool(args.nprocs, initializer=_init_worker, initargs=(s_m, t_interp, x))
+            results = pool.imap_unordered(_evaluate_point, todo)
+        else:
+            _init_worker(s_m, t_interp, x)
+            results = map(_evaluate_point, todo)
+        for count, (i, elapsed, lcs) in enumerate(results):
+            lc_arr[:,i] = lcs
+            eval_time[i] = elapsed
+            f.write(" ".join([str(i), "%.18e" % elapsed] + ["%.18e" % v for v in lcs.flatten()]) + "\n")
+            f.flush()
+            if (count + 1) % 100 == 0:
+                print("  {} of {} points done".format(count + 1, len(todo)))
+        if args.nprocs > 1:
+            pool.close()
+            pool.join()
+
+    print("Mean evaluation time per point: {:.3f} s".format(np.mean(eval_time)))
+    np.savez(fname, t_interp, x, lc_arr, eval_time)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import numpy as np
 import argparse
 import os
+import json
+import shlex
 
 
 from em_pe.models import model_dict, param_dict
@@ -13,6 +15,7 @@ parser.add_argument("--npts", type=int, help="Number of different parameter sets
 parser.add_argument("--fixed-param", action="append", nargs=2, help="Set parameter with fixed value")
 parser.add_argument("--sigma", default="0.0", help="Extra error estimate to be fit as a parameter")
 parser.add_argument("--sampler-args", help="All extra arguments to pass to sampler in one string")
+parser.add_argument("--bulk-injections", action="store_true", help="Generate all the injections with a single generate_injections.py call instead of one generate_data.py call per run")
 args = parser.parse_args()
 
 base_dir = args.directory
@@ -40,6 +43,8 @@ for p in params:
         variable_params[p] = param_dict[p]()
 
 commands = []
+injection_values = []
+injections = []
 
 for i in range(args.npts):
     param_values = {}
@@ -50,7 +55,10 @@ for i in range(args.npts):
     for p in variable_params.keys():
         param_values[p] = variable_params[p].sample_from_prior(width=1.0)
         command += " --p " + p + " " + str(param_values[p])
-    commands.append(command)
+    if args.bulk_injections:
+        injection_values.append([param_values[p] for p in variable_params.keys()])
+    else:
+        commands.append(command)
     commands.append("python3 ${EM_PE_INSTALL_DIR}/em_pe/sampler.py --dat "
             + str(i) + "/" + " --m " + args.m + " -v --f g.txt --f r.txt --f "
             + "i.txt --f z.txt --f y.txt --f J.txt --f H.txt --f K.txt --min 40"
@@ -61,6 +69,31 @@ for i in range(args.npts):
         commands[-1] += " --fixed-param " + p + " " + str(fixed_params[p])
     for p in variable_params.keys():
         commands[-1] += " --set-limit " + p + " " + str(param_values[p] / 2.0) + " " + str(2.0 * param_values[p])
+    injections.append({
+        "name":str(i),
+        "directory":str(i) + "/",
+        "generate":(None if args.bulk_injections else command),
+        "sampler_args":shlex.split(commands[-1].split("sampler.py", 1)[1])
+    })
+
+### the whole set of injections is generated up front, before any of the PE runs
+if args.bulk_injections:
+    np.savetxt(base_dir + "injection_params.txt", np.array(injection_values).reshape((args.npts, -1)), header=" ".join(variable_params.keys()))
+    command = ("python3 ${EM_PE_INSTALL_DIR}/scripts/generate_injections.py --m " + args.m + " --directory ./ --skip-existing"
+            + " --injection-file injection_params.txt --n 50 --err 0.2 --tmin 0.1 --tmax 30 --sigma " + args.sigma)
+    for p in fixed_params.keys():
+        command += " --fixed-param " + p + " " + fixed_params[p]
+    commands.insert(0, command)
 
 with open(base_dir + "run.sh", "w") as f:
     f.write("\n".join(commands))
+
+### the same runs, in the form used by scripts/run_pp_campaign.py
+campaign = {
+        "model":args.m,
+        "nprocs":8,
+        "setup":(commands[:1] if args.bulk_injections else []),
+        "injections":injections
+}
+with open(base_dir + "campaign.json", "w") as f:
+    json.dump(campaign, f, indent=4)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+
+from em_pe.utils.posterior import resample_sample_file
+
+parser = argparse.ArgumentParser(description='Write a compact equal-weight posterior for an importance-weighted posterior sample file, using systematic resampling.')
+parser.add_argument('--posterior-samples', help='Input posterior sample file (text or .npy)')
+parser.add_argument('--out', help='Filename for output (.npy for binary output)')
+parser.add_argument('--n', type=int, default=5000, help='Number of equal-weight samples to draw')
+parser.add_argument('--seed', type=int, help='Random seed')
+parser.add_argument('--chunk-size', default=100000, type=int, help='Number of rows to read at a time')
+args = parser.parse_args()
+
+metadata = resample_sample_file(args.posterior_samples, args.out, args.n, seed=args.seed, chunk_size=args.chunk_size)
+print("Wrote", args.n, "equal-weight samples from", metadata["n_input"], "(effective sample size", metadata["ess"], ") to", args.out)
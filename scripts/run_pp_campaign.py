@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+'''
+Run a PP campaign
+-----------------
+Run all the data generation and PE jobs of a campaign set up by
+pp_plot_helper.py (campaign.json), packing them onto the available cores and
+memory. Injections that are already complete are skipped, failed jobs are
+retried, and each worker process reuses the models it has already loaded.
+'''
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import Process, Queue
+from queue import Empty
+
+from em_pe.sampler import main as run_sampler, _parse_command_line_args as parse_sampler_args
+
+parser = argparse.ArgumentParser(description='Run the jobs of a PP campaign with a pool of worker processes')
+parser.add_argument('--campaign', help='Campaign file written by pp_plot_helper.py (the jobs are run from its directory)')
+parser.add_argument('--cores', type=int, default=os.cpu_count(), help='Number of cores to use (defaults to all)')
+parser.add_argument('--nprocs', type=int, help='Number of processes per PE job (defaults to the value in the campaign file, capped at --cores)')
+parser.add_argument('--memory', type=float, help='Memory available for PE jobs, in GB (defaults to the physical memory)')
+parser.add_argument('--job-memory', type=float, default=0.0, help='Estimated memory used by each PE job, in GB')
+parser.add_argument('--max-retries', type=int, default=2, help='Number of times to retry a failed job')
+
+class _redirect_output:
+    '''
+    Send stdout and stderr (including those of child processes) to a log file.
+    '''
+    def __init__(self, fname):
+        self.fname = fname
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = (os.dup(1), os.dup(2))
+        self.log = open(self.fname, 'a')
+        os.dup2(self.log.fileno(), 1)
+        os.dup2(self.log.fileno(), 2)
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        os.close(self.saved[0])
+        os.close(self.saved[1])
+        self.log.close()
+
+def _worker(job_queue, result_queue):
+    ### models loaded by earlier jobs are kept here and reused by later ones
+    model_cache = {}
+    while True:
+        job = job_queue.get()
+        if job is None:
+            return
+        name, kind, payload, log_fname = job
+        result_queue.put(('start', name, os.getpid()))
+        start = time.time()
+        error = None
+        try:
+            with _redirect_output(log_fname):
+                if kind == 'command':
+                    returncode = subprocess.call(payload, shell=True)
+                    if returncode != 0:
+                        raise RuntimeError('command exited with code {}'.format(returncode))
+                else:
+                    run_sampler(payload, model_cache=model_cache)
+        except (Exception, SystemExit) as e:
+            error = repr(e)
+        result_queue.put(('done', name, (error, time.time() - start)))
+
+def run_jobs(jobs, nworkers, max_retries=2):
+    '''
+    Run jobs with a pool of worker processes, retrying failures.
+
+    Parameters
+    ----------
+    jobs : list
+        List of (name, kind, payload, log file) tuples. kind is "command" for
+        shell commands, or "sampler" for sampler arguments.
+    nworkers : int
+        Number of worker processes
+    max_retries : int
+        Number of times to retry a failed job
+
+    Returns
+    -------
+    list
+        Names of the jobs that failed every attempt
+    '''
+    if len(jobs) == 0:
+        return []
+    job_dict = {job[0]:job for job in jobs}
+    attempts = {job[0]:0 for job in jobs}
+    job_queue = Queue()
+    result_queue = Queue()
+    nworkers = max(1, min(nworkers, len(jobs)))
+    workers = [Process(target=_worker, args=(job_queue, result_queue)) for _ in range(nworkers)]
+    for w in workers:
+        w.start()
+    for job in jobs:
+        job_queue.put(job)
+    failed = []
+    running = {} # maps worker PIDs to the jobs they are running
+    remaining = len(jobs)
+    while remaining > 0:
+        try:
+            kind, name, info = result_queue.get(timeout=10)
+        except Empty:
+            ### a worker that died (e.g. killed for running out of memory)
+            ### takes its job with it, so replace it and count the job as failed
+            for i, w in enumerate(workers):
+                if not w.is_alive():
+                    workers[i] = Process(target=_worker, args=(job_queue, result_queue))
+                    workers[i].start()
+                    if w.pid in running:
+                        result_queue.put(('done', running.pop(w.pid), ('worker exited with code {}'.format(w.exitcode), 0.0)))
+            continue
+        if kind == 'start':
+            running[info] = name
+            continue
+        running = {pid:job_name for pid, job_name in running.items() if job_name != name}
+        error, elapsed = info
+        attempts[name] += 1
+        if error is None:
+            remaining -= 1
+            print('  {} finished in {:.1f} s ({} remaining)'.format(name, elapsed, remaining))
+        elif attempts[name] <= max_retries:
+            print('  {} failed ({}), retrying'.format(name, error))
+            job_queue.put(job_dict[name])
+        else:
+            remaining -= 1
+            print('  {} failed ({}), giving up'.format(name, error))
+            failed.append(name)
+    for w in workers:
+        job_queue.put(None)
+    for w in workers:
+        w.join()
+    return failed
+
+### the campaign is only run from the main process, so that the worker
+### processes can also be started with the spawn and forkserver methods
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    with open(args.campaign) as f:
+        campaign = json.load(f)
+    os.chdir(os.path.dirname(os.path.abspath(args.campaign)))
+
+    nprocs = min(args.nprocs if args.nprocs is not None else campaign['nprocs'], args.cores)
+    if args.memory is not None:
+        memory = args.memory
+    else:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1.0e9
+    n_pe_workers = args.cores // nprocs
+    if args.job_memory > 0:
+        n_pe_workers = min(n_pe_workers, int(memory // args.job_memory))
+
+    ### an injection's data are complete once its true values have been written,
+    ### and its PE run is complete once the posterior samples have been written
+    injections = campaign['injections']
+    need_data = [inj for inj in injections if not os.path.exists(inj['directory'] + 'test_truths.txt')]
+    need_pe = [inj for inj in injections if not os.path.exists(parse_sampler_args(inj['sampler_args']).out)]
+    print('{} injections: {} need data, {} need PE'.format(len(injections), len(need_data), len(need_pe)))
+
+    ### data generation is single-threaded, so use every core
+    failed = []
+    if len(need_data) > 0:
+        ### the bulk generator must only fill in the missing injections, since rewriting
+        ### the others would leave their finished PE runs out of step with their data
+        setup = [command + ' --skip-existing' if 'generate_injections.py' in command and '--skip-existing' not in command else command
+                 for command in campaign['setup']]
+        setup_jobs = [('setup%d' % i, 'command', command, 'setup%d.log' % i) for i, command in enumerate(setup)]
+        failed += run_jobs(setup_jobs, args.cores, args.max_retries)
+        data_jobs = [(inj['name'], 'command', inj['generate'], inj['directory'] + 'generate.log')
+                     for inj in need_data if inj['generate'] is not None]
+        failed += run_jobs(data_jobs, args.cores, args.max_retries)
+
+    print('Running PE with {} workers of {} processes each'.format(max(1, n_pe_workers), nprocs))
+    pe_jobs = [(inj['name'], 'sampler', inj['sampler_args'] + ['--nprocs', str(nprocs)], inj['directory'] + 'sampler.log')
+               for inj in need_pe if os.path.exists(inj['directory'] + 'test_truths.txt')]
+    failed += run_jobs(pe_jobs, n_pe_workers, args.max_retries)
+
+    if len(failed) > 0:
+        print('Failed jobs:', ' '.join(failed))
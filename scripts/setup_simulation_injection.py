@@ -1,6 +1,9 @@
 import numpy as np
 from scipy.interpolate import interp1d
 import argparse
+import os
+
+from em_pe.utils.event_data import load_band_data, save_event_data
 
 parser = argparse.ArgumentParser(description="Script to generate injection/recovery tests for lightcurves extracted from simulations")
 parser.add_argument("--input-sim", help="File containing simulation magnitudes")
@@ -8,40 +11,89 @@ parser.add_argument("--tmin", type=float, help="Minimum time value")
 parser.add_argument("--tmax", type=float, help="Maximum time value")
 parser.add_argument("--n", type=int, help="Number of points per band")
 parser.add_argument("--err", type=float, help="Error std. dev.")
-parser.add_argument("--out", help="Directory to write output to")
-parser.add_argument("--angular-bin", type=int, help="Angular bin from which to pull data")
-parser.add_argument("--dist", type=float, help="Distance in Mpc")
+parser.add_argument("--out", help="Directory to write output to. With more than one injection, each is written to its own subdirectory (angle[bin]_dist[dist]_seed[seed]/).")
+parser.add_argument("--angular-bin", nargs="+", help="Angular bin(s) from which to pull data, as values or start:stop[:step] ranges")
+parser.add_argument("--dist", nargs="+", help="Distance(s) in Mpc, as values or start:stop:num ranges (endpoints included)")
+parser.add_argument("--seed", nargs="+", help="Random seed(s) for the times and noise, as values or start:stop[:step] ranges. Each seed's times and noise are shared by every angle and distance.")
 parser.add_argument("--GW170817-times", action="store_true", help="Use the times from 170817 (probably more realistic than random sampling). If using this, you need to provide the location of parsed GW170817 data with the --GW170817-loc argument, such as an existing PE run.")
 parser.add_argument("--GW170817-loc", help="Location of 170817 data")
 args = parser.parse_args()
 
+def _parse_int_list(values):
+    ### expand python-style start:stop[:step] ranges
+    ret = []
+    for v in values:
+        if ":" in v:
+            ret += list(range(*[int(x) for x in v.split(":")]))
+        else:
+            ret.append(int(v))
+    return ret
+
+def _parse_float_list(values):
+    ### expand start:stop:num ranges (as in np.linspace)
+    ret = []
+    for v in values:
+        if ":" in v:
+            start, stop, num = v.split(":")
+            ret += list(np.linspace(float(start), float(stop), int(num)))
+        else:
+            ret.append(float(v))
+    return ret
+
 def get_170817_times(b):
     fname = args.GW170817_loc + b + ".txt"
-    dat = np.loadtxt(fname)
+    dat = load_band_data(fname)
     return dat[:,0]
 
 bands_out = ["g", "r", "i", "z", "y", "J", "H", "K"]
 
-# this line loads the data, splits it by band, removes the last one (the S band), and makes a dictionary mapping bands to data
-data_in = dict(zip(bands_out, np.split(np.loadtxt(args.input_sim), 9)[:-1]))
+angular_bins = _parse_int_list(args.angular_bin)
+dists = np.array(_parse_float_list(args.dist))
+seeds = _parse_int_list(args.seed) if args.seed is not None else [None]
+
+# this line loads the data, splits it by band, removes the last one (the S band), and stacks the bands
+data_in = np.array(np.split(np.loadtxt(args.input_sim), 9)[:-1])
 
 # grab the time values
-t_in = data_in["g"][:,1]
-
-# remove all the data except the specific mags we want
-data_in = {b:data_in[b][:,args.angular_bin + 2] for b in bands_out}
-
-for b in bands_out:
-    f = interp1d(t_in, data_in[b], fill_value="extrapolate")
-    npts = args.n
-    if args.GW170817_times:
-        t = get_170817_times(b)
-        npts = t.size
-    else:
-        t = np.exp(np.random.uniform(np.log(args.tmin), np.log(args.tmax), npts))
-        t = np.sort(t)
-    out = np.empty((npts, 4))
-    out[:,0] = t
-    out[:,2] = f(t) + np.random.normal(0.0, args.err, npts) + 5.0 * (np.log10(args.dist * 1.0e6) - 1.0)
-    out[:,3] = args.err
-    np.savetxt(args.out + b + ".txt", out)
+t_in = data_in[0][:,1]
+
+# keep only the angular bins we want, as an (angle x band x time) array
+data_in = np.transpose(data_in[:,:,np.array(angular_bins) + 2], (2, 0, 1))
+
+# one interpolant per band, covering every angle at once
+interps = {b:interp1d(t_in, data_in[:,i], axis=1, fill_value="extrapolate") for i, b in enumerate(bands_out)}
+dist_mod = 5.0 * (np.log10(dists * 1.0e6) - 1.0)
+
+single = len(angular_bins) == 1 and dists.size == 1 and len(seeds) == 1
+for seed in seeds:
+    rng = np.random.RandomState(seed)
+    ### (angle x distance x time) magnitudes for each band
+    data_out = {}
+    for b in bands_out:
+        npts = args.n
+        if args.GW170817_times:
+            t = get_170817_times(b)
+            npts = t.size
+        else:
+            t = np.exp(rng.uniform(np.log(args.tmin), np.log(args.tmax), npts))
+            t = np.sort(t)
+        mags = interps[b](t)[:,np.newaxis,:] + rng.normal(0.0, args.err, npts) + dist_mod[np.newaxis,:,np.newaxis]
+        data_out[b] = (t, mags)
+    for i, angular_bin in enumerate(angular_bins):
+        for j, dist in enumerate(dists):
+            if single:
+                out_dir = args.out
+            else:
+                out_dir = os.path.join(args.out, "angle{}_dist{:g}_seed{}".format(angular_bin, dist, seed)) + "/"
+                if not os.path.exists(out_dir):
+                    os.makedirs(out_dir)
+            data_dict = {}
+            for b in bands_out:
+                t, mags = data_out[b]
+                out = np.zeros((t.size, 4))
+                out[:,0] = t
+                out[:,2] = mags[i,j]
+                out[:,3] = args.err
+                np.savetxt(out_dir + b + ".txt", out)
+                data_dict[b] = out
+            save_event_data(out_dir, data_dict, source=args.input_sim, angular_bin=angular_bin, distance=dist, seed=seed)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Tabulate a model
+----------------
+Sample any model over a parameter grid or Latin hypercube, at fixed times and
+bands, and store the lightcurves as a table that can be loaded as a new model
+(see em_pe.models.tabulated).
+"""
+from __future__ import print_function
+import argparse
+import os
+import numpy as np
+
+from em_pe.models import model_dict, param_dict, LogUniformPriorParameter, register_tabulated_model, save_table
+
+parser = argparse.ArgumentParser(description="Precompute a table of lightcurves from a model")
+parser.add_argument("--m", help="Name of model to tabulate")
+parser.add_argument("--morph-comp", default="TP2", help="Morphology and composition specification (kn_interp_angle only)")
+parser.add_argument("--name", help="Name of the tabulated model (defaults to [model]_tab)")
+parser.add_argument("--out", help="Filename for table (defaults to [name].npz in $TABLE_LOC)")
+parser.add_argument("--b", action="append", help="Band to tabulate (defaults to all bands of the model)")
+parser.add_argument("--tmin", type=float, default=0.1, help="Minimum time (in days)")
+parser.add_argument("--tmax", type=float, default=30.0, help="Maximum time (in days)")
+parser.add_argument("--n-times", type=int, default=50, help="Number of (log-spaced) time points")
+parser.add_argument("--mode", default="grid", choices=["grid", "lhs"], help="Sample the parameters on a regular grid or a Latin hypercube")
+parser.add_argument("--n-grid", type=int, default=8, help="Number of grid points per parameter (grid mode)")
+parser.add_argument("--n", type=int, default=2000, help="Number of Latin hypercube samples (lhs mode)")
+parser.add_argument("--interpolation", default="linear", choices=["linear", "cubic"], help="Interpolation method for gridded tables")
+parser.add_argument("--set-limit", action="append", nargs=3, help="Modify parameter limits (e.g. --set-limit mej_dyn 0.01 0.03)")
+parser.add_argument("--fixed-param", action="append", nargs=2, help="Parameters with fixed values (not tabulated)")
+parser.add_argument("--n-test", type=int, default=100, help="Number of random points used to estimate the interpolation error")
+parser.add_argument("--batch-size", type=int, default=1000, help="Number of parameter points to evaluate at once")
+args = parser.parse_args()
+
+def _make_model(m):
+    if m in ["kn_interp_angle", "kn_interp_angle_pca"]:
+        return model_dict[m](args.morph_comp)
+    return model_dict[m]()
+
+def evaluate_model(model, names, x, fixed_params, t, bands):
+    '''
+    Evaluate a model for an array of parameter points.
+
+    Parameters
+    ----------
+    model : model_base
+        Model to evaluate
+    names : list
+        Parameter names corresponding to the columns of x
+    x : np.ndarray
+        (n x ndim) array of parameter points
+    fixed_params : dict
+        Dictionary mapping fixed parameter names to their values
+    t : np.ndarray
+        Time values
+    bands : list
+        Bands to evaluate
+
+    Returns
+    -------
+    tuple
+        (n x band x time) arrays of magnitudes and magnitude errors
+    '''
+    n = x.shape[0]
+    mags = np.empty((n, len(bands), t.size))
+    mags_err = np.empty((n, len(bands), t.size))
+    for start in range(0, n, args.batch_size):
+        batch = x[start:start + args.batch_size]
+        params = dict(zip(names, batch.T))
+        for p in fixed_params:
+            params[p] = fixed_params[p] * np.ones(batch.shape[0])
+        if model.vectorized:
+            model.set_params(params, [args.tmin, args.tmax])
+            lcs = model.evaluate_bands({band:t for band in bands})
+            for j, band in enumerate(bands):
+                m, m_err = lcs[band]
+                mags[start:start + batch.shape[0],j] = np.reshape(m, (batch.shape[0], t.size))
+                mags_err[start:start + batch.shape[0],j] = np.broadcast_to(np.reshape(m_err, (-1, t.size)), (batch.shape[0], t.size))
+        else:
+            model.prepare_batch(params)
+            for i in range(batch.shape[0]):
+                model.set_params({p:params[p][i] for p in params}, [args.tmin, args.tmax])
+                lcs = model.evaluate_bands({band:t for band in bands})
+                for j, band in enumerate(bands):
+                    mags[start + i,j], mags_err[start + i,j] = lcs[band]
+        print("  evaluated {} of {} points".format(min(start + args.batch_size, n), n))
+    return mags, mags_err
+
+def _to_table_space(x, log_params):
+    ### tables are built in log space for log-uniform parameters
+    x = np.array(x, dtype=float)
+    x[...,log_params] = np.log10(x[...,log_params])
+    return x
+
+def _from_unit(u, lo, hi, log_params):
+    ### map points in the unit hypercube to the prior box
+    x = lo + u * (hi - lo)
+    x[:,log_params] = 10.0**x[:,log_params]
+    return x
+
+name = args.name if args.name is not None else args.m + "_tab"
+
+### resolve the output file before doing any (expensive) model evaluations
+if args.out is not None:
+    fname = args.out
+elif "TABLE_LOC" in os.environ:
+    fname = os.path.join(os.environ["TABLE_LOC"], name + ".npz")
+else:
+    parser.error("either give --out or set TABLE_LOC")
+if not os.path.isdir(os.path.dirname(os.path.abspath(fname))):
+    parser.error("output directory '" + os.path.dirname(os.path.abspath(fname)) + "' does not exist")
+
+source = _make_model(args.m)
+bands = args.b if args.b is not None else source.bands
+fixed_params = {p:float(value) for [p, value] in args.fixed_param} if args.fixed_param is not None else {}
+limits = {p:(float(llim), float(rlim)) for [p, llim, rlim] in args.set_limit} if args.set_limit is not None else {}
+
+### distance is applied analytically by the tabulated model, so it is not a table dimension
+names = [p for p in source.param_names if p not in fixed_params and p != "distance"]
+params = {p:param_dict[p]() for p in names}
+for p in limits:
+    params[p].update_limits(*limits[p])
+llim = np.array([params[p].llim for p in names])
+rlim = np.array([params[p].rlim for p in names])
+log_params = np.array([isinstance(params[p], LogUniformPriorParameter) for p in names])
+t = np.logspace(np.log10(args.tmin), np.log10(args.tmax), args.n_times)
+
+table = {
+        "name":name,
+        "source":args.m,
+        "mode":args.mode,
+        "interpolation":args.interpolation,
+        "param_names":np.array(names),
+        "log_params":log_params,
+        "llim":llim,
+        "rlim":rlim,
+        "has_distance":("distance" in source.param_names and "distance" not in fixed_params),
+        "times":t,
+        "bands":np.array(bands)
+}
+
+ndim = len(names)
+lo = _to_table_space(llim, log_params)
+hi = _to_table_space(rlim, log_params)
+if args.mode == "grid":
+    ### keep the upper edge just inside the box, since some models treat their upper limits as exclusive
+    u_axis = np.linspace(0.0, np.nextafter(1.0, 0.0), args.n_grid)
+    u = np.stack(np.meshgrid(*[u_axis] * ndim, indexing="ij"), axis=-1).reshape(-1, ndim)
+    x = _from_unit(u, lo, hi, log_params)
+    for i in range(ndim):
+        table["axis_%d" % i] = lo[i] + u_axis * (hi[i] - lo[i])
+else:
+    import pyDOE
+    x = _from_unit(pyDOE.lhs(ndim, samples=args.n), lo, hi, log_params)
+    table["points"] = x
+
+print("Evaluating", args.m, "at", x.shape[0], "points")
+table["mags"], table["mags_err"] = evaluate_model(source, names, x, fixed_params, t, bands)
+table["error_rms"] = np.full(len(bands), np.nan)
+table["error_max"] = np.full(len(bands), np.nan)
+
+save_table(fname, table)
+
+### estimate the interpolation error at random points inside the prior box
+if args.n_test > 0:
+    print("Estimating interpolation error at", args.n_test, "random points")
+    register_tabulated_model(fname)
+    x_test = _from_unit(np.random.uniform(size=(args.n_test, ndim)), lo, hi, log_params)
+    mags_true, _ = evaluate_model(source, names, x_test, fixed_params, t, bands)
+    mags_tab, _ = evaluate_model(model_dict[name](), names, x_test, {}, t, bands)
+    diff = np.abs(mags_tab - mags_true)
+    diff[~np.isfinite(diff)] = np.nan
+    table["error_rms"] = np.sqrt(np.nanmean(diff**2, axis=(0, 2)))
+    table["error_max"] = np.nanmax(diff, axis=(0, 2))
+    for j, band in enumerate(bands):
+        print("  {} band: rms error = {:.4f} mag, max error = {:.4f} mag".format(band, table["error_rms"][j], table["error_max"][j]))
+    save_table(fname, table)
+
+print("Saved table to", fname)